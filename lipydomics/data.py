@@ -8,14 +8,226 @@
 """
 
 
+import os
+import json
+import mmap
+import struct
+import tempfile
+import zipfile
+import warnings
 import numpy as np
 import pickle
 from csv import reader
-from pandas import DataFrame, concat, ExcelWriter
 
 from lipydomics.util import abbreviate_sheet
 
 
+# when the intensities are memory mapped (see Dataset.to_memmap(...)), they are read and written in blocks of feature
+# rows of about this size (in bytes) so that the full matrix never needs to be held in memory
+MMAP_BLOCK_BYTES = 2 ** 26
+
+
+def _csv_data_lines(f):
+    """
+_csv_data_lines
+    description:
+        yields the lines of data from an open dataset .csv file (after any header lines have been read), skipping
+        blank lines and lines starting with '#', same as the pandas C parser with comment='#'
+    parameters:
+        f (file) -- open dataset .csv file
+    yields:
+        (str) -- line of data
+"""
+    for line in f:
+        if line.strip() and not line.startswith('#'):
+            yield line
+
+
+def _read_dataset_csv(dataset_csv, skip_header, dtype, block_rows=None):
+    """
+_read_dataset_csv
+    description:
+        reads the m/z, rt, CCS labels and the intensities from a raw dataset .csv file (see Dataset.__init__(...))
+
+        The file is parsed using the C parser from pandas with an explicit dtype for every column (labels are always
+        float64), which is much faster than numpy.genfromtxt and does not hold onto intermediate Python objects. The
+        number of columns is taken from the first line of data (skipping blank lines and comments, see
+        _csv_data_lines(...)). Missing values become NaN and blank lines and lines starting with '#' are ignored, same
+        as with numpy.genfromtxt. The labels and intensities are returned as views of the parsed columns rather than
+        copies (the arrays are column-major, like the transposed arrays from numpy.genfromtxt(..., unpack=True) were).
+
+        If block_rows is set, the file is parsed block_rows lines at a time and the labels and intensities are
+        yielded for each block instead
+    parameters:
+        dataset_csv (str) -- filename of raw dataset in .csv format
+        skip_header (int) -- number of header lines in the file to skip
+        dtype (numpy.dtype) -- data type for the intensities
+        [block_rows (int)] -- number of lines to parse at a time [optional, default=None]
+    returns:
+        (numpy.ndarray(float), numpy.ndarray(dtype)) -- labels (n_features, 3) and intensities (n_features, n_samples)
+                                                        or a generator of them for each block if block_rows is set
+"""
+    # pandas is only needed here, import it on first use rather than with the module
+    from pandas import read_csv
+
+    with open(dataset_csv, 'r') as f:
+        for _ in range(skip_header):
+            f.readline()
+        n_cols = len(next(_csv_data_lines(f), '').split(','))
+    dtypes = {i: (np.float64 if i < 3 else dtype) for i in range(n_cols)}
+    df = read_csv(dataset_csv, header=None, skiprows=skip_header, usecols=range(n_cols), dtype=dtypes, comment='#',
+                  engine='c', chunksize=block_rows)
+    if block_rows is None:
+        return df.iloc[:, :3].to_numpy(), df.iloc[:, 3:].to_numpy()
+    return ((chunk.iloc[:, :3].to_numpy(), chunk.iloc[:, 3:].to_numpy()) for chunk in df)
+
+
+def _count_dataset_csv(dataset_csv, skip_header):
+    """
+_count_dataset_csv
+    description:
+        counts the features (lines of data) and samples (columns after m/z, rt, CCS) in a raw dataset .csv file
+        without parsing any of the values. Blank lines and lines starting with '#' are not counted (see
+        _csv_data_lines(...)), same as in _read_dataset_csv(...)
+    parameters:
+        dataset_csv (str) -- filename of raw dataset in .csv format
+        skip_header (int) -- number of header lines in the file to skip
+    returns:
+        (int, int) -- number of features and number of samples
+"""
+    n_features, n_samples = 0, None
+    with open(dataset_csv, 'r') as f:
+        for _ in range(skip_header):
+            f.readline()
+        for line in _csv_data_lines(f):
+            if n_samples is None:
+                n_samples = len(line.split(',')) - 3
+            n_features += 1
+    return n_features, n_samples
+
+
+def _write_npy(npy_path, shape, dtype, blocks):
+    """
+_write_npy
+    description:
+        writes blocks of rows into a new .npy file then opens it as a read-only memory map
+    parameters:
+        npy_path (str) -- path of the .npy file to write
+        shape (tuple(int)) -- shape of the full array
+        dtype (numpy.dtype) -- data type of the array
+        blocks (iterable(numpy.ndarray)) -- consecutive blocks of rows that make up the full array
+    returns:
+        (numpy.memmap) -- the array, memory mapped in read-only mode
+"""
+    out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=shape)
+    i = 0
+    for block in blocks:
+        out[i:i + len(block)] = block
+        i += len(block)
+    if i != shape[0]:
+        m = '_write_npy: expected {} rows but got {} rows'
+        raise ValueError(m.format(shape[0], i))
+    out.flush()
+    del out
+    return np.load(npy_path, mmap_mode='r')
+
+
+# version of the file format written by Dataset.save_bin(...)
+BIN_FORMAT_VERSION = 1
+
+# instance variables of Dataset that are stored in the manifest or as arrays by Dataset.save_bin(...), anything else
+# (e.g. fitted models like Dataset.pca3_) gets pickled separately and instance variables starting with '_' are not saved
+_BIN_MANIFEST_FIELDS = ['csv', 'esi_mode', 'n_features', 'n_samples', 'group_indices', 'feat_ids', 'feat_id_levels',
+                        'feat_id_scores']
+_BIN_ARRAY_FIELDS = ['labels', 'intensities', 'normed_intensities', 'ext_var']
+# instance variables of Dataset that are specific to where it is running and are not saved at all: the arrays in a
+# reloaded Dataset are not memory mapped from the .npy files in mmap_dir (which may not exist on another machine)
+_UNSAVED_FIELDS = ['mmap_dir']
+
+
+def _json_default(obj):
+    """
+_json_default
+    description:
+        converts numpy scalars and arrays into plain Python objects for json.dump(...)
+    parameters:
+        obj (object) -- object that json can not serialize on its own
+    returns:
+        (object) -- serializable object
+"""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError('_json_default: object of type {} is not JSON serializable'.format(type(obj)))
+
+
+def _zip_write_npy(zf, name, array):
+    """
+_zip_write_npy
+    description:
+        writes an array into an uncompressed zip archive entry in .npy format. The entry's local header is padded (with
+        an extra field) so that the array data starts on a 64 byte boundary within the archive, that way it can be
+        memory mapped without copying (see _zip_read_npy(...))
+    parameters:
+        zf (zipfile.ZipFile) -- zip archive, opened for writing with ZIP_STORED
+        name (str) -- name of the entry
+        array (numpy.ndarray) -- array to write
+"""
+    zinfo = zipfile.ZipInfo(name)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    # local header: 30 bytes + name + padding extra field + zip64 extra field (20 bytes, forced below) then the .npy
+    # header, which numpy already pads to a multiple of 64 bytes
+    pad = -(zf.fp.tell() + 30 + len(name.encode('utf-8')) + 20) % 64
+    if pad:
+        pad += 64 if pad < 4 else 0
+        zinfo.extra = struct.pack('<HH', 0x6c64, pad - 4) + bytes(pad - 4)
+    with zf.open(zinfo, mode='w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def _zip_read_npy(f, buf, zinfo):
+    """
+_zip_read_npy
+    description:
+        gets an array from an uncompressed zip archive entry in .npy format as a read-only view of the memory mapped
+        archive, no data is copied or read until it gets used
+    parameters:
+        f (file) -- the archive file, opened in binary mode
+        buf (mmap.mmap) -- the archive file, memory mapped in read-only mode
+        zinfo (zipfile.ZipInfo) -- the archive entry
+    returns:
+        (numpy.ndarray) -- the array
+"""
+    # the entry data starts after the local header, which has variable length name and extra fields
+    n_name, n_extra = struct.unpack('<HH', buf[zinfo.header_offset + 26:zinfo.header_offset + 30])
+    f.seek(zinfo.header_offset + 30 + n_name + n_extra)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    count = int(np.prod(shape))
+    if count == 0:
+        return np.empty(shape, dtype=dtype)
+    array = np.frombuffer(buf, dtype=dtype, count=count, offset=f.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def _zip_read_pickle(buf, zinfo):
+    """
+_zip_read_pickle
+    description:
+        unpickles an object from an uncompressed zip archive entry
+    parameters:
+        buf (mmap.mmap) -- the archive file, memory mapped in read-only mode
+        zinfo (zipfile.ZipInfo) -- the archive entry
+    returns:
+        (object) -- the unpickled object
+"""
+    n_name, n_extra = struct.unpack('<HH', buf[zinfo.header_offset + 26:zinfo.header_offset + 30])
+    start = zinfo.header_offset + 30 + n_name + n_extra
+    return pickle.loads(buf[start:start + zinfo.file_size])
+
+
 class Dataset:
     """
 Dataset
@@ -23,31 +235,59 @@ Dataset
         A class for encapsulating a lipidomics dataset, with functions for loading and storing the data
 """
 
-    def __init__(self, dataset_csv, skip_header=1, esi_mode=None):
+    # directory holding the .npy files backing memory mapped intensities (None if the intensities are in memory), set
+    # at the class level so that Datasets pickled before this existed still have it
+    mmap_dir = None
+
+    # cache of data and summary statistics for each group (see Dataset._group_block(...) and
+    # Dataset.get_group_stats(...)), created on first use and cleared whenever the intensities or group assignments
+    # change, it is never saved or pickled
+    _group_cache = None
+
+    def __init__(self, dataset_csv, skip_header=1, esi_mode=None, dtype=np.float64, mmap_dir=None):
         """
 Dataset.__init__
     description:
         Loads a dataset from .csv file
 
-        Uses numpy.genfromtxt to load in a raw dataset, stored in .csv format. Stores two numpy.ndarrays containing
-        the labels (self.labels):
+        Uses the C parser from pandas (see _read_dataset_csv(...)) to load in a raw dataset, stored in .csv format.
+        Stores two numpy.ndarrays containing the labels (self.labels):
             [[mz, rt, ccs], ... ] shape = (n_features, 3)
         and raw intensities (self.intensities):
             [[i0, i1, ... ], ... ] shape = (n_features, n_samples)
         Expects the input data file to be a .csv structured with the following columns:
             mz, rt, ccs, i_1, i_2, ..., i_n
         By default, 1 header line is skipped
+        The labels are always stored as float64, the intensities can be stored as float32 instead (dtype=np.float32)
+        to halve the memory used by large datasets
+        If mmap_dir is set, the intensities are streamed from the .csv file into a .npy file in that directory and
+        memory mapped rather than loaded into memory (see Dataset.to_memmap(...))
     parameters:
         dataset_csv (str) -- filename of raw dataset in .csv format
-        [skip_header (int)] -- number of header lines in the file to skip when loading data, passed on to 
-                                np.genfromtxt [optional, default=1]
+        [skip_header (int)] -- number of header lines in the file to skip when loading data [optional, default=1]
         [esi_mode (str)] -- electrospray ionization mode, can be used for identification, either 'neg', 'pos' or None
                             for unspecified [optional, default=None]
+        [dtype (numpy.dtype)] -- data type for the intensities, np.float64 or np.float32 [optional, default=np.float64]
+        [mmap_dir (str)] -- directory to store memory mapped intensities in [optional, default=None]
 """
         # store the name of the .csv file 
         self.csv = dataset_csv
-        mz, rt, ccs, *intensities = np.genfromtxt(dataset_csv, delimiter=',', unpack=True, skip_header=skip_header)
-        self.labels, self.intensities = np.array([mz, rt, ccs]).T, np.array(intensities).T
+        if mmap_dir is None:
+            self.labels, self.intensities = _read_dataset_csv(dataset_csv, skip_header, dtype)
+        else:
+            self.mmap_dir = mmap_dir
+            n_features, n_samples = _count_dataset_csv(dataset_csv, skip_header)
+            block_rows = max(1, MMAP_BLOCK_BYTES // (np.dtype(dtype).itemsize * (n_samples + 3)))
+            labels = []
+
+            def intensity_blocks():
+                # the labels are small, keep them in memory as the intensities get written out
+                for lbls, ints in _read_dataset_csv(dataset_csv, skip_header, dtype, block_rows=block_rows):
+                    labels.append(lbls)
+                    yield ints
+
+            self.intensities = self._new_npy('intensities', (n_features, n_samples), dtype, intensity_blocks())
+            self.labels = np.concatenate(labels)
         # identifications can be added later
         self.feat_ids, self.feat_id_levels, self.feat_id_scores = None, None, None
         # store the number of features and samples in convenient instance variables
@@ -65,35 +305,216 @@ Dataset.__init__
         self.ext_var = None
 
 
+    def __getattr__(self, name):
+        """
+Dataset.__getattr__
+    description:
+        only gets called for instance variables that are not set. Instance variables that were pickled separately by
+        Dataset.save_bin(...) (e.g. fitted models like Dataset.pca3_) are not unpickled by Dataset.load_bin(...) until
+        they are first accessed, which happens here.
+    parameters:
+        name (str) -- name of the instance variable
+    returns:
+        (object) -- the instance variable
+"""
+        lazy = self.__dict__.get('_lazy_attrs')
+        if lazy and name in lazy:
+            value = _zip_read_pickle(*lazy.pop(name))
+            setattr(self, name, value)
+            return value
+        raise AttributeError("'Dataset' object has no attribute '{}'".format(name))
+
+
+    def __getstate__(self):
+        """
+Dataset.__getstate__
+    description:
+        gets the state of this Dataset instance for pickling, any instance variables that have not been unpickled yet
+        from a file saved by Dataset.save_bin(...) are unpickled first (the memory mapped file can not be pickled) and
+        transient instance variables (starting with '_') are left out. Memory mapped intensities are pickled as regular
+        arrays, so mmap_dir is left out as well.
+    returns:
+        (dict) -- state of this Dataset instance
+"""
+        for name in list(self.__dict__.get('_lazy_attrs', {})):
+            getattr(self, name)
+        # instance variables starting with '_' (like the group cache) are transient
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_') and k not in _UNSAVED_FIELDS}
+
+
     @staticmethod
     def load_bin(bin_path):
         """
 Dataset.load_bin
     description:
-        Loads a Dataset instance from a serialized binary file (.pickle)
+        Loads a Dataset instance from a binary file saved by Dataset.save_bin(...)
+
+        The file is memory mapped and the arrays (labels, intensities, normalized intensities, statistics) are read-only
+        views into it, so nothing is actually read from disk until it gets used and opening a large Dataset to look at
+        a single statistic is fast. Other instance variables that were pickled separately (e.g. fitted models like
+        Dataset.pca3_) are unpickled when they are first accessed. Datasets saved by older versions of lipydomics
+        (pickled Dataset instances) are also supported.
+
+        A Dataset that was using memory mapped intensities (see Dataset.to_memmap(...)) is not memory mapped from
+        its mmap_dir once reloaded (mmap_dir is not saved), use Dataset.to_memmap(...) again if needed.
 
         This is a static method, so rather than using a Dataset instance, the uninitialized class is used e.g. :
             from lipydomics.data import Dataset
             dset = Dataset.load_bin('saved_dataset.pickle')
     parameters:
-        bin_path (str) -- path to the serialized binary file
+        bin_path (str) -- path to the binary file
     returns:
         (Dataset) -- the dataset instance
 """
-        with open(bin_path, 'rb') as pf:
-            return pickle.load(pf)
+        if not zipfile.is_zipfile(bin_path):
+            # older versions of lipydomics just pickled the whole Dataset
+            with open(bin_path, 'rb') as pf:
+                return pickle.load(pf)
+        with zipfile.ZipFile(bin_path, 'r') as zf, open(bin_path, 'rb') as f:
+            manifest = json.loads(zf.read('manifest.json').decode('utf-8'))
+            if manifest.get('format') != 'lipydomics.Dataset' or manifest.get('version', 0) > BIN_FORMAT_VERSION:
+                m = 'Dataset: load_bin: unsupported file format in {} (format: {}, version: {})'
+                raise ValueError(m.format(bin_path, manifest.get('format'), manifest.get('version')))
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            dset = Dataset.__new__(Dataset)
+            for name in _BIN_MANIFEST_FIELDS:
+                setattr(dset, name, manifest[name])
+            for name in _BIN_ARRAY_FIELDS:
+                entry = manifest['arrays'].get(name)
+                setattr(dset, name, _zip_read_npy(f, buf, zf.getinfo(entry)) if entry else None)
+            dset.stats = {label: _zip_read_npy(f, buf, zf.getinfo(entry))
+                          for label, entry in manifest['stats'].items()}
+            dset.rt_calibration = None
+            if manifest['rt_calibration'] is not None:
+                from lipydomics.identification.rt_calibration import RTCalibration
+                rtc = manifest['rt_calibration']
+                dset.rt_calibration = RTCalibration(rtc['lipids'], rtc['meas_rt'], rtc['ref_rt'])
+            dset._lazy_attrs = {name: (buf, zf.getinfo(entry)) for name, entry in manifest['pickled'].items()}
+        return dset
 
 
     def save_bin(self, bin_path):
         """
 Dataset.save_bin
     description:
-        Saves this Dataset instance into a serialized binary format (.pickle) that can be reloaded again later
+        Saves this Dataset instance into a binary file that can be reloaded again later with Dataset.load_bin(...)
+
+        The file is an uncompressed zip archive containing:
+            manifest.json -- format version, metadata (csv, esi_mode, group assignments, identifications, retention
+                             time calibration, ...) and the archive entries for everything else
+            arrays/{name}.npy -- labels, intensities, normalized intensities, and external variable in .npy format
+            stats/{i}.npy -- each of the entries in Dataset.stats in .npy format
+            pickled/{name}.pickle -- any other instance variables (e.g. fitted models like Dataset.pca3_)
+        The .npy data in the archive is aligned so that it can be memory mapped when loaded. The archive is written to
+        a temporary file then moved into place, so a Dataset that was loaded from bin_path can be saved back to it.
+    parameters:
+        bin_path (str) -- path to save the binary file under
+"""
+        rtc = self.rt_calibration
+        manifest = {
+            'format': 'lipydomics.Dataset',
+            'version': BIN_FORMAT_VERSION,
+            'rt_calibration': None if rtc is None else {'lipids': rtc.lipids, 'meas_rt': rtc.meas_rt,
+                                                        'ref_rt': rtc.ref_rt},
+            'arrays': {},
+            'stats': {},
+            'pickled': {}
+        }
+        for name in _BIN_MANIFEST_FIELDS:
+            manifest[name] = getattr(self, name)
+        # make sure that any instance variables that have not been unpickled yet get saved too
+        for name in list(self.__dict__.get('_lazy_attrs', {})):
+            getattr(self, name)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(bin_path)))
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name in _BIN_ARRAY_FIELDS:
+                    x = getattr(self, name)
+                    if x is not None:
+                        manifest['arrays'][name] = 'arrays/{}.npy'.format(name)
+                        _zip_write_npy(zf, manifest['arrays'][name], np.asarray(x))
+                for i, label in enumerate(self.stats):
+                    manifest['stats'][label] = 'stats/{}.npy'.format(i)
+                    _zip_write_npy(zf, manifest['stats'][label], np.asarray(self.stats[label]))
+                known = set(_BIN_MANIFEST_FIELDS + _BIN_ARRAY_FIELDS + _UNSAVED_FIELDS + ['stats', 'rt_calibration'])
+                for name, value in self.__dict__.items():
+                    if name not in known and not name.startswith('_'):
+                        manifest['pickled'][name] = 'pickled/{}.pickle'.format(name)
+                        zf.writestr(manifest['pickled'][name], pickle.dumps(value))
+                zf.writestr('manifest.json', json.dumps(manifest, default=_json_default))
+            os.replace(tmp_path, bin_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+    def _new_npy(self, name, shape, dtype, blocks):
+        """
+Dataset._new_npy
+    description:
+        writes blocks of feature rows into a new .npy file in self.mmap_dir and opens it as a read-only memory map. A
+        new file is written every time (so existing memory maps of the old data are never overwritten) and the file
+        that was previously backing self.<name> is removed
+    parameters:
+        name (str) -- name of the instance variable the array is for ('intensities' or 'normed_intensities')
+        shape (tuple(int)) -- shape of the full array
+        dtype (numpy.dtype) -- data type of the array
+        blocks (iterable(numpy.ndarray)) -- consecutive blocks of feature rows that make up the full array
+    returns:
+        (numpy.memmap) -- the array, memory mapped in read-only mode
+"""
+        os.makedirs(self.mmap_dir, exist_ok=True)
+        fd, npy_path = tempfile.mkstemp(suffix='.npy', prefix=name + '_', dir=self.mmap_dir)
+        os.close(fd)
+        array = _write_npy(npy_path, shape, dtype, blocks)
+        old = getattr(self, name, None)
+        if isinstance(old, np.memmap) and old.filename and os.path.dirname(old.filename) == \
+                os.path.abspath(self.mmap_dir):
+            try:
+                os.remove(old.filename)
+            except OSError:
+                # the file can not be removed while it is still mapped on some platforms, just leave it
+                pass
+        return array
+
+
+    def feature_blocks(self):
+        """
+Dataset.feature_blocks
+    description:
+        yields slices that split the features (rows of the intensities) into blocks. When the intensities are memory
+        mapped, each block is about MMAP_BLOCK_BYTES in size so that computations done one block at a time do not need
+        the whole matrix in memory. Otherwise, there is just a single block with all of the features.
+    yields:
+        (slice) -- slice of feature rows
+"""
+        if self.mmap_dir is None:
+            yield slice(None)
+        else:
+            block_rows = max(1, MMAP_BLOCK_BYTES // (self.intensities.dtype.itemsize * max(self.n_samples, 1)))
+            for i in range(0, self.n_features, block_rows):
+                yield slice(i, i + block_rows)
+
+
+    def to_memmap(self, mmap_dir):
+        """
+Dataset.to_memmap
+    description:
+        Moves the intensities (and normalized intensities if present) out of memory and into .npy files in mmap_dir,
+        which are then memory mapped in read-only mode. Dataset methods (get_data_bygroup, normalize, drop_features)
+        and the statistics in lipydomics.stats that are computed per feature work on memory mapped intensities one
+        block of features at a time, writing new .npy files when the intensities change.
+        Datasets can also be loaded straight into memory mapped storage using the mmap_dir kwarg of Dataset.__init__
     parameters:
-        bin_path (str) -- path to save the serialized binary file under
+        mmap_dir (str) -- directory to store the .npy files in
 """
-        with open(bin_path, 'wb') as pf:
-            pickle.dump(self, pf)
+        self.mmap_dir = mmap_dir
+        self._clear_group_cache()
+        for name in ['intensities', 'normed_intensities']:
+            x = getattr(self, name)
+            if x is not None:
+                setattr(self, name, self._new_npy(name, x.shape, x.dtype, (x[s] for s in self.feature_blocks())))
 
 
     def assign_groups(self, group_indices):
@@ -122,6 +543,7 @@ Dataset.assign_groups
         # add all of the user-defined groupings
         for group_name in group_indices:
             self.group_indices[group_name] = group_indices[group_name]
+        self._clear_group_cache()
 
 
     def assign_groups_with_replicates(self, groups, n_replicates):
@@ -147,16 +569,71 @@ Dataset.assign_groups_with_replicates
         self.assign_groups(group_indices)
 
 
-    def get_data_bygroup(self, group_names, normed=False):
+    def _group_block(self, group_name, normed):
+        """
+Dataset._group_block
+    description:
+        gets the (read-only) intensities for the sample columns belonging to a single group, for all features. If the
+        group's sample columns are a contiguous range then this is just a view of the intensities. Otherwise, the
+        columns are copied out once and cached until the intensities are replaced by a different array or group
+        assignments change, so repeated calls (e.g. computing several statistics on the same groups) do not copy the
+        data again. Writing into the intensities in place is not detected, the cached block would be stale. Blocks are
+        not cached when the intensities are memory mapped, that would load them into memory.
+    parameters:
+        group_name (str) -- group name
+        normed (bool) -- use normalized (True) or raw (False) intensities
+    returns:
+        (np.ndarray) -- array of intensities for the group, shape = (n_features, group_size)
+"""
+        intensities = self.normed_intensities if normed else self.intensities
+        idx = self.group_indices[group_name]
+        if len(idx) > 0 and list(idx) == list(range(idx[0], idx[0] + len(idx))) and idx[0] >= 0:
+            block = intensities[:, idx[0]:idx[0] + len(idx)]
+            block.setflags(write=False)
+            return block
+        if self.mmap_dir is not None:
+            return intensities[:, idx]
+        if self._group_cache is None:
+            self._group_cache = {}
+        key = ('data', group_name, normed)
+        cached = self._group_cache.get(key)
+        # make sure that the cached block is still for the same intensities and group indices
+        if cached is None or cached[0] is not intensities or cached[1] != list(idx):
+            block = intensities[:, idx]
+            block.setflags(write=False)
+            cached = self._group_cache[key] = (intensities, list(idx), block)
+        return cached[2]
+
+
+    def _clear_group_cache(self):
+        """
+Dataset._clear_group_cache
+    description:
+        clears any data and statistics cached for groups (see Dataset._group_block(...) and
+        Dataset.get_group_stats(...)), this needs to be called whenever the intensities or group assignments change
+"""
+        self._group_cache = None
+
+
+    def get_data_bygroup(self, group_names, normed=False, features=None):
         """
 Dataset.get_data_bygroup
     description:
         Returns a subset (or multiple subsets) of the dataset as defined by group names. The group indices must be 
         defined ahead of time. Normalized data can be fetched if normalize() was called ahead of time.
+        The returned arrays are read-only, they are either views of the intensities (when the group's sample columns
+        are contiguous) or copies that are cached for later calls (see Dataset._group_block(...)). The cached copies
+        are only updated when the intensities are replaced (e.g. by normalize(...) or drop_features(...)) or groups are
+        reassigned, so modify self.intensities or self.normed_intensities by assigning a new array rather than
+        writing into the existing one in place (which would not be reflected in the cached copies).
+        The data can be restricted to a subset of features (e.g. one of the blocks from self.feature_blocks()), which
+        avoids reading all of the features when the intensities are memory mapped
     parameters:
         group_names (str OR list(str)) -- a single group name or list of group names to retrieve intensity data for
         [normed (bool)] -- if True, return the normalized intensities (requires that self.normalize(...) be called 
                             ahead of time), otherwise return the raw intensities [optional, default=False]
+        [features (slice)] -- only return data for this slice of features, None for all features 
+                                [optional, default=None]
     returns:
         (np.ndarray) -- array of intensities for sample columns belonging to the specified group, shape = 
                         (n_features, group_size). multiple arrays will be returned if multiple group names were 
@@ -172,25 +649,83 @@ Dataset.get_data_bygroup
             if group_names not in self.group_indices:
                 e = "Dataset: get_data_bygroup: group name '{}' not defined in self.groups".format(group_names)
                 raise ValueError(e)
-            if normed:
-                return self.normed_intensities[:, self.group_indices[group_names]]
-            else:
-                return self.intensities[:, self.group_indices[group_names]]
+            if features is None:
+                return self._group_block(group_names, normed)
+            intensities = self.normed_intensities if normed else self.intensities
+            return intensities[features][:, self.group_indices[group_names]]
         elif type(group_names) == list:
             for name in group_names:
                 if name not in self.group_indices:
                     e = "Dataset: get_data_bygroup: group name '{}' not defined in self.groups".format(name)
                     raise ValueError(e)
-            if normed:
-                return (self.normed_intensities[:, self.group_indices[name]] for name in group_names)
-            else:
-                return (self.intensities[:, self.group_indices[name]] for name in group_names)
+            if features is None:
+                return (self._group_block(name, normed) for name in group_names)
+            intensities = self.normed_intensities if normed else self.intensities
+            return (intensities[features][:, self.group_indices[name]] for name in group_names)
         else:
             e = "Dataset: get_data_bygroup: group_names should be either str or list "
             e += "(got type: {})".format(type(group_names))
             raise TypeError(e)
 
 
+    def get_group_stats(self, group_name, normed=False):
+        """
+Dataset.get_group_stats
+    description:
+        Returns per-feature summary statistics for the samples in a single group: the number of samples, and the sum,
+        sum of squares, mean, variance (ddof=1), minimum, and maximum of the intensities for each feature. These are
+        computed together (one block of features at a time if the intensities are memory mapped, so each block is
+        read from disk only once) then cached until the intensities are replaced by a different array or group
+        assignments change. Writing into the intensities in place is not detected, the cached statistics would be
+        stale (assign a new array instead). The statistics in lipydomics.stats that compare groups (ANOVA,
+        log2(fold-change), t-tests) are all derived from these, so computing several statistics or comparing many
+        pairs of groups only computes the summary statistics for each group once.
+    parameters:
+        group_name (str) -- group name
+        [normed (bool)] -- if True, use the normalized intensities (requires that self.normalize(...) be called ahead
+                            of time), otherwise use the raw intensities [optional, default=False]
+    returns:
+        (dict(str:...)) -- summary statistics: 'n' (int), 'sum', 'sumsq', 'mean', 'var', 'min', 'max' (read-only
+                            np.ndarray, shape = (n_features,))
+"""
+        if not self.group_indices:
+            e = "Dataset: get_group_stats: groups not defined"
+            raise ValueError(e)
+        if group_name not in self.group_indices:
+            e = "Dataset: get_group_stats: group name '{}' not defined in self.groups".format(group_name)
+            raise ValueError(e)
+        if normed and self.normed_intensities is None:
+            e = "Dataset: get_group_stats: normed set to True but self.normed_intensities not defined"
+            raise ValueError(e)
+        intensities = self.normed_intensities if normed else self.intensities
+        idx = list(self.group_indices[group_name])
+        if self._group_cache is None:
+            self._group_cache = {}
+        key = ('stats', group_name, normed)
+        cached = self._group_cache.get(key)
+        # make sure that the cached statistics are still for the same intensities and group indices
+        if cached is not None and cached[0] is intensities and cached[1] == idx:
+            return cached[2]
+
+        if self.mmap_dir is None:
+            blocks = [self._group_block(group_name, normed)]
+        else:
+            blocks = (self.get_data_bygroup(group_name, normed=normed, features=s) for s in self.feature_blocks())
+        parts = []
+        with warnings.catch_warnings():
+            # the variance of a single sample is NaN and raises a warning
+            warnings.simplefilter("ignore")
+            for x in blocks:
+                parts.append((np.sum(x, axis=1), np.einsum('ij,ij->i', x, x), np.mean(x, axis=1),
+                              np.var(x, axis=1, ddof=1), np.min(x, axis=1), np.max(x, axis=1)))
+        stats = {'n': len(idx)}
+        for name, values in zip(['sum', 'sumsq', 'mean', 'var', 'min', 'max'], zip(*parts)):
+            stats[name] = np.concatenate(values)
+            stats[name].setflags(write=False)
+        self._group_cache[key] = (intensities, idx, stats)
+        return stats
+
+
     def normalize(self, norm_weights):
         """
 Dataset.normalize
@@ -209,7 +744,13 @@ Dataset.normalize
             e += "{} but should have shape: ({},)".format(norm_weights.shape, self.n_samples)
             raise ValueError(e)
         # apply normalization
-        self.normed_intensities = np.multiply(self.intensities, norm_weights)
+        self._clear_group_cache()
+        if self.mmap_dir is None:
+            self.normed_intensities = np.multiply(self.intensities, norm_weights)
+        else:
+            dtype = np.result_type(self.intensities, norm_weights)
+            blocks = (np.multiply(self.intensities[s], norm_weights) for s in self.feature_blocks())
+            self.normed_intensities = self._new_npy('normed_intensities', self.intensities.shape, dtype, blocks)
 
 
     def __repr__(self):
@@ -306,6 +847,9 @@ Dataset.export_xlsx
     parameters:
         xlsx_path (str) -- path to save the spreadsheet under
 """
+        # pandas is only needed here, import it on first use rather than with the module
+        from pandas import DataFrame, concat, ExcelWriter
+
         # create a pandas DataFrame
         label_df = DataFrame(self.labels)
         int_df = DataFrame(self.intensities)
@@ -388,9 +932,19 @@ Dataset.drop_features_helper
             raise ValueError(m.format(target.shape, self.n_features))
 
         # first drop features from the intensities matrix (and normalized intensities if present)
-        self.intensities = self.intensities[target]
-        if self.normed_intensities is not None:
-            self.normed_intensities = self.normed_intensities[target]
+        self._clear_group_cache()
+        if self.mmap_dir is None:
+            self.intensities = self.intensities[target]
+            if self.normed_intensities is not None:
+                self.normed_intensities = self.normed_intensities[target]
+        else:
+            # write the kept features into new memory mapped arrays, one block at a time
+            n_kept = int(np.sum(target))
+            for name in ['intensities', 'normed_intensities']:
+                x = getattr(self, name)
+                if x is not None:
+                    blocks = (x[s][target[s]] for s in self.feature_blocks())
+                    setattr(self, name, self._new_npy(name, (n_kept, x.shape[1]), x.dtype, blocks))
 
         # drop features from the labels
         self.labels = self.labels[target]
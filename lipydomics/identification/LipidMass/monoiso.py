@@ -8,6 +8,66 @@
 """
 
 
+import re
+
+
+# reference dictionary for adduct charges
+adduct_to_z = {
+    '[M]+': 1,
+    '[M+H]+': 1,
+    '[M+Na]+': 1,
+    '[M+K]+': 1,
+    '[M+2K]2+': 2,
+    '[M+NH4]+': 1,
+    '[M+H-H2O]+': 1,
+    '[M-H]-': -1,
+    '[M+HCOO]-': -1,
+    '[M+CH3COO]-': -1,
+    '[M-2H]2-': -2,
+    '[M-3H]3-': -3,
+    '[M+Cl]-': -1,
+    '[M+2Na-H]+': 1,
+    '[M+2H]2+': 2,
+    '[M+3H]3+': 3
+}
+
+
+# reference dictionary for converting atoms to monoisotopic masses with high precision
+a_to_m = {
+    'H': 1.007825,
+    'C': 12.,
+    'N': 14.003074,
+    'O': 15.994915,
+    'F': 18.998403,
+    'Na': 22.989770,
+    'P': 30.973763,
+    'S': 31.972072,
+    'Cl': 34.968853,
+    'K': 38.963708
+}
+
+
+# reference dictionary for converting MS adducts to monoisotopic masses with high precision
+adduct_to_m = {
+    '[M]+': {},
+    '[M+H]+': {'H': 1},
+    '[M+Na]+': {'Na': 1},
+    '[M+K]+': {'K': 1},
+    '[M+2K]2+': {'K': 2},
+    '[M+NH4]+': {'N': 1, 'H': 4},
+    '[M+H-H2O]+': {'H': -1, 'O': -1},
+    '[M-H]-': {'H': -1},
+    '[M+HCOO]-': {'H': 1, 'C': 1, 'O': 2},
+    '[M+CH3COO]-': {'H': 3, 'C': 2, 'O': 2},
+    '[M-2H]2-': {'H': -2},
+    '[M-3H]3-': {'H': -3},
+    '[M+Cl]-': {'Cl': 1},
+    '[M+2Na-H]+': {'H': -1, 'Na': 2},
+    '[M+2H]2+': {'H': 2},
+    '[M+3H]3+': {'H': 3}
+}
+
+
 def atomic_mass(atom):
     """
 atomic_mass
@@ -19,19 +79,6 @@ atomic_mass
     returns:
         (float) -- high precision atomic mass 
 """
-    # reference dictionary for converting atoms to monoisotopic masses with high precision
-    a_to_m = {
-        'H': 1.007825,
-        'C': 12.,
-        'N': 14.003074,
-        'O': 15.994915,
-        'F': 18.998403,
-        'Na': 22.989770,
-        'P': 30.973763,
-        'S': 31.972072,
-        'Cl': 34.968853,
-        'K': 38.963708
-    }
     if atom not in a_to_m:
         raise ValueError('atomic_mass: atom id {} not available in a_to_m'.format(atom))
     return a_to_m[atom]
@@ -64,44 +111,27 @@ Lipid.ms_adduct_mass
     returns:
         (float) -- adduct monoisotopic m/z
 """
-    # reference dictionary for converting MS adducts to monoisotopic masses with high precision
-    adduct_to_m = {
-        '[M]+': {},
-        '[M+H]+': {'H': 1},
-        '[M+Na]+': {'Na': 1},
-        '[M+K]+': {'K': 1},
-        '[M+2K]2+': {'K': 2},
-        '[M+NH4]+': {'N': 1, 'H': 4},
-        '[M+H-H2O]+': {'H': -1, 'O': -1},
-        '[M-H]-': {'H': -1},
-        '[M+HCOO]-': {'H': 1, 'C': 1, 'O': 2},
-        '[M+CH3COO]-': {'H': 3, 'C': 2, 'O': 2},
-        '[M-2H]2-': {'H': -2},
-        '[M-3H]3-': {'H': -3},
-        '[M+Cl]-': {'Cl': 1},
-        '[M+2Na-H]+': {'H': -1, 'Na': 2},
-        '[M+2H]2+': {'H': 2},
-        '[M+3H]3+': {'H': 3}
-    }
     if adduct not in adduct_to_m:
         raise ValueError('ms_adduct_mass: MS adduct {} not available in adduct_to_m'.format(adduct))
-    # reference dictionary for adduct charges
-    adduct_to_z = {
-        '[M]+': 1,
-        '[M+H]+': 1,
-        '[M+Na]+': 1,
-        '[M+K]+': 1,
-        '[M+2K]2+': 2,
-        '[M+NH4]+': 1,
-        '[M+H-H2O]+': 1,
-        '[M-H]-': -1,
-        '[M+HCOO]-': -1,
-        '[M+CH3COO]-': -1,
-        '[M-2H]2-': -2, 
-        '[M-3H]3-': -3,
-        '[M+Cl]-': -1,
-        '[M+2Na-H]+': 1,
-        '[M+2H]2+': 2,
-        '[M+3H]3+': 3
-    }
     return (formula_mass(adduct_to_m[adduct]) + neutral_mass) / abs(adduct_to_z[adduct])
+
+
+def adduct_charge(adduct):
+    """
+adduct_charge
+    description:
+        Returns the charge of an MS adduct. Adducts that are not in the adduct_to_z reference dictionary (e.g. some of
+        the adducts in the measured reference datasets, like '[M+Na-H2O]+') have their charge parsed from the end of
+        the adduct string instead, i.e. ']2+' -> 2, ']-' -> -1
+    parameters:
+        adduct (str) -- MS adduct
+    returns:
+        (int) -- adduct charge
+"""
+    if adduct in adduct_to_z:
+        return adduct_to_z[adduct]
+    parsed = re.search(r'\](\d*)([+-])$', adduct)
+    if parsed is None:
+        raise ValueError('adduct_charge: unable to determine charge of MS adduct {}'.format(adduct))
+    n, sign = parsed.groups()
+    return (int(n) if n else 1) * (1 if sign == '+' else -1)
@@ -10,26 +10,117 @@
 
 from sqlite3 import connect
 import os
-import pickle
-
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from numpy import argsort, array
 
 from lipydomics.identification.id_levels import (
     id_feat_any, id_feat_meas_mz_rt_ccs, id_feat_pred_mz_rt_ccs, id_feat_meas_mz_rt, id_feat_pred_mz_rt,
-    id_feat_meas_mz_ccs, id_feat_pred_mz_ccs, id_feat_meas_mz, id_feat_pred_mz, id_feat_custom
+    id_feat_meas_mz_ccs, id_feat_pred_mz_ccs, id_feat_meas_mz, id_feat_pred_mz, id_feat_custom, any_levels,
+    any_levels_no_rt
 )
+from lipydomics.identification.batch_id import batch_id_levels
+from lipydomics.identification.candidate_index import get_candidate_index, db_signature
+from lipydomics.identification.id_cache import IdCache
 from lipydomics.identification.encoder_params import (
     ccs_lipid_classes, ccs_ms_adducts, ccs_fa_mods, rt_lipid_classes, rt_fa_mods
 )
-from lipydomics.identification.train_lipid_ccs_pred import (
-    prep_encoders as ccs_prep_encoders, featurize as ccs_featurize
-)
 from lipydomics.identification.mz_generation import get_lipid_mz
-from lipydomics.identification.train_lipid_rt_pred import (
-    prep_encoders as rt_prep_encoders, featurize as rt_featurize
-)
+from lipydomics.identification.predictors import CCSPredictor, RTPredictor, get_ccs_predictor, get_rt_predictor
+
+
+# size of the memory map used by the worker processes' connections to the lipid database (256 MB, larger than the db)
+_mmap_size = 268435456
+
+
+def _id_features(cursor, features, level, esi, norm, use_rt, engine):
+    """
+_id_features
+    description:
+        makes identifications for a list of features using either the 'feature' or 'batch' engine (see
+        add_feature_ids(...) for details)
+    parameters:
+        cursor (sqlite3.Cursor) -- cursor for querying lipids.db
+        features (list(tuple(float))) -- m/z, rt, CCS, and the m/z, rt, and CCS tolerances for each feature
+        level (str or list(str)) -- identification level, list of identification levels, or 'any'
+        esi (str) -- filter results by ionization mode: 'neg', 'pos', or None for unspecified
+        norm (str) -- specify l1 or l2 norm for computing scores
+        use_rt (bool) -- whether to use identification levels that involve retention time
+        engine (str) -- 'feature' or 'batch'
+    returns:
+        (list(tuple(list(str) or str, str, list(float)))) -- putative identification(s) (or '' for no matches),
+                                                                identification level, and scores for each feature
+"""
+    if engine == 'batch':
+        # resolve each identification level for all features at once
+        return batch_id_levels(_resolve_levels(level, use_rt), cursor, features, esi, norm=norm)
+
+    # available identification functions
+    id_funcs = {
+        'any': id_feat_any,
+        'meas_mz_rt_ccs': id_feat_meas_mz_rt_ccs,
+        'pred_mz_rt_ccs': id_feat_pred_mz_rt_ccs,
+        'meas_mz_rt': id_feat_meas_mz_rt,
+        'pred_mz_rt': id_feat_pred_mz_rt,
+        'meas_mz_ccs': id_feat_meas_mz_ccs,
+        'pred_mz_ccs': id_feat_pred_mz_ccs,
+        'meas_mz': id_feat_meas_mz,
+        'pred_mz': id_feat_pred_mz
+    }
+    results = []
+    for mz, rt, ccs, *tol in features:
+        if type(level) is list:
+            # use custom list of identification levels
+            results.append(id_feat_custom(level, cursor, mz, rt, ccs, *tol, esi, norm=norm))
+        elif level == 'any' and not use_rt:
+            # use any identification level that does not include retention time
+            results.append(id_funcs['any'](cursor, mz, rt, ccs, *tol, esi, norm=norm, use_rt=False))
+        else:
+            results.append(id_funcs[level](cursor, mz, rt, ccs, *tol, esi, norm=norm))
+    return results
+
+
+def _id_features_worker(db_path, features, level, esi, norm, use_rt, engine):
+    """
+_id_features_worker
+    description:
+        runs _id_features(...) on a chunk of features in a worker process, with its own read-only connection to the
+        lipid database (opened as immutable and memory-mapped since it is never modified while making identifications)
+    parameters:
+        db_path (str) -- path to the lipid database
+        (see _id_features(...) for the rest)
+    returns:
+        (list(tuple(list(str) or str, str, list(float)))) -- putative identification(s) (or '' for no matches),
+                                                                identification level, and scores for each feature
+"""
+    con = connect('{}?mode=ro&immutable=1'.format(Path(db_path).resolve().as_uri()), uri=True)
+    cur = con.cursor()
+    cur.execute('PRAGMA mmap_size={}'.format(_mmap_size))
+    results = _id_features(cur, features, level, esi, norm, use_rt, engine)
+    con.close()
+    return results
+
+
+def _resolve_levels(level, use_rt):
+    """
+_resolve_levels
+    description:
+        converts the `level` param of add_feature_ids(...) into the list of identification levels to attempt (in order)
+    parameters:
+        level (str or list(str)) -- identification level, list of identification levels, or 'any'
+        use_rt (bool) -- whether to use identification levels that involve retention time
+    returns:
+        (list(str)) -- identification levels
+"""
+    if type(level) is list:
+        return level
+    elif level == 'any':
+        return any_levels if use_rt else any_levels_no_rt
+    return [level]
 
 
-def add_feature_ids(dataset, tol, level='any', norm='l2', mz_tol_type='Da', db_version_tstamp=None, use_rt=True):
+def add_feature_ids(dataset, tol, level='any', norm='l2', mz_tol_type='Da', db_version_tstamp=None, use_rt=True,
+                    engine='feature', n_jobs=1, cache=None):
     """
 add_feature_ids
     description:
@@ -86,6 +177,21 @@ add_feature_ids
                                              default (most recent build) [optional, default=None]
         [use_rt (bool)] -- whether to use identification levels that involve retention time, ignored unless used with
                             the 'any' identification level [optional, default=True]
+        [engine (str)] -- 'feature' to query the database separately for each feature, 'batch' to load all of the
+                            features into a temporary table and resolve each identification level for every feature
+                            with a single query, or 'numpy' to search an in-memory index of the database (built once
+                            per database version and cached in builds/) without any queries. All produce identical
+                            results but 'batch' and 'numpy' are much faster for datasets with many features
+                            [optional, default='feature']
+        [n_jobs (int)] -- number of worker processes to split the features between (in contiguous chunks), or -1 to
+                            use all available CPUs. Each worker has its own read-only connection to the lipid
+                            database, and the results are identical to those from a single process. Only used with
+                            the 'feature' and 'batch' engines [optional, default=1]
+        [cache (lipydomics.identification.id_cache.IdCache or None)] -- if provided, identification results are
+                                                                        looked up in (and added to) this persistent
+                                                                        cache so that only features that have not
+                                                                        been seen before with the same parameters are
+                                                                        identified [optional, default=None]
 """
     if level not in ['pred_mz', 'pred_mz_ccs', 'pred_mz_rt_ccs', 'meas_mz_ccs', 'meas_mz_rt_ccs', 'any',
                      'meas_mz', 'meas_mz_rt', 'pred_mz_rt'] and type(level) is not list:
@@ -105,27 +211,21 @@ add_feature_ids
         m = 'add_feature_ids: mz_tol_type must be either "Da" or "ppm" (was: "{}")'.format(mz_tol_type)
         raise ValueError(m)
 
-    # available identification functions
-    id_funcs = {
-        'any': id_feat_any,
-        'meas_mz_rt_ccs': id_feat_meas_mz_rt_ccs,
-        'pred_mz_rt_ccs': id_feat_pred_mz_rt_ccs,
-        'meas_mz_rt': id_feat_meas_mz_rt,
-        'pred_mz_rt': id_feat_pred_mz_rt,
-        'meas_mz_ccs': id_feat_meas_mz_ccs,
-        'pred_mz_ccs': id_feat_pred_mz_ccs,
-        'meas_mz': id_feat_meas_mz,
-        'pred_mz': id_feat_pred_mz
-    }
+    if engine not in ['feature', 'batch', 'numpy']:
+        m = 'add_feature_ids: engine must be "feature", "batch", or "numpy" (was: "{}")'.format(engine)
+        raise ValueError(m)
+
+    if type(n_jobs) is not int or (n_jobs < 1 and n_jobs != -1):
+        m = 'add_feature_ids: n_jobs must be a positive integer or -1 (was: {})'.format(n_jobs)
+        raise ValueError(m)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
 
     # ESI mode from Dataset
     esi = dataset.esi_mode
 
-    # initialize connection to lipids.db (stored within the lipydomics package)
-    con = connect(db_path)
-    cur = con.cursor()
-
-    feat_ids, feat_id_levels, feat_id_scores = [], [], []
+    # assemble the query values and (absolute) tolerances for each feature
+    features = []
     for mz, rt, ccs in dataset.labels:
 
         mzt, rtt, ccst = tol
@@ -140,25 +240,52 @@ add_feature_ids
         if mz_tol_type == 'ppm':
             mzt = mzt * mz / 1000000.
 
-        tol2 = [mzt, rtt, ccst]
+        features.append((mz, rt, ccs, mzt, rtt, ccst))
 
-        # try to get identification(s)
-        if type(level) is list:
-            # use custom list of identification levels
-            feat_id, feat_id_level, feat_id_score = id_feat_custom(level, cur, mz, rt, ccs, *tol2, esi, norm=norm)
+    # look up any previous results in the cache, only the features that are not found need to be identified
+    if cache is not None:
+        db_version = '{}_{}'.format(db_version_tstamp, db_signature(db_path))
+        ctx = cache.context(db_version, _resolve_levels(level, use_rt), norm, mz_tol_type, tol, esi,
+                            dataset.rt_calibration is not None)
+        results = cache.get(ctx, features)
+        todo = [i for i, res in enumerate(results) if res is None]
+    else:
+        results, todo = [None for _ in features], list(range(len(features)))
+    todo_features = [features[i] for i in todo]
+
+    # try to get identification(s)
+    if not todo_features:
+        new_results = []
+    elif engine == 'numpy':
+        index = get_candidate_index(db_path, db_version_tstamp)
+        new_results = index.identify(_resolve_levels(level, use_rt), todo_features, esi, norm=norm)
+    elif n_jobs > 1 and len(todo_features) > 1:
+        # split the features into contiguous chunks, one per worker, then merge the results back in order
+        chunk = -(-len(todo_features) // n_jobs)
+        chunks = [todo_features[i:i + chunk] for i in range(0, len(todo_features), chunk)]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(_id_features_worker, db_path, c, level, esi, norm, use_rt, engine)
+                       for c in chunks]
+            new_results = [result for future in futures for result in future.result()]
+    else:
+        # initialize connection to lipids.db (stored within the lipydomics package)
+        con = connect(db_path)
+        new_results = _id_features(con.cursor(), todo_features, level, esi, norm, use_rt, engine)
+        # close the database connection
+        con.close()
 
-        elif level == 'any' and not use_rt:
-            # use any identification level that does not include retention time
-            feat_id, feat_id_level, feat_id_score = id_funcs['any'](cur, mz, rt, ccs, *tol2, esi,
-                                                                    norm=norm, use_rt=False)
-        else:
-            feat_id, feat_id_level, feat_id_score = id_funcs[level](cur, mz, rt, ccs, *tol2, esi, norm=norm)
+    for i, res in zip(todo, new_results):
+        results[i] = res
+    if cache is not None and todo_features:
+        cache.put(ctx, todo_features, new_results)
 
+    feat_ids, feat_id_levels, feat_id_scores = [], [], []
+    for (mz, rt, ccs, *_), (feat_id, feat_id_level, feat_id_score) in zip(features, results):
         if feat_id:
             if len(feat_id) > 1:
                 # sort feat_id and feat_id_score in order of descending score
-                feat_id, feat_id_score = [list(x) for x in zip(*sorted(zip(feat_id, feat_id_score), 
-                                                                       key=lambda pair: pair[1], reverse=True))]
+                order = argsort(-array(feat_id_score), kind='stable')
+                feat_id, feat_id_score = [feat_id[i] for i in order], [feat_id_score[i] for i in order]
             feat_ids.append(feat_id)
             feat_id_levels.append(feat_id_level)
             feat_id_scores.append(feat_id_score)
@@ -174,8 +301,46 @@ add_feature_ids
     dataset.feat_id_levels = feat_id_levels
     dataset.feat_id_scores = feat_id_scores
 
-    # close the database connection
-    con.close()
+
+def _ccs_encoding_errors(lipid_class, adduct, fa_mod):
+    """
+_ccs_encoding_errors
+    description:
+        checks whether the lipid class, MS adduct and FA modifier of a lipid are encodable by the CCS prediction model
+    parameters:
+        lipid_class (str) -- lipid class
+        adduct (str) -- MS adduct
+        fa_mod (None or str) -- fatty acid modifier
+    returns:
+        (str) -- description of the encoding errors, empty if there are none
+"""
+    m = ''
+    if lipid_class not in ccs_lipid_classes:
+        m += 'lipid class "{}" not encodable '.format(lipid_class)
+    if adduct not in ccs_ms_adducts:
+        m += 'MS adduct "{}" not encodable '.format(adduct)
+    if not (fa_mod is None or fa_mod in ccs_fa_mods):
+        m += 'FA modifier "{}" not encodable '.format(fa_mod)
+    return m
+
+
+def _rt_encoding_errors(lipid_class, fa_mod):
+    """
+_rt_encoding_errors
+    description:
+        checks whether the lipid class and FA modifier of a lipid are encodable by the retention time prediction model
+    parameters:
+        lipid_class (str) -- lipid class
+        fa_mod (None or str) -- fatty acid modifier
+    returns:
+        (str) -- description of the encoding errors, empty if there are none
+"""
+    m = ''
+    if lipid_class not in ccs_lipid_classes:
+        m += 'lipid class "{}" not encodable '.format(lipid_class)
+    if not (fa_mod is None or fa_mod in ccs_fa_mods):
+        m += 'FA modifier "{}" not encodable '.format(fa_mod)
+    return m
 
 
 def predict_ccs(lipid_class, lipid_nc, lipid_nu, adduct, mz='generate', fa_mod=None, ignore_encoding_errors=False):
@@ -200,18 +365,8 @@ predict_ccs
         (float) -- predicted CCS
 """
     # first check whether the lipid class, MS adduct and FA mod are encodable
-    lc_ok = lipid_class in ccs_lipid_classes
-    ad_ok = adduct in ccs_ms_adducts
-    fm_ok = fa_mod is None or fa_mod in ccs_fa_mods
-    all_ok = lc_ok and ad_ok and fm_ok
-    if not (all_ok or ignore_encoding_errors):  # either all of the checks were good or we are ignoring errors
-        m = ''
-        if not lc_ok:
-            m += 'lipid class "{}" not encodable '.format(lipid_class)
-        if not ad_ok:
-            m += 'MS adduct "{}" not encodable '.format(adduct)
-        if not fm_ok:
-            m += 'FA modifier "{}" not encodable '.format(fa_mod)
+    m = _ccs_encoding_errors(lipid_class, adduct, fa_mod)
+    if m and not ignore_encoding_errors:  # either all of the checks were good or we are ignoring errors
         raise ValueError('predict_ccs: {}'.format(m))
 
     # try to generate an m/z value if one wasn't provided
@@ -223,20 +378,53 @@ predict_ccs
             m = m.format(lipid_class, '' if fa_mod is None else fa_mod, lipid_nc, lipid_nu, adduct, ve)
             raise ValueError(m)
 
-    # prepare encoders
-    c_encoder, f_encoder, a_encoder = ccs_prep_encoders()
+    # featurize, scale, and predict CCS
+    return get_ccs_predictor().predict([lipid_class], [lipid_nc], [lipid_nu], [fa_mod], [adduct], [mz])[0]
 
-    # load the predictive model and the scaler
-    this_dir = os.path.dirname(__file__)
-    model_path = os.path.join(this_dir, 'lipid_ccs_pred.pickle')
-    scaler_path = os.path.join(this_dir, 'lipid_ccs_scale.pickle')
-    with open(model_path, 'rb') as pf1, open(scaler_path, 'rb') as pf2:
-        model = pickle.load(pf1)
-        scaler = pickle.load(pf2)
 
-    # featurize, scale, and predict CCS
-    x = [ccs_featurize(lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz, c_encoder, f_encoder, a_encoder)]
-    return model.predict(scaler.transform(x))[0]
+def predict_ccs_batch(lipid_classes, lipid_ncs, lipid_nus, adducts, mzs='generate', fa_mods=None,
+                      ignore_encoding_errors=False):
+    """
+predict_ccs_batch
+    description:
+        Predicts CCS for an array of lipids at once, using a shared predictor (the encoders, model, and scaler are
+        only loaded the first time). The predictions are exactly the same as calling predict_ccs(...) on each lipid.
+    parameters:
+        lipid_classes (list(str)) -- lipid classes
+        lipid_ncs (list(int)) -- sum compositions, number of fatty acid carbons
+        lipid_nus (list(int)) -- sum compositions, number of fatty acid unsaturations
+        adducts (list(str)) -- MS adducts
+        [mzs (str or list(float or str))] -- m/z of each MS adduct (or 'generate'), or 'generate' to generate m/z
+                                                values for all lipids automatically using LipidMass
+                                                [optional, default='generate']
+        [fa_mods (None or list(None or str))] -- fatty acid modifiers, or None for no modifiers [optional, default=None]
+        [ignore_encoding_errors (bool)] -- generate predictions even if one or more of the input parameters are not
+                                            encodable [optional, default=False]
+    returns:
+        (numpy.ndarray(float)) -- predicted CCS values
+"""
+    n = len(lipid_classes)
+    mzs = ['generate' for _ in range(n)] if type(mzs) is str else list(mzs)
+    fa_mods = [None for _ in range(n)] if fa_mods is None else list(fa_mods)
+    if not (len(lipid_ncs) == len(lipid_nus) == len(adducts) == len(mzs) == len(fa_mods) == n):
+        m = 'predict_ccs_batch: all lipid parameters must have the same length'
+        raise ValueError(m)
+
+    for i, (lc, lnc, lnu, add, mz, fam) in enumerate(zip(lipid_classes, lipid_ncs, lipid_nus, adducts, mzs, fa_mods)):
+        # check whether the lipid class, MS adduct and FA mod are encodable
+        m = _ccs_encoding_errors(lc, add, fam)
+        if m and not ignore_encoding_errors:
+            raise ValueError('predict_ccs_batch: lipid {}: {}'.format(i, m))
+        # try to generate an m/z value if one wasn't provided
+        if mz == 'generate':
+            try:
+                mzs[i] = get_lipid_mz(lc, lnc, lnu, add, fa_mod=fam)
+            except ValueError as ve:
+                m = 'predict_ccs_batch: unable to generate m/z for lipid: "{}({}{}:{})_{}" ({})'
+                m = m.format(lc, '' if fam is None else fam, lnc, lnu, add, ve)
+                raise ValueError(m)
+
+    return get_ccs_predictor().predict(lipid_classes, lipid_ncs, lipid_nus, fa_mods, adducts, mzs)
 
 
 def predict_rt(lipid_class, lipid_nc, lipid_nu, fa_mod=None, ignore_encoding_errors=False):
@@ -258,31 +446,44 @@ predict_ccs
         (float) -- predicted HILIC retention time
 """
     # first check whether the lipid class and FA mod are encodable
-    lc_ok = lipid_class in ccs_lipid_classes
-    fm_ok = fa_mod is None or fa_mod in ccs_fa_mods
-    all_ok = lc_ok and fm_ok
-    if not (all_ok or ignore_encoding_errors):  # either all of the checks were good or we are ignoring errors
-        m = ''
-        if not lc_ok:
-            m += 'lipid class "{}" not encodable '.format(lipid_class)
-        if not fm_ok:
-            m += 'FA modifier "{}" not encodable '.format(fa_mod)
+    m = _rt_encoding_errors(lipid_class, fa_mod)
+    if m and not ignore_encoding_errors:  # either all of the checks were good or we are ignoring errors
         raise ValueError('predict_rt: {}'.format(m))
 
-    # prepare encoders
-    c_encoder, f_encoder = rt_prep_encoders()
+    # featurize, scale, and predict RT
+    return get_rt_predictor().predict([lipid_class], [lipid_nc], [lipid_nu], [fa_mod])[0]
 
-    # load the predictive model and the scaler
-    this_dir = os.path.dirname(__file__)
-    model_path = os.path.join(this_dir, 'lipid_rt_pred.pickle')
-    scaler_path = os.path.join(this_dir, 'lipid_rt_scale.pickle')
-    with open(model_path, 'rb') as pf1, open(scaler_path, 'rb') as pf2:
-        model = pickle.load(pf1)
-        scaler = pickle.load(pf2)
 
-    # featurize, scale, and predict RT
-    x = [rt_featurize(lipid_class, lipid_nc, lipid_nu, fa_mod, c_encoder, f_encoder)]
-    return model.predict(scaler.transform(x))[0]
+def predict_rt_batch(lipid_classes, lipid_ncs, lipid_nus, fa_mods=None, ignore_encoding_errors=False):
+    """
+predict_rt_batch
+    description:
+        Predicts HILIC retention times for an array of lipids at once, using a shared predictor (the encoders, model,
+        and scaler are only loaded the first time). The predictions are exactly the same as calling predict_rt(...) on
+        each lipid.
+    parameters:
+        lipid_classes (list(str)) -- lipid classes
+        lipid_ncs (list(int)) -- sum compositions, number of fatty acid carbons
+        lipid_nus (list(int)) -- sum compositions, number of fatty acid unsaturations
+        [fa_mods (None or list(None or str))] -- fatty acid modifiers, or None for no modifiers [optional, default=None]
+        [ignore_encoding_errors (bool)] -- generate predictions even if one or more of the input parameters are not
+                                            encodable [optional, default=False]
+    returns:
+        (numpy.ndarray(float)) -- predicted HILIC retention times
+"""
+    n = len(lipid_classes)
+    fa_mods = [None for _ in range(n)] if fa_mods is None else list(fa_mods)
+    if not (len(lipid_ncs) == len(lipid_nus) == len(fa_mods) == n):
+        m = 'predict_rt_batch: all lipid parameters must have the same length'
+        raise ValueError(m)
+
+    for i, (lc, fam) in enumerate(zip(lipid_classes, fa_mods)):
+        # check whether the lipid class and FA mod are encodable
+        m = _rt_encoding_errors(lc, fam)
+        if m and not ignore_encoding_errors:
+            raise ValueError('predict_rt_batch: lipid {}: {}'.format(i, m))
+
+    return get_rt_predictor().predict(lipid_classes, lipid_ncs, lipid_nus, fa_mods)
 
 
 def remove_potential_nonlipids(dataset, bounds=(10., -10.)):
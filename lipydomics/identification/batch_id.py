@@ -0,0 +1,95 @@
+"""
+    lipydomics/identification/batch_id.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        Set-based (batch) version of the identification levels defined in id_levels.py. Instead of querying the
+        database once per feature, all of the feature search windows are loaded into a temporary table and the
+        candidates within the m/z tolerance of every feature are fetched with a single range join on each of the
+        reference tables, then the identification levels are assigned with id_levels.tiered_id(...). The results are
+        exactly the same as those produced by the per-feature functions in id_levels.py
+"""
+
+
+from itertools import groupby
+from operator import itemgetter
+
+from lipydomics.identification.id_levels import level_defs, tiered_id
+
+
+def mz_window_query(src, esi_mode):
+    """
+mz_window_query
+    description:
+        builds the query that joins a reference table against all of the feature search windows stored in the
+        temporary `batch_feats` table, matching on m/z only
+
+        The reference table is scanned once and for each reference m/z, the (indexed) lower bounds of the feature m/z
+        windows are searched within the maximum window width (query parameter), which keeps the range join from
+        degrading into a full cross product. Results are ordered by feature then by reference identifier which
+        matches the order the per-feature queries return them in.
+    parameters:
+        src (str) -- reference table, 'measured' or 'predicted'
+        esi_mode (str) -- filter results by ionization mode: 'neg', 'pos', or None for unspecified
+    returns:
+        (str) -- query string, takes a single parameter: the maximum m/z window width
+"""
+    qry = 'SELECT f.i, m.name, m.adduct, m.mz, m.rt, m.ccs FROM {} AS m CROSS JOIN temp.batch_feats AS f '.format(src)
+    qry += 'WHERE f.mz_min BETWEEN m.mz - ? AND m.mz AND m.mz <= f.mz_max'
+    if esi_mode == 'pos':
+        qry += ' AND m.charge > 0'
+    elif esi_mode == 'neg':
+        qry += ' AND m.charge < 0'
+    return qry + ' ORDER BY f.i, m.{}'.format('m_id' if src == 'measured' else 't_id')
+
+
+def batch_id_levels(levels, cursor, features, esi_mode, norm='l2'):
+    """
+batch_id_levels
+    description:
+        Identifies all features using a list of identification levels, which are attempted in the order they are
+        provided. The candidates for all features are fetched using a single query on each of the reference tables.
+        This produces the same results as calling id_levels.id_feat_custom(...) on each feature individually.
+    parameters:
+        levels (list(str)) -- list of identification levels to try, will be attempted in the order they are provided
+        cursor (sqlite3.Cursor) -- cursor for querying lipids.db
+        features (list(tuple(float))) -- m/z, rt, CCS, and the m/z, rt, and CCS tolerances for each feature
+        esi_mode (str) -- filter results by ionization mode: 'neg', 'pos', or None for unspecified
+        [norm (str)] -- specify l1 or l2 norm for computing scores [optional, default='l2']
+    returns:
+        (list(tuple(list(str) or str, str, list(float)))) -- putative identification(s) (or '' for no matches),
+                                                                identification level, and scores for each feature
+"""
+    # check that the identification levels are defined
+    for lvl in levels:
+        if lvl == 'any':
+            m = 'batch_id_levels: the special "any" ID level is invalid in a custom ID level list'
+            raise ValueError(m)
+        elif lvl not in level_defs:
+            m = 'batch_id_levels: identification level "{}" is not defined'
+            raise ValueError(m.format(lvl))
+
+    if not features:
+        return []
+
+    # load all of the feature m/z search windows into a temporary table
+    cursor.execute('DROP TABLE IF EXISTS temp.batch_feats')
+    cursor.execute('CREATE TEMP TABLE batch_feats (i INTEGER PRIMARY KEY, mz_min REAL, mz_max REAL)')
+    qdata = [(i, mz - tol_mz, mz + tol_mz) for i, (mz, _, _, tol_mz, _, _) in enumerate(features)]
+    cursor.executemany('INSERT INTO temp.batch_feats VALUES (?,?,?)', qdata)
+    cursor.execute('CREATE INDEX temp.batch_feats_mz_min ON batch_feats (mz_min)')
+    # widest m/z window (with a little slack for rounding) bounds the index search in the range join
+    max_width = max([mz_max - mz_min for _, mz_min, mz_max in qdata]) * 1.000001 + 0.000001
+
+    # candidates within the m/z tolerance of each feature, from each of the required reference tables
+    candidates = [{} for _ in features]
+    for src in set([level_defs[lvl][0] for lvl in levels]):
+        for cands in candidates:
+            cands[src] = []
+        rows = cursor.execute(mz_window_query(src, esi_mode), (max_width,)).fetchall()
+        for i, grp in groupby(rows, key=itemgetter(0)):
+            candidates[i][src] = [row[1:] for row in grp]
+    cursor.execute('DROP TABLE temp.batch_feats')
+
+    return [tiered_id(levels, cands, *feat, norm=norm) for cands, feat in zip(candidates, features)]
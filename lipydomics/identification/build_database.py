@@ -5,21 +5,232 @@
 
         Replaces the old shell script used for building a new lipids database. Main method runs all of the individual
         build scripts.
+
+        The build stages form a small dependency graph (see get_stages()). Stages whose dependencies have finished run
+        concurrently on a process pool (see --jobs). Stages that run on the pool only read from the database (using
+        their own read-only connections) and return the rows for their output tables. The main process is the single
+        writer: it inserts the rows returned by each stage and runs the stages that modify the database directly.
+        During the build the database uses write-ahead logging, so the stages can keep reading while rows are written.
+
+        Builds are incremental: each build stage records a hash of its inputs (source files, build parameters, and the
+        data it reads from the database) in the build_stages table. When rebuilding, the database from the previous
+        build (builds/lipids_<tstamp>.db) is used as the starting point and any stages whose inputs have not changed
+        are skipped, reusing their artifacts (tables, models and plots) from the previous build.
 """
 
 
 import os
+import glob
 import shutil
+import hashlib
+import argparse
+from functools import partial
+from io import StringIO
+from time import perf_counter
 from sqlite3 import connect
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from ..util import gen_tstamp, print_and_log
+from .db_table_defs import measured, theo_mz, theo_ccs, theo_rt, measured_rtree, build_stages, bulk_load_pragmas
+from .build_params import include_ref_dsets, ccs_pred_ref_dsets
+from .encoder_params import ccs_lipid_classes, ccs_fa_mods, ccs_ms_adducts, rt_lipid_classes, rt_fa_mods
+from .fill_measured_from_src import src_dataset_rows, src_metadata
+from .fill_theo_mz_from_gen import enumerated_mz_rows
+from .train_lipid_ccs_pred import train_new_model as train_ccs_model, predicted_ccs_rows
+from .characterize_lipid_ccs_pred import characterize as charac_ccs_pred
+from .train_lipid_rt_pred import train_new_model as train_rt_model, predicted_rt_rows
+from .characterize_lipid_rt_pred import characterize as charac_rt_pred
+from .index_database import add_predicted, add_indexes
+
+
+def fill_from_src(cursor, bl):
+    """ build stage: rows for the measured table from the reference datasets """
+    print_and_log("\nadding cleaned datasets into lipids.db", bl)
+    rows = []
+    for dset in include_ref_dsets:
+        print_and_log("\tadding dataset: {} ...".format(dset), bl, end=" ")
+        t0, n = perf_counter(), len(rows)
+        rows += src_dataset_rows(dset, src_metadata[dset], gid_start=len(rows))
+        n = len(rows) - n
+        print_and_log("ok ({} rows, {:.0f} rows/s)".format(n, n / (perf_counter() - t0)), bl)
+    print_and_log("", bl)  # add a blank line
+    return {'measured': rows}
+
+
+def gen_theo_mz(cursor, bl):
+    """ build stage: rows for the predicted_mz table from the enumerated lipids """
+    print_and_log('generating predicted m/z ...', bl, end=' ')
+    t0 = perf_counter()
+    rows = [row for batch in enumerated_mz_rows() for row in batch]
+    print_and_log('ok ({} rows, {:.0f} rows/s)\n'.format(len(rows), len(rows) / (perf_counter() - t0)), bl)
+    return {'predicted_mz': rows}
+
+
+def train_ccs_pred(cursor, bl):
+    """ build stage: trains the CCS model, returns rows for the predicted_ccs table """
+    print_and_log('training new predictive CCS model (and input scaler) ...', bl)
+    model, scaler = train_ccs_model(cursor, 'svr', bl)
+    print_and_log('... ok', bl)
+    print_and_log('\npredicting CCS ...', bl, end=' ')
+    t0 = perf_counter()
+    rows = [row for chunk in predicted_ccs_rows(cursor, model, scaler) for row in chunk]
+    print_and_log('ok ({} rows, {:.0f} rows/s)\n'.format(len(rows), len(rows) / (perf_counter() - t0)), bl)
+    return {'predicted_ccs': rows}
+
+
+def train_rt_pred(cursor, bl):
+    """ build stage: trains the RT model, returns rows for the predicted_rt table """
+    print_and_log('training new predictive RT model (and input scaler) ...', bl)
+    model, scaler = train_rt_model(cursor, bl)
+    print_and_log('... ok', bl)
+    print_and_log('\npredicting RT ...', bl, end=' ')
+    t0 = perf_counter()
+    rows = [row for chunk in predicted_rt_rows(cursor, model, scaler) for row in chunk]
+    print_and_log('ok ({} rows, {:.0f} rows/s)\n'.format(len(rows), len(rows) / (perf_counter() - t0)), bl)
+    return {'predicted_rt': rows}
 
-from ..util import gen_tstamp
-from .db_table_defs import measured, theo_mz, theo_ccs, theo_rt
-from .fill_measured_from_src import main as fill_from_src
-from .fill_theo_mz_from_gen import main as gen_theo_mz
-from .train_lipid_ccs_pred import main as train_ccs_pred
-from .characterize_lipid_ccs_pred import main as charac_ccs_pred
-from .train_lipid_rt_pred import main as train_rt_pred
-from .characterize_lipid_rt_pred import main as charac_rt_pred
+
+def index_db(cursor, bl):
+    """ build stage (writer): combines the predicted values and adds indexes once all of the tables are filled """
+    print_and_log('adding combined predicted values into lipids.db ...', bl, end=' ')
+    add_predicted(cursor)
+    print_and_log('ok\n', bl)
+    print_and_log('adding indexes into lipids.db ...', bl, end=' ')
+    add_indexes(cursor)
+    print_and_log('ok\n', bl)
+
+
+def get_stages(jobs=1, characterize=True):
+    """
+get_stages
+    description:
+        defines the build stages and the dependencies between them. Each stage is defined by a dictionary with:
+            'name' -- name of the stage
+            'run' -- build function of the stage, takes a cursor for lipids.db and the build log as arguments
+            'deps' -- names of the stages that must finish before this one can start
+            'writer' -- if True the stage modifies the database directly and is run in the main process, otherwise
+                        it runs on the process pool with a read-only connection and returns a dictionary mapping the
+                        names of its tables to the rows to insert into them
+            'files' -- source files (relative to this directory) that are inputs to the stage
+            'params' -- build parameters that are inputs to the stage
+            'queries' -- queries for the data in the database that are inputs to the stage
+            'tables' -- (name, CREATE TABLE statement) for the tables the stage fills
+            'img_dir' -- directory (relative to this directory) that the stage saves plots into, or None
+    parameters:
+        [jobs (int)] -- total number of worker processes for rendering the characterization plots, split between
+                        the characterization stages since they can run at the same time [optional, default=1]
+        [characterize (bool)] -- include the (CCS and RT prediction performance) characterization stages
+                                    [optional, default=True]
+    returns:
+        (list(dict(...))) -- build stages
+"""
+    mz_gen_files = ['mz_generation.py', 'fill_theo_mz_from_gen.py', '../util.py'] + \
+        sorted([os.path.relpath(_, os.path.dirname(__file__)) for _ in
+                glob.glob(os.path.join(os.path.dirname(__file__), 'LipidMass', '**', '*.py'), recursive=True)])
+    ccs_train_qry = 'SELECT lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz, ccs FROM measured WHERE src_tag IN ' \
+                    + '({}) ORDER BY m_id'.format(','.join(['"{}"'.format(_) for _ in ccs_pred_ref_dsets]))
+    rt_train_qry = 'SELECT lipid_class, lipid_nc, lipid_nu, fa_mod, rt FROM measured WHERE rt IS NOT NULL ORDER BY m_id'
+    pred_mz_qry = 'SELECT * FROM predicted_mz ORDER BY t_id'
+    # the CCS and RT characterization stages can run at the same time (see run_stages(...)), so they split the
+    # worker processes for rendering plots between them instead of each starting its own pool of jobs processes
+    charac_jobs = max(1, jobs // 2)
+    stages = [
+        {
+            'name': 'fill_measured_from_src', 'run': fill_from_src, 'deps': [], 'writer': False,
+            'files': ['fill_measured_from_src.py', 'LipidMass/monoiso.py', '../util.py']
+                     + ['reference_data/{}.json'.format(_) for _ in include_ref_dsets],
+            'params': [include_ref_dsets], 'queries': [],
+            'tables': [('measured', measured)], 'img_dir': None
+        },
+        {
+            'name': 'fill_theo_mz_from_gen', 'run': gen_theo_mz, 'deps': [], 'writer': False,
+            'files': mz_gen_files, 'params': [], 'queries': [],
+            'tables': [('predicted_mz', theo_mz)], 'img_dir': None
+        },
+        {
+            'name': 'train_lipid_ccs_pred', 'run': train_ccs_pred, 'writer': False,
+            'deps': ['fill_measured_from_src', 'fill_theo_mz_from_gen'],
+            'files': ['train_lipid_ccs_pred.py', 'encoder_params.py', 'featurization.py', 'compact_models.py',
+                      '../util.py'],
+            'params': [ccs_pred_ref_dsets, ccs_lipid_classes, ccs_fa_mods, ccs_ms_adducts],
+            'queries': [ccs_train_qry, pred_mz_qry],
+            'tables': [('predicted_ccs', theo_ccs)], 'img_dir': None
+        },
+        {
+            'name': 'characterize_lipid_ccs_pred', 'run': partial(charac_ccs_pred, n_jobs=charac_jobs), 'writer': False,
+            'deps': ['train_lipid_ccs_pred'],
+            'files': ['characterize_lipid_ccs_pred.py', 'lipid_ccs_pred.pickle', 'lipid_ccs_scale.pickle'],
+            'params': [],
+            'queries': ['SELECT * FROM measured ORDER BY m_id', 'SELECT * FROM predicted_ccs ORDER BY t_id'],
+            'tables': [], 'img_dir': 'ccs_pred_perf'
+        },
+        {
+            'name': 'train_lipid_rt_pred', 'run': train_rt_pred, 'writer': False,
+            'deps': ['fill_measured_from_src', 'fill_theo_mz_from_gen'],
+            'files': ['train_lipid_rt_pred.py', 'encoder_params.py', 'featurization.py', 'compact_models.py',
+                      '../util.py'],
+            'params': [rt_lipid_classes, rt_fa_mods],
+            'queries': [rt_train_qry, pred_mz_qry],
+            'tables': [('predicted_rt', theo_rt)], 'img_dir': None
+        },
+        {
+            'name': 'characterize_lipid_rt_pred', 'run': partial(charac_rt_pred, n_jobs=charac_jobs), 'writer': False,
+            'deps': ['train_lipid_rt_pred'],
+            'files': ['characterize_lipid_rt_pred.py', 'lipid_rt_pred.pickle', 'lipid_rt_scale.pickle'],
+            'params': [],
+            'queries': ['SELECT * FROM measured ORDER BY m_id', 'SELECT * FROM predicted_rt ORDER BY t_id'],
+            'tables': [], 'img_dir': 'rt_pred_perf'
+        },
+        {
+            'name': 'index_database', 'run': index_db, 'writer': True,
+            'deps': ['train_lipid_ccs_pred', 'train_lipid_rt_pred'],
+            'files': ['index_database.py', 'db_table_defs.py'], 'params': [],
+            'queries': ['SELECT * FROM measured ORDER BY m_id', pred_mz_qry,
+                        'SELECT * FROM predicted_ccs ORDER BY t_id', 'SELECT * FROM predicted_rt ORDER BY t_id'],
+            'tables': [], 'img_dir': None
+        }
+    ]
+    if not characterize:
+        stages = [stage for stage in stages if not stage['name'].startswith('characterize')]
+    return stages
+
+
+def stage_input_hash(stage, cursor):
+    """
+stage_input_hash
+    description:
+        computes a hash of all of the inputs to a build stage: the contents of its source files, its build parameters,
+        and the results of its queries against the (current state of the) database
+    parameters:
+        stage (dict(...)) -- build stage (see get_stages())
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+    returns:
+        (str) -- input hash (hex)
+"""
+    this_dir = os.path.dirname(__file__)
+    h = hashlib.sha256()
+    for fname in stage['files']:
+        h.update(fname.encode())
+        with open(os.path.join(this_dir, fname), 'rb') as f:
+            h.update(f.read())
+    h.update(repr(stage['params']).encode())
+    for qry in stage['queries']:
+        h.update(qry.encode())
+        for row in cursor.execute(qry):
+            h.update(repr(row).encode())
+    return h.hexdigest()
+
+
+def previous_build():
+    """
+previous_build
+    description:
+        finds the database from the most recent build in the builds directory
+    returns:
+        (str or None) -- path to the most recent build of the database, None if there are none
+"""
+    builds = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'builds', 'lipids_*.db')))
+    return builds[-1] if builds else None
 
 
 def remove_old_files():
@@ -32,23 +243,44 @@ def remove_old_files():
 
     # remove all of the CCS and RT prediction performance images
     for d in ['ccs_pred_perf', 'rt_pred_perf']:
-        img_dir = os.path.join(this_dir, d)
-        for img in os.listdir(img_dir):
-            os.remove(os.path.join(img_dir, img))
+        remove_images(d)
+
+
+def remove_images(img_dir):
+    """ removes all of the images from a directory (relative to this directory) """
+    img_dir = os.path.join(os.path.dirname(__file__), img_dir)
+    for img in os.listdir(img_dir):
+        os.remove(os.path.join(img_dir, img))
 
 
 def initialize_db():
-    """ initialize all of the tables in the database """
+    """ initialize all of the tables in the database (the R*Tree table is filled in at the end of the build) """
 
     db_file = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_file)
     cur = con.cursor()
-    for table in [measured, theo_mz, theo_ccs, theo_rt]:
+    for table in [measured, theo_mz, theo_ccs, theo_rt, measured_rtree]:
         cur.execute(table)
     con.commit()
     con.close()
 
 
+def reset_stage_outputs(stage, cursor):
+    """
+reset_stage_outputs
+    description:
+        clears out the outputs from a previous run of a build stage (empties its tables and removes its plots)
+    parameters:
+        stage (dict(...)) -- build stage (see get_stages())
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+"""
+    for name, create in stage['tables']:
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(name))
+        cursor.execute(create)
+    if stage['img_dir'] is not None:
+        remove_images(stage['img_dir'])
+
+
 def make_database_copy(tstamp):
     """ makes a copy of the database and stores it in the builds directory """
     src = os.path.join(os.path.dirname(__file__), 'lipids.db')
@@ -56,22 +288,138 @@ def make_database_copy(tstamp):
     shutil.copy(src, dst)
 
 
-def main(tstamp):
-    """ set up and run all of the individual build scripts """
+def _run_stage(run, db_path):
+    """
+_run_stage
+    description:
+        runs a (non-writer) build stage with a read-only connection to the database, capturing its log messages
+    parameters:
+        run (function) -- build function of the stage
+        db_path (str) -- path to lipids.db
+    returns:
+        (dict(str:list(tuple)), str, float) -- rows for each output table, log messages, and run time (s)
+"""
+    t0 = perf_counter()
+    con = connect('file:{}?mode=ro'.format(os.path.abspath(db_path)), uri=True)
+    log = StringIO()
+    outputs = run(con.cursor(), log)
+    con.close()
+    return outputs, log.getvalue(), perf_counter() - t0
+
+
+def run_stages(stages, con, build_log, prev_hashes, tstamp, jobs=1):
+    """
+run_stages
+    description:
+        runs the build stages in dependency order, skipping any stages whose inputs have not changed. Stages run on a
+        process pool as soon as all of their dependencies have finished, the rows they return are inserted by this
+        (the only writing) process. The stage log messages and run times are added to the build log as each stage
+        finishes.
+    parameters:
+        stages (list(dict(...))) -- build stages (see get_stages())
+        con (sqlite3.connection) -- connection to lipids.db
+        build_log (str) -- path to the build log
+        prev_hashes (dict(str:str)) -- input hashes for each stage from the previous build
+        tstamp (str) -- time stamp for this build
+        [jobs (int)] -- maximum number of stages to run at the same time [optional, default=1]
+"""
+    db_path = con.execute('PRAGMA database_list').fetchone()[2]
+    cur = con.cursor()
+    pending, running, done = list(stages), {}, set()
 
-    # get rid of old files
-    remove_old_files()
+    def finish(stage, input_hash, outputs, log, elapsed):
+        # write the stage outputs (if any) and record the stage input hash
+        t0 = perf_counter()
+        for table, rows in (outputs or {}).items():
+            if rows:
+                cur.executemany('INSERT INTO {} VALUES ({})'.format(table, ','.join('?' * len(rows[0]))), rows)
+        cur.execute('INSERT OR REPLACE INTO build_stages VALUES (?,?,?)', (stage['name'], input_hash, tstamp))
+        con.commit()
+        with open(build_log, 'a') as bl:
+            bl.write(log)
+            print_and_log('{} finished in {:.1f} s (+{:.1f} s writing)\n'.format(stage['name'], elapsed,
+                                                                               perf_counter() - t0), bl)
+        done.add(stage['name'])
 
-    # initialize the database
-    initialize_db()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for stage in [stage for stage in pending if all([dep in done for dep in stage['deps']])]:
+                pending.remove(stage)
+                input_hash = stage_input_hash(stage, cur)
+                if prev_hashes.get(stage['name']) == input_hash:
+                    with open(build_log, 'a') as bl:
+                        print_and_log('skipping {} (inputs unchanged)'.format(stage['name']), bl)
+                    done.add(stage['name'])
+                    continue
+                reset_stage_outputs(stage, cur)
+                con.commit()
+                if stage['writer']:
+                    t0, log = perf_counter(), StringIO()
+                    stage['run'](cur, log)
+                    finish(stage, input_hash, None, log.getvalue(), perf_counter() - t0)
+                else:
+                    running[pool.submit(_run_stage, stage['run'], db_path)] = (stage, input_hash)
+            if not running:
+                if pending and not any([all([dep in done for dep in stage['deps']]) for stage in pending]):
+                    m = 'run_stages: unable to resolve dependencies for stages: {}'
+                    raise ValueError(m.format([stage['name'] for stage in pending]))
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, input_hash = running.pop(future)
+                finish(stage, input_hash, *future.result())
 
-    # run all of the build scripts
-    fill_from_src(tstamp)
-    gen_theo_mz(tstamp)
-    train_ccs_pred(tstamp)
-    charac_ccs_pred(tstamp)
-    train_rt_pred(tstamp)
-    charac_rt_pred(tstamp)
+
+def main(tstamp, full=False, jobs=1, characterize=True):
+    """
+main
+    description:
+        set up and run all of the individual build scripts, skipping any stages whose inputs have not changed since
+        the previous build unless a full rebuild is requested
+    parameters:
+        tstamp (str) -- time stamp for this build
+        [full (bool)] -- rebuild everything from scratch [optional, default=False]
+        [jobs (int)] -- maximum number of build stages (and characterization plots) to run at the same time
+                        [optional, default=1]
+        [characterize (bool)] -- characterize the CCS and RT prediction performance (plots in ccs_pred_perf/ and
+                                    rt_pred_perf/), skip this for faster builds [optional, default=True]
+"""
+    db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
+    prev_db = None if full else previous_build()
+
+    build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
+    with open(build_log, 'w') as bl:
+        if not characterize:
+            print_and_log('skipping characterization (prediction performance plots may be out of date)', bl)
+        if prev_db is None:
+            print_and_log('full build', bl)
+            # get rid of old files and initialize the database
+            remove_old_files()
+            initialize_db()
+        else:
+            # start from the previous build
+            print_and_log('incremental build from: {}'.format(os.path.basename(prev_db)), bl)
+            shutil.copy(prev_db, db_path)
+
+    con = connect(db_path)
+    cur = con.cursor()
+    for pragma in bulk_load_pragmas:
+        cur.execute(pragma)
+    # write-ahead logging lets the stages running on the process pool read while rows are being written
+    cur.execute('PRAGMA journal_mode = WAL')
+    cur.execute(build_stages)
+    prev_hashes = dict(cur.execute('SELECT stage, input_hash FROM build_stages').fetchall())
+    con.commit()
+
+    # run all of the build scripts (the stage inputs are hashed after all of their dependencies have run)
+    t0 = perf_counter()
+    run_stages(get_stages(jobs=jobs, characterize=characterize), con, build_log, prev_hashes, tstamp, jobs=jobs)
+    with open(build_log, 'a') as bl:
+        print_and_log('build finished in {:.1f} s'.format(perf_counter() - t0), bl)
+
+    # back to a single database file
+    cur.execute('PRAGMA journal_mode = DELETE')
+    con.close()
 
     # make a copy of the database and store it in the builds directory
     make_database_copy(tstamp)
@@ -79,5 +427,11 @@ def main(tstamp):
 
 # run the main function if this module is called directly
 if __name__ == '__main__':
-    main(gen_tstamp())
-
+    parser = argparse.ArgumentParser(description='build the lipids database')
+    parser.add_argument('--full', action='store_true', help='rebuild everything, ignoring the previous build')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='maximum number of build stages to run at the same time (default: number of CPUs)')
+    parser.add_argument('--skip-characterization', action='store_true',
+                        help='do not make the CCS and RT prediction performance plots (faster builds)')
+    args = parser.parse_args()
+    main(gen_tstamp(), full=args.full, jobs=args.jobs, characterize=not args.skip_characterization)
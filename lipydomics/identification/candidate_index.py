@@ -0,0 +1,285 @@
+"""
+    lipydomics/identification/candidate_index.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        An in-memory index of the reference data in lipids.db (measured and predicted m/z, rt and CCS) built on sorted
+        NumPy arrays. Candidates for all features are found at once using np.searchsorted on the m/z windows, then
+        filtered with vectorized rt/CCS masks, with no SQL queries at all. Identifications made using the index are
+        exactly the same as those made using the functions in id_levels.py.
+
+        The index is built once per database version and cached on disk (as .npz) in the builds/ directory.
+"""
+
+
+import os
+from sqlite3 import connect
+import numpy as np
+
+from lipydomics.util import get_scores
+from lipydomics.identification.id_levels import level_defs
+
+
+# in-process cache of loaded indices, keyed by the path to the lipid database
+_loaded = {}
+
+
+def index_path(db_version_tstamp=None):
+    """
+index_path
+    description:
+        returns the path of the cached candidate index for a version of the lipid database
+    parameters:
+        [db_version_tstamp (str or None)] -- time-stamped version of the lipids database, or None for the default
+                                             (most recent build) [optional, default=None]
+    returns:
+        (str) -- path to the cached candidate index (.npz)
+"""
+    fname = 'index_{}.npz'.format(db_version_tstamp if db_version_tstamp else 'lipids')
+    return os.path.join(os.path.dirname(__file__), 'builds', fname)
+
+
+def db_signature(db_path):
+    """
+db_signature
+    description:
+        generates a signature of a lipid database file (size and modification time) used to detect when a cached
+        index has become stale
+    parameters:
+        db_path (str) -- path to the lipid database
+    returns:
+        (str) -- database file signature
+"""
+    st = os.stat(db_path)
+    return '{}_{}'.format(st.st_size, st.st_mtime_ns)
+
+
+class CandidateIndex:
+    """
+CandidateIndex
+    description:
+        Sorted array representation of the measured and predicted reference values in lipids.db. For each source
+        ('measured' and 'predicted') the following aligned arrays are stored, all sorted by m/z:
+            {src}_mz (float64) -- m/z
+            {src}_rt (float64) -- retention time (NaN if not available)
+            {src}_ccs (float64) -- CCS (NaN if not available)
+            {src}_pol (int8) -- adduct polarity (1 for positive, -1 for negative)
+            {src}_id (int64) -- m_id or t_id from lipids.db
+            {src}_name (int32) -- code into the names array
+            {src}_adduct (int32) -- code into the adducts array
+        along with the names and adducts arrays (str) that the codes refer to
+"""
+
+    def __init__(self, arrays):
+        """
+CandidateIndex.__init__
+    description:
+        Initializes the index from a dictionary of arrays (see class description), which is how the arrays are
+        stored on disk.
+    parameters:
+        arrays (dict(str:numpy.ndarray)) -- index arrays
+"""
+        self.arrays = arrays
+        # '{name}_{adduct}' identification strings for every reference value
+        names, adducts = arrays['names'], arrays['adducts']
+        self.labels = {}
+        for src in ['measured', 'predicted']:
+            self.labels[src] = np.array(['{}_{}'.format(names[n], adducts[a]) for n, a in
+                                         zip(arrays[src + '_name'], arrays[src + '_adduct'])], dtype=object)
+
+    @staticmethod
+    def build(db_path):
+        """
+CandidateIndex.build
+    description:
+        Builds a new index from a lipid database
+    parameters:
+        db_path (str) -- path to the lipid database
+    returns:
+        (CandidateIndex) -- the candidate index
+"""
+        con = connect(db_path)
+        cur = con.cursor()
+        qrys = {
+            'measured': 'SELECT m_id, name, adduct, charge, mz, rt, ccs FROM measured',
+            'predicted': 'SELECT t_id, name, adduct, charge, mz, rt, ccs FROM predicted'
+        }
+        names, adducts = {}, {}
+        arrays = {}
+        for src in ['measured', 'predicted']:
+            ids, name_codes, adduct_codes, charges, mzs, rts, ccss = [], [], [], [], [], [], []
+            for id_, name, adduct, charge, mz, rt, ccs in cur.execute(qrys[src]):
+                ids.append(id_)
+                name_codes.append(names.setdefault(name, len(names)))
+                adduct_codes.append(adducts.setdefault(adduct, len(adducts)))
+                charges.append(charge)
+                mzs.append(mz)
+                rts.append(np.nan if rt is None else rt)
+                ccss.append(np.nan if ccs is None else ccs)
+            ids, mzs = np.array(ids, dtype=np.int64), np.array(mzs, dtype=np.float64)
+            # sort by m/z (then by id so that the order is deterministic)
+            order = np.lexsort((ids, mzs))
+            arrays[src + '_mz'] = mzs[order]
+            arrays[src + '_rt'] = np.array(rts, dtype=np.float64)[order]
+            arrays[src + '_ccs'] = np.array(ccss, dtype=np.float64)[order]
+            arrays[src + '_id'] = ids[order]
+            arrays[src + '_name'] = np.array(name_codes, dtype=np.int32)[order]
+            arrays[src + '_adduct'] = np.array(adduct_codes, dtype=np.int32)[order]
+            # adduct polarities, these correspond to the charge > 0 and charge < 0 filters in id_levels.py
+            arrays[src + '_pol'] = np.sign(np.array(charges, dtype=np.int8))[order]
+        con.close()
+        arrays['names'] = np.array(list(names), dtype=str)
+        arrays['adducts'] = np.array(list(adducts), dtype=str)
+        return CandidateIndex(arrays)
+
+    @staticmethod
+    def load(path):
+        """
+CandidateIndex.load
+    description:
+        Loads an index that was saved with CandidateIndex.save(...)
+    parameters:
+        path (str) -- path to the saved index (.npz)
+    returns:
+        (CandidateIndex) -- the candidate index
+"""
+        with np.load(path, allow_pickle=False) as npz:
+            return CandidateIndex({k: npz[k] for k in npz.files})
+
+    def save(self, path):
+        """
+CandidateIndex.save
+    description:
+        Saves this index to file (.npz)
+    parameters:
+        path (str) -- path to save the index under
+"""
+        np.savez(path, **self.arrays)
+
+    def find_candidates(self, src, mz_min, mz_max):
+        """
+CandidateIndex.find_candidates
+    description:
+        Finds all of the reference values from a source with m/z within the windows of all features
+    parameters:
+        src (str) -- reference data source, 'measured' or 'predicted'
+        mz_min (numpy.ndarray(float)) -- lower bound of the m/z window for each feature
+        mz_max (numpy.ndarray(float)) -- upper bound of the m/z window for each feature
+    returns:
+        (numpy.ndarray(int), numpy.ndarray(int)) -- feature index and reference value index for each candidate, the
+                                                    candidates are grouped by feature
+"""
+        mz = self.arrays[src + '_mz']
+        # equivalent to: mz BETWEEN mz_min AND mz_max
+        lo = np.searchsorted(mz, mz_min, side='left')
+        hi = np.searchsorted(mz, mz_max, side='right')
+        counts = np.maximum(hi - lo, 0)
+        feat = np.repeat(np.arange(len(mz_min)), counts)
+        cand = np.arange(counts.sum()) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        return feat, cand
+
+    def identify(self, levels, features, esi_mode, norm='l2'):
+        """
+CandidateIndex.identify
+    description:
+        Identifies all features using a list of identification levels, which are attempted in the order they are
+        provided. Produces the same results as calling id_levels.id_feat_custom(...) on each feature individually.
+    parameters:
+        levels (list(str)) -- list of identification levels to try, will be attempted in the order they are provided
+        features (list(tuple(float))) -- m/z, rt, CCS, and the m/z, rt, and CCS tolerances for each feature
+        esi_mode (str) -- filter results by ionization mode: 'neg', 'pos', or None for unspecified
+        [norm (str)] -- specify l1 or l2 norm for computing scores [optional, default='l2']
+    returns:
+        (list(tuple(list(str) or str, str, list(float)))) -- putative identification(s) (or '' for no matches),
+                                                                identification level, and scores for each feature
+"""
+        for lvl in levels:
+            if lvl == 'any':
+                m = 'CandidateIndex: identify: the special "any" ID level is invalid in a custom ID level list'
+                raise ValueError(m)
+            elif lvl not in level_defs:
+                m = 'CandidateIndex: identify: identification level "{}" is not defined'
+                raise ValueError(m.format(lvl))
+
+        n = len(features)
+        results = [('', '', []) for _ in range(n)]
+        if n == 0:
+            return results
+        q = np.array(features, dtype=np.float64).reshape(n, 6)
+        q, tol = q[:, :3], q[:, 3:]
+        lower, upper = q - tol, q + tol
+
+        # the m/z window is the same for every level, so only search each source once
+        pairs = {}
+        for src in set([level_defs[lvl][0] for lvl in levels]):
+            feat, cand = self.find_candidates(src, lower[:, 0], upper[:, 0])
+            if esi_mode in ['pos', 'neg']:
+                keep = self.arrays[src + '_pol'][cand] == (1 if esi_mode == 'pos' else -1)
+                feat, cand = feat[keep], cand[keep]
+            x = np.column_stack([self.arrays[src + '_' + d][cand] for d in ['mz', 'rt', 'ccs']])
+            # equivalent to: rt BETWEEN rt_min AND rt_max, ccs BETWEEN ccs_min AND ccs_max (NaN never matches)
+            in_window = (x >= lower[feat]) & (x <= upper[feat])
+            pairs[src] = (feat, cand, x, in_window)
+
+        unassigned = np.ones(n, dtype=bool)
+        for lvl in levels:
+            src, use_rt, use_ccs = level_defs[lvl]
+            feat, cand, x, in_window = pairs[src]
+            ok = unassigned[feat]
+            if use_rt:
+                ok &= in_window[:, 1]
+            if use_ccs:
+                ok &= in_window[:, 2]
+            if not ok.any():
+                continue
+            feat, cand, x = feat[ok], cand[ok], x[ok]
+            unassigned[feat] = False
+            # order candidates by feature, then by reference id (same order as the SQL queries)
+            order = np.lexsort((self.arrays[src + '_id'][cand], feat))
+            feat, cand, x = feat[order], cand[order], x[order]
+            # mask out the dimensions that are not used by this level
+            q_lvl = np.where([True, use_rt, use_ccs], q[feat], np.nan)
+            scores = get_scores(q_lvl, x, tol[feat], norm=norm).tolist()
+            labels = self.labels[src][cand].tolist()
+            bounds = np.flatnonzero(np.diff(feat)) + 1
+            for i, j0, j1 in zip(feat[np.concatenate([[0], bounds])].tolist(),
+                                 [0] + bounds.tolist(), bounds.tolist() + [len(feat)]):
+                results[i] = (labels[j0:j1], lvl, scores[j0:j1])
+        return results
+
+
+def get_candidate_index(db_path, db_version_tstamp=None):
+    """
+get_candidate_index
+    description:
+        Returns the candidate index for a lipid database. The index is loaded from the on-disk cache (builds/) if it is
+        available and up to date with the database, otherwise it is built and cached. Loaded indices are also kept in
+        memory so subsequent calls do not need to read them again.
+    parameters:
+        db_path (str) -- path to the lipid database
+        [db_version_tstamp (str or None)] -- time-stamped version of the lipids database, or None for the default
+                                             (most recent build) [optional, default=None]
+    returns:
+        (CandidateIndex) -- the candidate index
+"""
+    sig = db_signature(db_path)
+    if db_path in _loaded and _loaded[db_path][0] == sig:
+        return _loaded[db_path][1]
+    path = index_path(db_version_tstamp)
+    idx = None
+    if os.path.isfile(path):
+        idx = CandidateIndex.load(path)
+        if str(idx.arrays.get('db_signature', '')) != sig:
+            # stale, the database has been changed since the index was built
+            idx = None
+    if idx is None:
+        idx = CandidateIndex.build(db_path)
+        idx.arrays['db_signature'] = np.array(sig)
+        try:
+            idx.save(path)
+        except OSError:
+            # not being able to cache the index (e.g. read-only installation) is not a problem, just rebuild next time
+            pass
+    _loaded[db_path] = (sig, idx)
+    return idx
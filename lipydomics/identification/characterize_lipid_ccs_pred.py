@@ -5,12 +5,17 @@
 
     description:
         Characterizes performance of the predictive model for generating predicted CCS values by generating plots
-        of predicted vs. measured CCS organized by lipid class (along with FA modifier) and MS adduct
+        of predicted vs. measured CCS organized by lipid class (along with FA modifier) and MS adduct. The data for all
+        of the plots is fetched at once then the plots are rendered in parallel (using the non-interactive Agg backend)
 """
 
 
 import os
 from sqlite3 import connect
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 from matplotlib import rcParams, gridspec
 
@@ -22,76 +27,81 @@ from .encoder_params import ccs_lipid_classes, ccs_fa_mods, ccs_ms_adducts
 rcParams['font.size'] = 6
 
 
-def single_class_plot(cursor, lipid_class, adduct, fa_mod=None):
+def group_data(cursor):
+    """
+group_data
+    description:
+        fetches the measured and predicted CCS for all of the lipid classes (accounting for fa_mod if present) and MS
+        adducts with enough measured data (more than 9 values) in two queries, then groups them by lipid class, fa_mod
+        and adduct. Only measured data from the sources used for training the predictive model is included. Measured
+        values are compared against predicted values (within the m/z and CCS ranges of the measured data) for lipids
+        with the same sum composition.
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+    returns:
+        (list(tuple(...))) -- lipid class, adduct, fa_mod, measured m/z, measured CCS, predicted m/z, predicted CCS,
+                                residual m/z, residual CCS (%) for each group to plot (see single_class_plot(...))
+"""
+    # measured data for the encodable lipid classes, fa_mods and adducts
+    qry = 'SELECT lipid_class, fa_mod, adduct, lipid_nc, lipid_nu, mz, ccs, src_tag FROM measured ORDER BY m_id'
+    meas = [row for row in cursor.execute(qry).fetchall()
+            if row[0] in ccs_lipid_classes and (row[1] is None or row[1] in ccs_fa_mods) and row[2] in ccs_ms_adducts]
+    if not meas:
+        return []
+    m_lc, m_fam, m_add, m_nc, m_nu, m_mz, m_ccs, m_src = [np.array(_, dtype=object) for _ in zip(*meas)]
+    m_nc, m_nu, m_mz, m_ccs = m_nc.astype(int), m_nu.astype(int), m_mz.astype(float), m_ccs.astype(float)
+    m_src_ok = np.isin(m_src, ccs_pred_ref_dsets)
+
+    # predicted data for the same lipid classes and adducts
+    qry = 'SELECT lipid_class, fa_mod, adduct, lipid_nc, lipid_nu, mz, ccs FROM predicted_mz JOIN predicted_ccs ON '
+    qry += 'predicted_mz.t_id=predicted_ccs.t_id ORDER BY predicted_mz.t_id'
+    pred = [row for row in cursor.execute(qry).fetchall() if row[0] in ccs_lipid_classes and row[2] in ccs_ms_adducts]
+    t_lc, t_fam, t_add, t_nc, t_nu, t_mz, t_ccs = [np.array(_, dtype=object) for _ in zip(*pred)] if pred \
+        else [np.array([], dtype=object) for _ in range(7)]
+    t_nc, t_nu, t_mz, t_ccs = t_nc.astype(int), t_nu.astype(int), t_mz.astype(float), t_ccs.astype(float)
+
+    # count the measured values in each group (groups are in the order that they first appear in the measured table)
+    counts = {}
+    for key in zip(m_lc, m_fam, m_add):
+        counts[key] = counts.get(key, 0) + 1
+
+    groups = []
+    for lipid_class, fa_mod, adduct in [key for key in counts if counts[key] > 9]:
+        # only o and p fa_mods are matched explicitly, everything else is compared with the unmodified lipid class
+        fam = fa_mod if fa_mod in ['o', 'p'] else None
+        m_sel = (m_lc == lipid_class) & (m_fam == fam) & (m_add == adduct) & m_src_ok
+        # if no measured data was found skip plotting this class
+        if not m_sel.any():
+            continue
+        mz_m, ccs_m, nc_m, nu_m = m_mz[m_sel], m_ccs[m_sel], m_nc[m_sel], m_nu[m_sel]
+        # set bounds on the predicted data to fetch and display
+        mz_min, mz_max = int(min(mz_m)), int(max(mz_m))
+        ccs_min, ccs_max = int(min(ccs_m)), int(max(ccs_m))
+        t_sel = (t_lc == lipid_class) & (t_fam == fam) & (t_add == adduct)
+        t_sel &= (t_mz >= mz_min) & (t_mz <= mz_max) & (t_ccs >= ccs_min) & (t_ccs <= ccs_max)
+        mz_t, ccs_t, nc_t, nu_t = t_mz[t_sel], t_ccs[t_sel], t_nc[t_sel], t_nu[t_sel]
+        # residual CCS for every pair of measured and predicted values with the same sum composition
+        i_m, i_t = np.nonzero((nc_m[:, None] == nc_t[None, :]) & (nu_m[:, None] == nu_t[None, :]))
+        mz_resid = mz_m[i_m]
+        ccs_resid = 100. * (ccs_t[i_t] - ccs_m[i_m]) / ccs_m[i_m]
+        groups.append((lipid_class, adduct, fa_mod, mz_m, ccs_m, mz_t, ccs_t, mz_resid, ccs_resid))
+    return groups
+
+
+def single_class_plot(lipid_class, adduct, fa_mod, mz_m, ccs_m, mz_t, ccs_t, mz_resid, ccs_resid):
     """
 single_class_plot
     description:
         generates a plot comparing predicted CCS values against experimentally measured ones for a given lipid class
         (accounting for fa_mod if present) and MS adduct. Saves the plot as a figure in the ccs_pred_perf/ directory
     parameters:
-        cursor (sqlite3.cursor) -- cursor for querying lipids.db
         lipid_class (str) -- lipid class
         adduct (str) -- MS adduct
-        [fa_mod (None or str)] -- fatty acid modifier [optional, default=None]
+        fa_mod (None or str) -- fatty acid modifier
+        mz_m, ccs_m (numpy.ndarray(float)) -- measured m/z and CCS
+        mz_t, ccs_t (numpy.ndarray(float)) -- predicted m/z and CCS
+        mz_resid, ccs_resid (numpy.ndarray(float)) -- m/z and CCS error (%) for the residuals
 """
-    # predicted and measured m/z and ccs
-    mz_t, ccs_t = [], []
-    mz_m, ccs_m = [], []
-    # use nc and nu to compute residuals
-    nc_m, nu_m = [], []
-    nc_t, nu_t = [], []
-
-    # fetch the measured data
-    if fa_mod in ['o', 'p']:
-        qry = 'SELECT mz, ccs, src_tag, lipid_nc, lipid_nu FROM measured WHERE lipid_class="{}" AND fa_mod=="{}" AND adduct="{}"'
-        qry = qry.format(lipid_class, fa_mod, adduct)
-    else:
-        qry = 'SELECT mz, ccs, src_tag, lipid_nc, lipid_nu FROM measured WHERE lipid_class="{}" AND fa_mod IS NULL AND adduct="{}"'
-        qry = qry.format(lipid_class, adduct)
-    for mz, ccs, st, nc, nu in cursor.execute(qry).fetchall():
-        # only include data from the designated sources
-        src_ok = st in ccs_pred_ref_dsets
-        if src_ok:
-            nc_m.append(int(nc))
-            nu_m.append(int(nu))
-            mz_m.append(float(mz))
-            ccs_m.append(float(ccs))
-
-    # if no measured data was found, return None to skip plotting this class
-    if len(mz_m) < 1:
-        return None
-
-    # set bounds on the predicted data to fetch and display
-    mz_min, mz_max = int(min(mz_m)), int(max(mz_m))
-    ccs_min, ccs_max = int(min(ccs_m)), int(max(ccs_m))
-
-    # fetch the predicted data
-    if fa_mod in ['o', 'p']:
-        qry = 'SELECT mz, ccs, lipid_nc, lipid_nu FROM predicted_mz JOIN predicted_ccs ON '
-        qry += 'predicted_mz.t_id=predicted_ccs.t_id '
-        qry += 'WHERE lipid_class="{}" AND fa_mod=="{}" AND adduct="{}" AND (mz BETWEEN {} AND {}) AND '
-        qry += '(ccs BETWEEN {} AND {})'
-        qry = qry.format(lipid_class, fa_mod, adduct, mz_min, mz_max, ccs_min, ccs_max)
-    else:
-        qry = 'SELECT mz, ccs, lipid_nc, lipid_nu FROM predicted_mz JOIN predicted_ccs ON '
-        qry += 'predicted_mz.t_id=predicted_ccs.t_id '
-        qry += 'WHERE lipid_class="{}" AND fa_mod IS NULL AND adduct="{}" AND (mz BETWEEN {} AND {}) AND '
-        qry += '(ccs BETWEEN {} AND {})'
-        qry = qry.format(lipid_class, adduct, mz_min, mz_max, ccs_min, ccs_max)
-    for mz, ccs, nc, nu in cursor.execute(qry).fetchall():
-        mz_t.append(float(mz))
-        ccs_t.append(float(ccs))
-        nc_t.append(int(nc))
-        nu_t.append(int(nu))
-
-    # compute residual CCS
-    mz_resid, ccs_resid = [], []
-    for mzm, ccsm, nc, nu in zip(mz_m, ccs_m, nc_m, nu_m):
-        for mzt, ccst, nct, nut in zip(mz_t, ccs_t, nc_t, nu_t):
-            if nc == nct and nu == nut:
-                mz_resid.append(mzm)
-                ccs_resid.append(100. * (ccst - ccsm) / ccsm)
-
     this_dir = os.path.dirname(__file__)
     fig_fname = 'ccs_pred_perf/{}_{}{}_{}.png'.format(len(ccs_m), lipid_class, fa_mod if fa_mod else '', adduct)
     fig_path = os.path.join(this_dir, fig_fname)
@@ -136,7 +146,36 @@ single_class_plot
     plt.close()
 
 
-def main(tstamp):
+def _plot_group(group):
+    """ renders the plot for a single group from group_data(...) (for use with a process pool) """
+    single_class_plot(*group)
+
+
+def characterize(cursor, bl, n_jobs=1):
+    """
+characterize
+    description:
+        generates the CCS prediction performance plots for all of the lipid classes with enough measured data
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+        bl (file) -- build log
+        [n_jobs (int)] -- number of worker processes to render the plots with [optional, default=1]
+"""
+    print_and_log('characterizing CCS prediction performance ...', bl, end=' ')
+
+    # automatically generate plots for all data included in the model training
+    groups = group_data(cursor)
+    if n_jobs > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(_plot_group, groups))
+    else:
+        for group in groups:
+            _plot_group(group)
+
+    print_and_log('ok ({} plots)\n'.format(len(groups)), bl)
+
+
+def main(tstamp, n_jobs=1):
     """ main build function """
 
     # connect to database
@@ -147,21 +186,7 @@ def main(tstamp):
     build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
     with open(build_log, 'a') as bl:
 
-        print_and_log('characterizing CCS prediction performance ...', bl, end=' ')
-
-        # automatically generate plots for all data included in the model training
-        qry = 'SELECT lipid_class, fa_mod, adduct, COUNT(*) as c FROM measured '
-        qry += 'GROUP BY lipid_class, fa_mod, adduct HAVING c > 9'
-        for lipid_class, fa_mod, adduct, c in cur.execute(qry).fetchall():
-            # only use the classes, fa_mods and adducts that are explicitly encoded
-            lc_ok = lipid_class in ccs_lipid_classes
-            fam_ok = fa_mod is None or fa_mod in ccs_fa_mods
-            add_ok = adduct in ccs_ms_adducts
-            if lc_ok and fam_ok and add_ok:
-                single_class_plot(cur, lipid_class, adduct, fa_mod=fa_mod)
-
-        print_and_log('ok\n', bl)
+        characterize(cur, bl, n_jobs=n_jobs)
 
     # close database connection
     con.close()
-
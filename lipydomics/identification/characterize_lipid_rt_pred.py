@@ -5,15 +5,19 @@
 
     description:
         Characterizes performance of the predictive model for generating predicted RT values by generating plots
-        of predicted vs. measured RT
+        of predicted vs. measured RT. The data for all of the plots is fetched at once then the plots are rendered in
+        parallel (using the non-interactive Agg backend)
 """
 
 
 from sqlite3 import connect
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 from matplotlib import rcParams
-from numpy import median
 
 from ..util import print_and_log
 from .encoder_params import rt_lipid_classes, rt_fa_mods
@@ -22,41 +26,59 @@ from .encoder_params import rt_lipid_classes, rt_fa_mods
 rcParams['font.size'] = 6
 
 
-def single_class_plot(cursor, lipid_class, fa_mod=None):
+def group_data(cursor):
+    """
+group_data
+    description:
+        fetches the measured and predicted RT for all of the lipid classes (accounting for fa_mod if present) with
+        measured RT in two queries, then groups them by lipid class and fa_mod
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+    returns:
+        (list(tuple(...))) -- lipid class, fa_mod, measured RT, predicted RT for each group to plot (see
+                                single_class_plot(...))
+"""
+    # measured data for the encodable lipid classes and fa_mods
+    qry = 'SELECT lipid_class, fa_mod, rt FROM measured WHERE rt IS NOT NULL ORDER BY m_id'
+    meas = [row for row in cursor.execute(qry).fetchall()
+            if row[0] in rt_lipid_classes and (row[1] is None or row[1] in rt_fa_mods)]
+    if not meas:
+        return []
+    m_lc, m_fam, m_rt = [np.array(_, dtype=object) for _ in zip(*meas)]
+    m_rt = m_rt.astype(float)
+
+    # predicted data
+    qry = 'SELECT lipid_class, fa_mod, rt FROM predicted_mz JOIN predicted_rt ON predicted_mz.t_id=predicted_rt.t_id '
+    qry += 'ORDER BY predicted_mz.t_id'
+    pred = cursor.execute(qry).fetchall()
+    t_lc, t_fam, t_rt = [np.array(_, dtype=object) for _ in zip(*pred)] if pred \
+        else [np.array([], dtype=object) for _ in range(3)]
+    t_rt = t_rt.astype(float)
+
+    groups = []
+    # groups are in the order that they first appear in the measured table
+    for lipid_class, fa_mod in dict.fromkeys(zip(m_lc, m_fam)):
+        rt_m = m_rt[(m_lc == lipid_class) & (m_fam == fa_mod)]
+        rt_t = t_rt[(t_lc == lipid_class) & (t_fam == fa_mod)]
+        # only plot groups with both measured and predicted RT
+        if len(rt_m) > 0 and len(rt_t) > 0:
+            groups.append((lipid_class, fa_mod, rt_m, rt_t))
+    return groups
+
+
+def single_class_plot(lipid_class, fa_mod, rt_m, rt_t):
     """
 single_class_plot
     description:
         generates a plot comparing predicted RT values against experimentally measured ones for a given lipid class
         (accounting for fa_mod if present). Saves the plot as a figure in the rt_pred_perf/ directory
     parameters:
-        cursor (sqlite3.cursor) -- cursor for querying lipids.db
         lipid_class (str) -- lipid class
-        [fa_mod (None or str)] -- fatty acid modifier [optional, default=None]
+        fa_mod (None or str) -- fatty acid modifier
+        rt_m (numpy.ndarray(float)) -- measured RT
+        rt_t (numpy.ndarray(float)) -- predicted RT
 """
-    # predicted and measured retention time
-    rt_t, rt_m = [], []
-
-    # fetch the predicted data
-    if fa_mod in rt_fa_mods:
-        qry = 'SELECT rt FROM predicted_mz JOIN predicted_rt ON predicted_mz.t_id=predicted_rt.t_id '
-        qry += 'WHERE lipid_class="{}" AND fa_mod=="{}"'
-        qry = qry.format(lipid_class, fa_mod)
-    else:
-        qry = 'SELECT rt FROM predicted_mz JOIN predicted_rt ON predicted_mz.t_id=predicted_rt.t_id '
-        qry += 'WHERE lipid_class="{}" AND fa_mod IS NULL'
-        qry = qry.format(lipid_class)
-    for rt in cursor.execute(qry).fetchall():
-        rt_t.append(float(rt[0]))
-
-    # fetch the measured data
-    if fa_mod in rt_fa_mods:
-        qry = 'SELECT rt FROM measured WHERE lipid_class="{}" AND fa_mod=="{}" AND rt IS NOT NULL'
-        qry = qry.format(lipid_class, fa_mod)
-    else:
-        qry = 'SELECT rt FROM measured WHERE lipid_class="{}" AND fa_mod IS NULL AND rt IS NOT NULL'
-        qry = qry.format(lipid_class)
-    for rt in cursor.execute(qry).fetchall():
-        rt_m.append(float(rt[0]))
+    rt_m, rt_t = list(rt_m), list(rt_t)
 
     this_dir = os.path.dirname(__file__)
     fig_fname = 'rt_pred_perf/{}_{}{}.png'.format(len(rt_m), lipid_class, fa_mod if fa_mod else '')
@@ -98,7 +120,36 @@ single_class_plot
         plt.close()
 
 
-def main(tstamp):
+def _plot_group(group):
+    """ renders the plot for a single group from group_data(...) (for use with a process pool) """
+    single_class_plot(*group)
+
+
+def characterize(cursor, bl, n_jobs=1):
+    """
+characterize
+    description:
+        generates the RT prediction performance plots for all of the lipid classes with enough measured data
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+        bl (file) -- build log
+        [n_jobs (int)] -- number of worker processes to render the plots with [optional, default=1]
+"""
+    print_and_log('characterizing RT prediction performance ...', bl, end=' ')
+
+    # automatically generate plots for all combinations
+    groups = group_data(cursor)
+    if n_jobs > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(_plot_group, groups))
+    else:
+        for group in groups:
+            _plot_group(group)
+
+    print_and_log('ok ({} plots)\n'.format(len(groups)), bl)
+
+
+def main(tstamp, n_jobs=1):
     """ main build function """
 
     # connect to database
@@ -109,20 +160,7 @@ def main(tstamp):
     build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
     with open(build_log, 'a') as bl:
 
-        print_and_log('characterizing RT prediction performance ...', bl, end=' ')
-
-        # automatically generate plots for all combinations
-        qry = 'SELECT lipid_class, fa_mod FROM measured '
-        qry += 'WHERE rt IS NOT NULL GROUP BY lipid_class, fa_mod'
-        for lipid_class, fa_mod in cur.execute(qry).fetchall():
-            # only use the classes and fa_mods that are explicitly encoded
-            lc_ok = lipid_class in rt_lipid_classes
-            fam_ok = fa_mod is None or fa_mod in rt_fa_mods
-            if lc_ok and fam_ok:
-                single_class_plot(cur, lipid_class, fa_mod=fa_mod)
-
-        print_and_log('ok\n', bl)
+        characterize(cur, bl, n_jobs=n_jobs)
 
     # close database connection
     con.close()
-
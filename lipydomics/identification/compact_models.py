@@ -0,0 +1,164 @@
+"""
+    lipydomics/identification/compact_models.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        Compact on-disk (.npz) format for the trained CCS and RT predictive models, along with pure NumPy inference.
+        The models are trained using scikit-learn (see train_lipid_ccs_pred.py and train_lipid_rt_pred.py) then the
+        parameters needed to make predictions are exported into .npz files, so loading the models and making
+        predictions does not require scikit-learn (and does not depend upon the scikit-learn version like unpickling
+        does).
+
+        SVR models (RBF kernel) store: support vectors, dual coefficients, intercept, gamma, and the input scaler scale_
+        linear models store: coefficients, intercept, and the input scaler scale_
+
+        The input scalers are StandardScaler(with_mean=False), so scaling inputs is just dividing by scale_
+"""
+
+
+import numpy as np
+
+
+def export_svr(model, scaler, path):
+    """
+export_svr
+    description:
+        exports a trained (RBF kernel) SVR model and its input scaler into a .npz file
+    parameters:
+        model (sklearn.svm.SVR) -- trained SVR model
+        scaler (sklearn.preprocessing.StandardScaler) -- input scaler (with_mean=False)
+        path (str) -- path to save the .npz file
+"""
+    if model.kernel != 'rbf':
+        m = 'export_svr: only models with an RBF kernel can be exported (kernel was: {})'
+        raise ValueError(m.format(model.kernel))
+    np.savez_compressed(path, kind='svr', support_vectors=model.support_vectors_, dual_coef=model.dual_coef_[0],
+                        intercept=model.intercept_[0], gamma=model._gamma, scale=scaler.scale_)
+
+
+def export_linear(model, scaler, path):
+    """
+export_linear
+    description:
+        exports a trained linear model and its input scaler into a .npz file
+    parameters:
+        model (sklearn.linear_model.LinearRegression) -- trained linear model
+        scaler (sklearn.preprocessing.StandardScaler) -- input scaler (with_mean=False)
+        path (str) -- path to save the .npz file
+"""
+    np.savez_compressed(path, kind='linear', coef=model.coef_, intercept=model.intercept_, scale=scaler.scale_)
+
+
+class SVRModel:
+    """
+SVRModel
+    description:
+        RBF kernel support vector regression model loaded from a .npz file (see export_svr(...)), predictions are made
+        using NumPy only
+"""
+
+    def __init__(self, support_vectors, dual_coef, intercept, gamma, scale):
+        """
+SVRModel.__init__
+    description:
+        sets up the model from its parameters
+    parameters:
+        support_vectors (numpy.ndarray(float)) -- support vectors, shape = (n_support_vectors, n_features)
+        dual_coef (numpy.ndarray(float)) -- dual coefficients, shape = (n_support_vectors,)
+        intercept (float) -- intercept
+        gamma (float) -- RBF kernel coefficient
+        scale (numpy.ndarray(float)) -- input scaler scale_, shape = (n_features,)
+"""
+        self.support_vectors = support_vectors
+        self.dual_coef = dual_coef
+        self.intercept = float(intercept)
+        self.gamma = float(gamma)
+        self.scale = scale
+        # squared norms of the support vectors are the same for every prediction
+        self._sv_sq = (support_vectors * support_vectors).sum(axis=1)
+
+    def predict(self, X, block_size=2048):
+        """
+SVRModel.predict
+    description:
+        makes predictions for an array of (unscaled) feature vectors. The kernel matrix is evaluated for blocks of
+        feature vectors at a time so that memory use is bounded by block_size * n_support_vectors. The products with
+        the support vectors are computed one feature vector at a time and all of the sums are taken along rows, so
+        each prediction is exactly the same no matter how many feature vectors are predicted at once.
+    parameters:
+        X (numpy.ndarray(float)) -- feature vectors, shape = (n_samples, n_features)
+        [block_size (int)] -- number of feature vectors to evaluate the kernel for at a time [optional, default=2048]
+    returns:
+        (numpy.ndarray(float)) -- predictions, shape = (n_samples,)
+"""
+        X = np.asarray(X, dtype=float) / self.scale
+        y = np.empty(len(X))
+        cross = np.empty((min(block_size, len(X)), len(self.support_vectors)))
+        for i in range(0, len(X), block_size):
+            Xb = X[i:i + block_size]
+            xc = cross[:len(Xb)]
+            for j, x in enumerate(Xb):
+                np.dot(self.support_vectors, x, out=xc[j])
+            # squared euclidean distances between each feature vector and each support vector
+            d2 = (Xb * Xb).sum(axis=1)[:, None] + self._sv_sq[None, :] - 2. * xc
+            np.maximum(d2, 0., out=d2)
+            y[i:i + block_size] = (np.exp(-self.gamma * d2) * self.dual_coef).sum(axis=1)
+        return y + self.intercept
+
+
+class LinearModel:
+    """
+LinearModel
+    description:
+        linear regression model loaded from a .npz file (see export_linear(...)), predictions are made using NumPy only
+"""
+
+    def __init__(self, coef, intercept, scale):
+        """
+LinearModel.__init__
+    description:
+        sets up the model from its parameters
+    parameters:
+        coef (numpy.ndarray(float)) -- coefficients, shape = (n_features,)
+        intercept (float) -- intercept
+        scale (numpy.ndarray(float)) -- input scaler scale_, shape = (n_features,)
+"""
+        self.coef = coef
+        self.intercept = float(intercept)
+        self.scale = scale
+
+    def predict(self, X):
+        """
+LinearModel.predict
+    description:
+        makes predictions for an array of (unscaled) feature vectors. The dot product is taken one row at a time (see
+        train_lipid_rt_pred.predict_batch(...)) so that the predictions are exactly the same as predicting each
+        feature vector on its own
+    parameters:
+        X (numpy.ndarray(float)) -- feature vectors, shape = (n_samples, n_features)
+    returns:
+        (numpy.ndarray(float)) -- predictions, shape = (n_samples,)
+"""
+        X = np.asarray(X, dtype=float) / self.scale
+        return np.array([np.dot(x, self.coef) for x in X], dtype=float) + self.intercept
+
+
+def load_model(path):
+    """
+load_model
+    description:
+        loads a model from a .npz file (see export_svr(...) and export_linear(...))
+    parameters:
+        path (str) -- path to the .npz file
+    returns:
+        (SVRModel or LinearModel) -- the model
+"""
+    with np.load(path) as npz:
+        kind = str(npz['kind'])
+        if kind == 'svr':
+            return SVRModel(npz['support_vectors'], npz['dual_coef'], npz['intercept'], npz['gamma'], npz['scale'])
+        if kind == 'linear':
+            return LinearModel(npz['coef'], npz['intercept'], npz['scale'])
+    m = 'load_model: unrecognized model kind "{}" in file: {}'
+    raise ValueError(m.format(kind, path))
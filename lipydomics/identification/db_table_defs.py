@@ -20,8 +20,9 @@ CREATE TABLE measured (
     lipid_nu INTEGER NOT NULL,
     -- fatty acid modifier
     fa_mod TEXT,
-    -- MS adduct
+    -- MS adduct and its charge
     adduct TEXT NOT NULL,
+    charge INTEGER NOT NULL,
     -- m/z and CCS
     mz REAL NOT NULL,
     ccs REAL NOT NULL,
@@ -51,8 +52,9 @@ CREATE TABLE predicted_mz (
     lipid_nu INTEGER NOT NULL,
     -- fatty acid modifier
     fa_mod TEXT,
-    -- MS adduct
+    -- MS adduct and its charge
     adduct TEXT NOT NULL,
+    charge INTEGER NOT NULL,
     -- predicted m/z
     mz REAL NOT NULL
 );
@@ -78,3 +80,81 @@ CREATE TABLE predicted_rt (
 );
 """
 
+
+measured_rtree = """
+-- R*Tree over measured m/z, rt, CCS and charge for box queries (missing rt spans the full range), m_id matches 
+-- measured.m_id
+CREATE VIRTUAL TABLE IF NOT EXISTS measured_rtree USING rtree (
+    m_id,
+    mz_min, mz_max,
+    rt_min, rt_max,
+    ccs_min, ccs_max,
+    charge_min, charge_max
+);
+"""
+
+predicted = """
+-- denormalized table combining predicted m/z, CCS and retention time (filled at the end of the build from the 
+-- predicted_mz, predicted_ccs and predicted_rt tables), clustered by m/z so m/z range queries read contiguous rows
+CREATE TABLE IF NOT EXISTS predicted (
+    -- matches predicted_mz.t_id
+    t_id INTEGER NOT NULL,
+    -- lipid name
+    name TEXT NOT NULL,
+    -- lipid_class and sum composition
+    lipid_class TEXT NOT NULL,
+    lipid_nc INTEGER NOT NULL,
+    lipid_nu INTEGER NOT NULL,
+    -- fatty acid modifier
+    fa_mod TEXT,
+    -- MS adduct and its charge
+    adduct TEXT NOT NULL,
+    charge INTEGER NOT NULL,
+    -- predicted m/z, CCS and retention time (NULL if not predicted)
+    mz REAL NOT NULL,
+    ccs REAL,
+    rt REAL,
+    PRIMARY KEY (mz, t_id)
+) WITHOUT ROWID;
+"""
+
+indexes = [
+    """
+-- covering indexes for m/z range queries on measured values, with partial indexes for each polarity
+CREATE INDEX IF NOT EXISTS measured_mz_idx ON measured (mz, adduct, rt, ccs, name, m_id);
+""",
+    """
+CREATE INDEX IF NOT EXISTS measured_mz_pos_idx ON measured (mz, adduct, rt, ccs, name, m_id, charge) WHERE charge > 0;
+""",
+    """
+CREATE INDEX IF NOT EXISTS measured_mz_neg_idx ON measured (mz, adduct, rt, ccs, name, m_id, charge) WHERE charge < 0;
+"""
+]
+
+
+bulk_load_pragmas = [
+    """
+-- settings for bulk loading during the build: no rollback journal or syncing to disk (the database is rebuilt from
+-- scratch if the build fails) and a large page cache (~256 MB)
+PRAGMA journal_mode = OFF;
+""",
+    """
+PRAGMA synchronous = OFF;
+""",
+    """
+PRAGMA cache_size = -262144;
+"""
+]
+
+
+build_stages = """
+-- hashes of the inputs to each of the build stages, stages whose inputs have not changed are skipped when rebuilding
+CREATE TABLE IF NOT EXISTS build_stages (
+    -- name of the build stage
+    stage TEXT UNIQUE NOT NULL,
+    -- hash of the stage inputs (source files, build parameters and data read from the database)
+    input_hash TEXT NOT NULL,
+    -- time stamp of the build in which the stage was last run
+    tstamp TEXT NOT NULL
+);
+"""
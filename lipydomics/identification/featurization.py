@@ -0,0 +1,89 @@
+"""
+    lipydomics/identification/featurization.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        Generates feature vectors for the CCS and RT predictive models. This is kept separate from the model training
+        code (train_lipid_ccs_pred.py and train_lipid_rt_pred.py) so that making predictions only needs NumPy
+"""
+
+
+import numpy as np
+
+from lipydomics.identification.encoder_params import (
+    ccs_lipid_classes, ccs_fa_mods, ccs_ms_adducts, rt_lipid_classes, rt_fa_mods
+)
+
+
+# lookup tables mapping lipid_class, fa_mod, and adduct to their one-hot column (the OneHotEncoders from
+# train_lipid_ccs_pred.prep_encoders() order their categories by sorting them)
+_ccs_lc_codes = {_: i for i, _ in enumerate(sorted(set(ccs_lipid_classes)))}
+_ccs_fm_codes = {_: i for i, _ in enumerate(sorted(set(ccs_fa_mods)))}
+_ccs_ad_codes = {_: i for i, _ in enumerate(sorted(set(ccs_ms_adducts)))}
+
+
+def ccs_featurize_batch(lipid_classes, lipid_ncs, lipid_nus, fa_mods, adducts, mzs):
+    """
+ccs_featurize_batch
+    description:
+        generates numerical representations for an array of lipids, each row is exactly the same as the feature
+        vector from train_lipid_ccs_pred.featurize(...) but the encoders are not needed: the categorical values are
+        mapped to their one-hot columns using lookup tables (anything that is not encodable, e.g. a fa_mod of None,
+        encodes as all 0s)
+    parameters:
+        lipid_classes (list(str)) -- lipid classes
+        lipid_ncs (list(int)) -- sum compositions: number of carbons
+        lipid_nus (list(int)) -- sum compositions: number of unsaturations
+        fa_mods (list(str)) -- fatty acid modifiers
+        adducts (list(str)) -- MS adducts
+        mzs (list(float)) -- m/z
+    returns:
+        (np.array(float)) -- feature vectors, shape = (n_lipids, n_features)
+"""
+    n, n_lc, n_fm, n_ad = len(lipid_classes), len(_ccs_lc_codes), len(_ccs_fm_codes), len(_ccs_ad_codes)
+    X = np.zeros((n, n_lc + n_fm + n_ad + 3))
+    rows = np.arange(n)
+    for offset, codes, values in [(0, _ccs_lc_codes, lipid_classes), (n_lc, _ccs_fm_codes, fa_mods),
+                                  (n_lc + n_fm, _ccs_ad_codes, adducts)]:
+        cols = np.array([codes.get(_, -1) for _ in values], dtype=int)
+        ok = cols >= 0
+        X[rows[ok], offset + cols[ok]] = 1.
+    X[:, -3] = np.array(lipid_ncs, dtype=float)
+    X[:, -2] = np.array(lipid_nus, dtype=float)
+    X[:, -1] = np.array(mzs, dtype=float)
+    return X
+
+
+# lookup tables mapping lipid_class and fa_mod to their one-hot column (the OneHotEncoders from
+# train_lipid_rt_pred.prep_encoders() order their categories by sorting them, duplicates are only encoded once)
+_rt_lc_codes = {_: i for i, _ in enumerate(sorted(set(rt_lipid_classes)))}
+_rt_fm_codes = {_: i for i, _ in enumerate(sorted(set(rt_fa_mods)))}
+
+
+def rt_featurize_batch(lipid_classes, lipid_ncs, lipid_nus, fa_mods):
+    """
+rt_featurize_batch
+    description:
+        generates numerical representations for an array of lipids, each row is exactly the same as the feature
+        vector from train_lipid_rt_pred.featurize(...) but the encoders are not needed: the categorical values are
+        mapped to their one-hot columns using lookup tables (anything that is not encodable, e.g. a fa_mod of None,
+        encodes as all 0s)
+    parameters:
+        lipid_classes (list(str)) -- lipid classes
+        lipid_ncs (list(int)) -- sum compositions: number of carbons
+        lipid_nus (list(int)) -- sum compositions: number of unsaturations
+        fa_mods (list(str)) -- fatty acid modifiers
+    returns:
+        (np.array(float)) -- feature vectors, shape = (n_lipids, n_features)
+"""
+    n, n_lc, n_fm = len(lipid_classes), len(_rt_lc_codes), len(_rt_fm_codes)
+    X = np.zeros((n, n_lc + n_fm + 2))
+    rows = np.arange(n)
+    for offset, codes, values in [(0, _rt_lc_codes, lipid_classes), (n_lc, _rt_fm_codes, fa_mods)]:
+        cols = np.array([codes.get(_, -1) for _ in values], dtype=int)
+        ok = cols >= 0
+        X[rows[ok], offset + cols[ok]] = 1.
+    X[:, -2] = np.array(lipid_ncs, dtype=float)
+    X[:, -1] = np.array(lipid_nus, dtype=float)
+    return X
@@ -12,30 +12,48 @@
 import os
 from sqlite3 import connect
 from json import load as jload
+from time import perf_counter
 
 from ..util import parse_lipid, print_and_log
 from .build_params import include_ref_dsets
-
-
-def add_src_dataset(cursor, src_tag, metadata, gid_start=0):
+from .db_table_defs import bulk_load_pragmas
+from .LipidMass.monoiso import adduct_charge
+
+
+# CCS metadata by source
+src_metadata = {
+    "zhou0817": {"type": "DT", "method": "single field, calibrated with Agilent tune mix (Agilent)"},
+    "hine1217": {"type": "TW", "method": "calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)"},
+    "hine0217": {"type": "TW", "method": "calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)"},
+    "hine0119": {"type": "TW", "method": "calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)"},
+    'leap0219': {"type": "DT", "method": "stepped-field"},
+    'blaz0818': {'type': 'DT', "method": 'single field'},
+    'vasi0120_pos': {'type': 'TIMS', 'method': 'calibrated with 4 ions from ESI LC/MS tuning mix (Agilent)'},
+    'vasi0120_neg': {'type': 'TIMS', 'method': 'calibrated with 4 ions from ESI LC/MS tuning mix (Agilent)'},
+    'vasi0120_neg_corr': {'type': 'TIMS', 'method': 'calibrated with 4 ions from ESI LC/MS tuning mix (Agilent) *linear correction applied to CCS*'},
+    'tsug0220_pos': {'type': 'TIMS', 'method': 'single field, calibrated'},
+    'tsug0220_neg': {'type': 'TIMS', 'method': 'single field, calibrated'},
+    'tsug0220_neg_corr': {'type': 'TIMS', 'method': 'single field, calibrated *linear correction applied to CCS'},
+    'hine0520': {'type': 'TW', 'method': 'calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)'}
+}
+
+
+def src_dataset_rows(src_tag, metadata, gid_start=0):
     """
-add_src_dataset
+src_dataset_rows
     description:
-        Adds values from a source dataset to the database, specified by a source tag
+        Generates rows for the measured table from a source dataset, specified by a source tag
     parameters:
-        cursor (sqlite3.cursor) -- cursor for running queries against the drugs.db database
-        src_tag (str) -- source tag 
+        src_tag (str) -- source tag
         metadata (dict(...)) -- CCS metadata: CCS type and method
         [gid_start (int)] -- starting number for m_id integer identifier [optional, default=0]
     returns:
-        (int) -- the next available m_id value
+        (list(tuple)) -- rows for the measured table
 """
     ref_file = os.path.join(os.path.dirname(__file__), "reference_data/{}.json".format(src_tag))
     with open(ref_file, "r") as j:
         jdata = jload(j)
-    # query string
-    # m_id, name, adduct, mz, ccs, smi, src_tag
-    qry = "INSERT INTO measured VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+    rows = []
     # s_id starts at 0 and goes up from there
     m_id = gid_start
     for cmpd in jdata:
@@ -75,13 +93,34 @@ add_src_dataset
             ccs_type, ccs_method = metadata["type"], metadata["method"]
 
             qdata = (
-                m_id, cmpd["name"], l_cl, l_nc, l_nu, fa_mod, adduct, cmpd["mz"], cmpd["ccs"],
+                m_id, cmpd["name"], l_cl, l_nc, l_nu, fa_mod, adduct, adduct_charge(adduct), cmpd["mz"], cmpd["ccs"],
                 rt, smi, src_tag, ccs_type, ccs_method
             )
-            cursor.execute(qry, qdata)
+            rows.append(qdata)
             m_id += 1
 
-    return m_id
+    return rows
+
+
+def add_src_dataset(cursor, src_tag, metadata, gid_start=0):
+    """
+add_src_dataset
+    description:
+        Adds values from a source dataset to the database, specified by a source tag
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for running queries against the drugs.db database
+        src_tag (str) -- source tag 
+        metadata (dict(...)) -- CCS metadata: CCS type and method
+        [gid_start (int)] -- starting number for m_id integer identifier [optional, default=0]
+    returns:
+        (int) -- the next available m_id value
+"""
+    rows = src_dataset_rows(src_tag, metadata, gid_start=gid_start)
+    # query string
+    # m_id, name, lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, charge, mz, ccs, rt, smi, src_tag, ccs_type,
+    # ccs_method
+    cursor.executemany("INSERT INTO measured VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+    return gid_start + len(rows)
 
 
 def main(tstamp):
@@ -91,37 +130,24 @@ def main(tstamp):
     db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_path)
     cur = con.cursor()
+    for pragma in bulk_load_pragmas:
+        cur.execute(pragma)
 
     # include reference datasets defined in build_params
     dsets = include_ref_dsets
 
-    # CCS metadata by source
-    metadata = {
-        "zhou0817": {"type": "DT", "method": "single field, calibrated with Agilent tune mix (Agilent)"},
-        "hine1217": {"type": "TW", "method": "calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)"},
-        "hine0217": {"type": "TW", "method": "calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)"},
-        "hine0119": {"type": "TW", "method": "calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)"},
-        'leap0219': {"type": "DT", "method": "stepped-field"},
-        'blaz0818': {'type': 'DT', "method": 'single field'},
-        'vasi0120_pos': {'type': 'TIMS', 'method': 'calibrated with 4 ions from ESI LC/MS tuning mix (Agilent)'},
-        'vasi0120_neg': {'type': 'TIMS', 'method': 'calibrated with 4 ions from ESI LC/MS tuning mix (Agilent)'},
-        'vasi0120_neg_corr': {'type': 'TIMS', 'method': 'calibrated with 4 ions from ESI LC/MS tuning mix (Agilent) *linear correction applied to CCS*'},
-        'tsug0220_pos': {'type': 'TIMS', 'method': 'single field, calibrated'},
-        'tsug0220_neg': {'type': 'TIMS', 'method': 'single field, calibrated'},
-        'tsug0220_neg_corr': {'type': 'TIMS', 'method': 'single field, calibrated *linear correction applied to CCS'},
-        'hine0520': {'type': 'TW', 'method': 'calibrated with phosphatidylcholines (ESI+) and phosphatidylethanolamines (ESI-)'}
-    }
-
     # add each src dataset
     build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
-    with open(build_log, 'w') as bl:  # this is the first build script so OK to clear out the log file
+    with open(build_log, 'a') as bl:
         print_and_log("\nadding cleaned datasets into lipids.db", bl)
 
         gid_next = 0
         for dset in dsets:
             print_and_log("\tadding dataset: {} ...".format(dset), bl, end=" ")
-            gid_next = add_src_dataset(cur, dset, metadata[dset], gid_start=gid_next)
-            print_and_log("ok", bl)
+            t0, gid_prev = perf_counter(), gid_next
+            gid_next = add_src_dataset(cur, dset, src_metadata[dset], gid_start=gid_next)
+            n = gid_next - gid_prev
+            print_and_log("ok ({} rows, {:.0f} rows/s)".format(n, n / (perf_counter() - t0)), bl)
         print_and_log("", bl)  # add a blank line
 
     # save changes to the database
@@ -10,33 +10,62 @@
 
 import os
 from sqlite3 import connect
+from time import perf_counter
 
+from .db_table_defs import bulk_load_pragmas
 from .mz_generation import enumerate_all_lipids
+from .LipidMass.monoiso import adduct_charge
 from ..util import parse_lipid, print_and_log
 
 
+def enumerated_mz_rows(batch_size=50000):
+    """
+enumerated_mz_rows
+    description:
+        Generates rows for the predicted_mz table from the enumerated m/z values, in batches. Each lipid name only
+        needs to be parsed once (not once per MS adduct).
+    parameters:
+        [batch_size (int)] -- number of rows per batch [optional, default=50000]
+    yields:
+        (list(tuple)) -- batch of rows: t_id, name, lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, charge, mz
+"""
+    parsed_names, charges = {}, {}
+    batch = []
+    # t_id starts at 0 and goes up from there
+    for t_id, (name, adduct, mz) in enumerate(enumerate_all_lipids()):
+        if name not in parsed_names:
+            # parse the lipid name for class, nc, nu and FA mod
+            parsed = parse_lipid(name)
+            fa_mod = parsed['fa_mod'] if 'fa_mod' in parsed else None
+            parsed_names[name] = (parsed['lipid_class'], parsed['n_carbon'], parsed['n_unsat'], fa_mod)
+        if adduct not in charges:
+            charges[adduct] = adduct_charge(adduct)
+        batch.append((t_id, name, *parsed_names[name], adduct, charges[adduct], float(mz)))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def add_enumerated_mz(cursor):
     """
-add_src_dataset
+add_enumerated_mz
     description:
         Adds enumerated m/z values into the database
     parameters:
-        cursor (sqlite3.cursor) -- cursor for running queries against the drugs.db database
+        cursor (sqlite3.cursor) -- cursor for running queries against the lipids.db database
+    returns:
+        (int) -- number of rows added
 """
-
     # query string
-    # t_id, name, adduct, mz
-    qry = 'INSERT INTO predicted_mz VALUES (?,?,?,?,?,?,?,?)'
-    # t_id starts at 0 and goes up from there
-    t_id = 0
-    for name, adduct, mz in enumerate_all_lipids():
-        # parse the lipid name for class, nc, nu and FA mod
-        parsed = parse_lipid(name)
-        lc, nc, nu = parsed['lipid_class'], parsed['n_carbon'], parsed['n_unsat']
-        fa_mod = parsed['fa_mod'] if 'fa_mod' in parsed else None
-        qdata = (t_id, name, lc, nc, nu, fa_mod, adduct, mz)
-        cursor.execute(qry, qdata)
-        t_id += 1
+    # t_id, name, lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, charge, mz
+    qry = 'INSERT INTO predicted_mz VALUES (?,?,?,?,?,?,?,?,?)'
+    n = 0
+    for batch in enumerated_mz_rows():
+        cursor.executemany(qry, batch)
+        n += len(batch)
+    return n
 
 
 def main(tstamp):
@@ -46,12 +75,15 @@ def main(tstamp):
     db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_path)
     cur = con.cursor()
+    for pragma in bulk_load_pragmas:
+        cur.execute(pragma)
 
     build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
     with open(build_log, 'a') as bl:
         print_and_log('adding predicted m/z into lipids.db ...', bl, end=' ')
-        add_enumerated_mz(cur)
-        print_and_log('ok\n', bl)
+        t0 = perf_counter()
+        n = add_enumerated_mz(cur)
+        print_and_log('ok ({} rows, {:.0f} rows/s)\n'.format(n, n / (perf_counter() - t0)), bl)
 
     # save changes to the database
     con.commit()
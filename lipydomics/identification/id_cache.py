@@ -0,0 +1,209 @@
+"""
+    lipydomics/identification/id_cache.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        A persistent (SQLite) cache of feature identification results. Results are keyed on everything that can
+        affect them: the lipid database version (and file signature), identification level(s), norm, m/z tolerance
+        type, tolerances, ESI mode, whether a retention time calibration was used, and the (rounded) m/z, rt and CCS
+        of the feature. Repeated calls to add_feature_ids(...) with the same parameters then only need to make
+        identifications for features that have not been seen before. The number of cached results is capped, with the
+        least recently used results evicted first.
+"""
+
+
+import os
+import json
+from math import isnan
+from sqlite3 import connect, Error as SQLiteError
+
+
+# number of decimal places the feature m/z, rt and CCS are rounded to in the cache keys
+_key_decimals = 6
+
+# missing (NaN) m/z, rt or CCS values are stored under this value in the cache keys, SQLite would store NaN as NULL
+# (which is not allowed in the primary key) and a real feature can not have this value
+_missing_key = float('-inf')
+
+
+def _default_paths():
+    """
+_default_paths
+    description:
+        default locations for the cache database, in order of preference: id_cache.db in the builds directory, then
+        in a lipydomics directory in the user cache directory ($XDG_CACHE_HOME, or ~/.cache), which is used when the
+        builds directory is not writable (e.g. read-only installation)
+    returns:
+        (list(str)) -- paths to the cache database
+"""
+    user_cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return [os.path.join(os.path.dirname(__file__), 'builds', 'id_cache.db'),
+            os.path.join(user_cache, 'lipydomics', 'id_cache.db')]
+
+
+class IdCache:
+    """
+IdCache
+    description:
+        Persistent cache of identification results, stored in a SQLite database. Counts of cache hits and misses
+        are kept in the `hits` and `misses` attributes (since this object was created).
+"""
+
+    def __init__(self, path=None, max_entries=1000000):
+        """
+IdCache.__init__
+    description:
+        Opens (or creates) the cache database
+    parameters:
+        [path (str or None)] -- path to the cache database, or None for the default (id_cache.db in the builds
+                                directory, or in the user cache directory if the builds directory is not writable,
+                                see _default_paths()) [optional, default=None]
+        [max_entries (int)] -- maximum number of cached results to keep, the least recently used results are evicted
+                                once this is exceeded [optional, default=1000000]
+"""
+        if type(max_entries) is not int or max_entries < 1:
+            m = 'IdCache: max_entries must be a positive integer (was: {})'.format(max_entries)
+            raise ValueError(m)
+        self.max_entries = max_entries
+        self.hits, self.misses = 0, 0
+        paths = [path] if path else _default_paths()
+        for i, self.path in enumerate(paths):
+            try:
+                self._con = self._open(self.path)
+                break
+            except (OSError, SQLiteError) as e:
+                # fall back on the next default location (if there is one)
+                if i == len(paths) - 1:
+                    m = 'IdCache: unable to open the cache database at {} for writing ({})'
+                    raise OSError(m.format(self.path, e)) from e
+        # monotonic counter used to track the order that results were last used in
+        self._tick = self._con.execute('SELECT IFNULL(MAX(last_used), 0) FROM results').fetchone()[0]
+
+    @staticmethod
+    def _open(path):
+        """
+IdCache._open
+    description:
+        connects to the cache database (creating it and its directory if needed) and makes sure that it can be
+        written to
+    parameters:
+        path (str) -- path to the cache database
+    returns:
+        (sqlite3.Connection) -- connection to the cache database
+"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        con = connect(path)
+        try:
+            con.execute('CREATE TABLE IF NOT EXISTS results (ctx TEXT, mz REAL, rt REAL, ccs REAL, ids TEXT, '
+                        'level TEXT, scores TEXT, last_used INTEGER, PRIMARY KEY (ctx, mz, rt, ccs)) WITHOUT ROWID')
+            con.execute('CREATE INDEX IF NOT EXISTS results_last_used_idx ON results (last_used)')
+            con.commit()
+            # the tables may already exist in a database that is read-only, so check that it can be written to (by
+            # writing back the same user_version)
+            user_version = con.execute('PRAGMA user_version').fetchone()[0]
+            con.execute('PRAGMA user_version = {}'.format(user_version))
+        except SQLiteError:
+            con.close()
+            raise
+        return con
+
+    @staticmethod
+    def context(db_version, level, norm, mz_tol_type, tol, esi_mode, calibrated_rt):
+        """
+IdCache.context
+    description:
+        generates the part of the cache key that is shared by all features in a call to add_feature_ids(...)
+    parameters:
+        db_version (str) -- lipid database version (time stamp and file signature)
+        level (str or list(str)) -- identification level, list of identification levels, or 'any'
+        norm (str) -- l1 or l2 norm for computing scores
+        mz_tol_type (str) -- 'Da' or 'ppm'
+        tol (list(float, float, float)) -- tolerance for m/z, rt, and CCS, respectively
+        esi_mode (str) -- ionization mode: 'neg', 'pos', or None for unspecified
+        calibrated_rt (bool) -- whether calibrated retention times are used
+    returns:
+        (str) -- context string
+"""
+        return json.dumps([db_version, level, norm, mz_tol_type, [float(_) for _ in tol], esi_mode,
+                           bool(calibrated_rt)])
+
+    def get(self, ctx, features):
+        """
+IdCache.get
+    description:
+        looks up cached identification results for a list of features
+    parameters:
+        ctx (str) -- context string from IdCache.context(...)
+        features (list(tuple(float))) -- m/z, rt, CCS (and anything else, ignored) for each feature
+    returns:
+        (list(tuple(list(str) or str, str, list(float)) or None)) -- cached results for each feature, None if a
+                                                                        feature is not in the cache
+"""
+        self._con.execute('DROP TABLE IF EXISTS temp.cache_query')
+        self._con.execute('CREATE TEMP TABLE cache_query (i INTEGER PRIMARY KEY, mz REAL, rt REAL, ccs REAL)')
+        self._con.executemany('INSERT INTO temp.cache_query VALUES (?,?,?,?)',
+                              [(i, *self._round(feat)) for i, feat in enumerate(features)])
+        qry = 'SELECT q.i, r.ids, r.level, r.scores FROM temp.cache_query AS q JOIN results AS r ' \
+              + 'ON r.ctx=? AND r.mz=q.mz AND r.rt=q.rt AND r.ccs=q.ccs'
+        results = [None for _ in features]
+        for i, ids, level, scores in self._con.execute(qry, (ctx,)).fetchall():
+            results[i] = (json.loads(ids), level, json.loads(scores))
+        self._con.execute('DROP TABLE temp.cache_query')
+        # mark the results that were found as used
+        found = [i for i, res in enumerate(results) if res is not None]
+        self._tick += 1
+        self._con.executemany('UPDATE results SET last_used=? WHERE ctx=? AND mz=? AND rt=? AND ccs=?',
+                              [(self._tick, ctx, *self._round(features[i])) for i in found])
+        self._con.commit()
+        self.hits += len(found)
+        self.misses += len(features) - len(found)
+        return results
+
+    def put(self, ctx, features, results):
+        """
+IdCache.put
+    description:
+        adds identification results for a list of features to the cache, then evicts the least recently used results
+        if the cache has grown beyond its maximum size
+    parameters:
+        ctx (str) -- context string from IdCache.context(...)
+        features (list(tuple(float))) -- m/z, rt, CCS (and anything else, ignored) for each feature
+        results (list(tuple(list(str) or str, str, list(float)))) -- identification results for each feature
+"""
+        self._tick += 1
+        qdata = [(ctx, *self._round(feat), json.dumps(ids), level, json.dumps(scores), self._tick)
+                 for feat, (ids, level, scores) in zip(features, results)]
+        self._con.executemany('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?,?)', qdata)
+        n = self._con.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        if n > self.max_entries:
+            qry = 'DELETE FROM results WHERE (ctx, mz, rt, ccs) IN (SELECT ctx, mz, rt, ccs FROM results ' \
+                  + 'ORDER BY last_used LIMIT ?)'
+            self._con.execute(qry, (n - self.max_entries,))
+        self._con.commit()
+
+    def __len__(self):
+        return self._con.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def clear(self):
+        """
+IdCache.clear
+    description:
+        removes all cached results and resets the hit/miss counters
+"""
+        self._con.execute('DELETE FROM results')
+        self._con.commit()
+        self.hits, self.misses = 0, 0
+
+    def close(self):
+        """
+IdCache.close
+    description:
+        closes the connection to the cache database
+"""
+        self._con.close()
+
+    @staticmethod
+    def _round(feat):
+        """ round the m/z, rt and CCS of a feature for use in a cache key (missing values use _missing_key) """
+        return tuple([_missing_key if isnan(x) else round(x, _key_decimals) for x in map(float, feat[:3])])
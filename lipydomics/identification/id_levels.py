@@ -8,7 +8,29 @@
 """
 
 
-from lipydomics.util import get_score
+from numpy import nan
+
+from lipydomics.util import get_scores
+
+
+# for each identification level: the reference table ('measured' or 'predicted') and whether rt and CCS are matched
+level_defs = {
+    'meas_mz_rt_ccs': ('measured', True, True),
+    'pred_mz_rt_ccs': ('predicted', True, True),
+    'meas_mz_rt': ('measured', True, False),
+    'pred_mz_rt': ('predicted', True, False),
+    'meas_mz_ccs': ('measured', False, True),
+    'pred_mz_ccs': ('predicted', False, True),
+    'meas_mz': ('measured', False, False),
+    'pred_mz': ('predicted', False, False)
+}
+
+
+# identification levels attempted (in order) for the 'any' identification level, with and without retention time
+any_levels = [
+    'meas_mz_rt_ccs', 'pred_mz_rt_ccs', 'meas_mz_rt', 'pred_mz_rt', 'meas_mz_ccs', 'pred_mz_ccs', 'meas_mz', 'pred_mz'
+]
+any_levels_no_rt = ['meas_mz_ccs', 'pred_mz_ccs', 'meas_mz', 'pred_mz']
 
 
 def id_feat_pred_mz(cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm=None):
@@ -29,21 +51,23 @@ id_feat_pred_mz
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz FROM predicted_mz WHERE mz BETWEEN ? AND ?'
+    qry = 'SELECT name, adduct, mz FROM predicted WHERE mz BETWEEN ? AND ?'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND charge > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND charge < 0'
+    qry += ' ORDER BY t_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     for name, adduct, mz_x in cursor.execute(qry, (mz_min, mz_max)).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs, mz_q=mz, mz_x=mz_x))
+        x.append((mz_x, nan, nan))
 
     if putative_ids:
+        putative_scores = get_scores((mz, nan, nan), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
         return putative_ids, 'pred_mz', putative_scores
     else:
         return '', '', []
@@ -69,20 +93,22 @@ id_feat_meas_mz
 """
     qry = 'SELECT name, adduct, mz FROM measured WHERE mz BETWEEN ? AND ?'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND charge > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND charge < 0'
+    qry += ' ORDER BY m_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     for name, adduct, mz_x in cursor.execute(qry, (mz_min, mz_max)).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs, mz_q=mz, mz_x=mz_x))
+        x.append((mz_x, nan, nan))
 
     if putative_ids:
-        return putative_ids, 'pred_mz', putative_scores
+        putative_scores = get_scores((mz, nan, nan), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
+        return putative_ids, 'meas_mz', putative_scores
     else:
         return '', '', []
 
@@ -105,24 +131,25 @@ id_feat_pred_mz_rt
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz, rt FROM predicted_mz JOIN predicted_rt ON ' \
-            + 'predicted_mz.t_id=predicted_rt.t_id WHERE mz BETWEEN ? AND ? AND rt BETWEEN ? and ?'
+    qry = 'SELECT name, adduct, mz, rt FROM predicted WHERE mz BETWEEN ? AND ? AND rt BETWEEN ? AND ?'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND charge > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND charge < 0'
+    qry += ' ORDER BY t_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
     rt_min = rt - tol_rt
     rt_max = rt + tol_rt
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     for name, adduct, mz_x, rt_x in cursor.execute(qry, (mz_min, mz_max, rt_min, rt_max)).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs, mz_q=mz, rt_q=rt, mz_x=mz_x, rt_x=rt_x))
+        x.append((mz_x, rt_x, nan))
 
     if putative_ids:
+        putative_scores = get_scores((mz, rt, nan), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
         return putative_ids, 'pred_mz_rt', putative_scores
     else:
         return '', '', []
@@ -146,24 +173,25 @@ id_feat_pred_mz_ccs
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz, ccs FROM predicted_mz JOIN predicted_ccs ON ' \
-            + 'predicted_mz.t_id=predicted_ccs.t_id WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? and ?'
+    qry = 'SELECT name, adduct, mz, ccs FROM predicted WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? AND ?'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND charge > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND charge < 0'
+    qry += ' ORDER BY t_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
     ccs_min = ccs - tol_ccs
     ccs_max = ccs + tol_ccs
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     for name, adduct, mz_x, ccs_x in cursor.execute(qry, (mz_min, mz_max, ccs_min, ccs_max)).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs, mz_q=mz, ccs_q=ccs, mz_x=mz_x, ccs_x=ccs_x))
+        x.append((mz_x, nan, ccs_x))
 
     if putative_ids:
+        putative_scores = get_scores((mz, nan, ccs), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
         return putative_ids, 'pred_mz_ccs', putative_scores
     else:
         return '', '', []
@@ -187,14 +215,13 @@ id_feat_pred_mz_rt_ccs
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz, rt, ccs FROM predicted_mz JOIN predicted_ccs ON ' \
-            + 'predicted_mz.t_id=predicted_ccs.t_id JOIN predicted_rt ON ' \
-            + 'predicted_mz.t_id=predicted_rt.t_id WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? AND ? AND ' \
+    qry = 'SELECT name, adduct, mz, rt, ccs FROM predicted WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? AND ? AND ' \
             + 'rt BETWEEN ? AND ?'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND charge > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND charge < 0'
+    qry += ' ORDER BY t_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
@@ -203,15 +230,14 @@ id_feat_pred_mz_rt_ccs
     rt_min = rt - tol_rt
     rt_max = rt + tol_rt
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     qdata = (mz_min, mz_max, ccs_min, ccs_max, rt_min, rt_max)
     for name, adduct, mz_x, rt_x, ccs_x in cursor.execute(qry, qdata).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs,
-                                         mz_q=mz, rt_q=rt, ccs_q=ccs,
-                                         mz_x=mz_x, rt_x=rt_x, ccs_x=ccs_x))
+        x.append((mz_x, rt_x, ccs_x))
 
     if putative_ids:
+        putative_scores = get_scores((mz, rt, ccs), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
         return putative_ids, 'pred_mz_rt_ccs', putative_scores
     else:
         return '', '', []
@@ -235,24 +261,29 @@ id_feat_pred_meas_mz_ccs
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz, ccs FROM measured WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? and ?'
+    # box query on the R*Tree then check the exact values (R*Tree coordinates are single precision)
+    qry = 'SELECT m.name, m.adduct, m.mz, m.ccs FROM measured_rtree AS b CROSS JOIN measured AS m ' \
+            + 'WHERE b.mz_min <= ?2 AND b.mz_max >= ?1 AND b.ccs_min <= ?4 AND b.ccs_max >= ?3 AND m.m_id=b.m_id ' \
+            + 'AND m.mz BETWEEN ?1 AND ?2 AND m.ccs BETWEEN ?3 AND ?4'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND b.charge_min > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND b.charge_max < 0'
+    qry += ' ORDER BY m.m_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
     ccs_min = ccs - tol_ccs
     ccs_max = ccs + tol_ccs
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     qdata = (mz_min, mz_max, ccs_min, ccs_max)
     for name, adduct, mz_x, ccs_x in cursor.execute(qry, qdata).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs, mz_q=mz, ccs_q=ccs, mz_x=mz_x, ccs_x=ccs_x))
+        x.append((mz_x, nan, ccs_x))
 
     if putative_ids:
+        putative_scores = get_scores((mz, nan, ccs), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
         return putative_ids, 'meas_mz_ccs', putative_scores
     else:
         return '', '', []
@@ -276,24 +307,29 @@ id_feat_meas_mz_rt
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz, rt FROM measured WHERE mz BETWEEN ? AND ? AND rt BETWEEN ? and ?'
+    # box query on the R*Tree then check the exact values (R*Tree coordinates are single precision)
+    qry = 'SELECT m.name, m.adduct, m.mz, m.rt FROM measured_rtree AS b CROSS JOIN measured AS m ' \
+            + 'WHERE b.mz_min <= ?2 AND b.mz_max >= ?1 AND b.rt_min <= ?4 AND b.rt_max >= ?3 AND m.m_id=b.m_id ' \
+            + 'AND m.mz BETWEEN ?1 AND ?2 AND m.rt BETWEEN ?3 AND ?4'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND b.charge_min > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND b.charge_max < 0'
+    qry += ' ORDER BY m.m_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
     rt_min = rt - tol_rt
     rt_max = rt + tol_rt
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     for name, adduct, mz_x, rt_x in cursor.execute(qry, (mz_min, mz_max, rt_min, rt_max)).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs, mz_q=mz, rt_q=rt, mz_x=mz_x, rt_x=rt_x))
+        x.append((mz_x, rt_x, nan))
 
     if putative_ids:
-        return putative_ids, 'pred_mz_rt', putative_scores
+        putative_scores = get_scores((mz, rt, nan), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
+        return putative_ids, 'meas_mz_rt', putative_scores
     else:
         return '', '', []
 
@@ -316,12 +352,16 @@ id_feat_pred_meas_mz_rt_ccs
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    qry = 'SELECT name, adduct, mz, rt, ccs FROM measured WHERE ' + \
-            'mz BETWEEN ? AND ? AND rt BETWEEN ? and ? AND ccs BETWEEN ? and ?'
+    # box query on the R*Tree then check the exact values (R*Tree coordinates are single precision)
+    qry = 'SELECT m.name, m.adduct, m.mz, m.rt, m.ccs FROM measured_rtree AS b CROSS JOIN measured AS m ' \
+            + 'WHERE b.mz_min <= ?2 AND b.mz_max >= ?1 AND b.rt_min <= ?4 AND b.rt_max >= ?3 AND b.ccs_min <= ?6 ' \
+            + 'AND b.ccs_max >= ?5 AND m.m_id=b.m_id AND m.mz BETWEEN ?1 AND ?2 AND m.rt BETWEEN ?3 AND ?4 ' \
+            + 'AND m.ccs BETWEEN ?5 AND ?6'
     if esi_mode == 'pos':
-        qry += ' AND adduct LIKE "%+"'
+        qry += ' AND b.charge_min > 0'
     elif esi_mode == 'neg':
-        qry += ' AND adduct LIKE "%-"'
+        qry += ' AND b.charge_max < 0'
+    qry += ' ORDER BY m.m_id'
 
     mz_min = mz - tol_mz
     mz_max = mz + tol_mz
@@ -330,20 +370,97 @@ id_feat_pred_meas_mz_rt_ccs
     ccs_min = ccs - tol_ccs
     ccs_max = ccs + tol_ccs
 
-    putative_ids, putative_scores = [], []
+    putative_ids, x = [], []
     qdata = (mz_min, mz_max, rt_min, rt_max, ccs_min, ccs_max)
     for name, adduct, mz_x, rt_x, ccs_x in cursor.execute(qry, qdata).fetchall():
         putative_ids.append('{}_{}'.format(name, adduct))
-        putative_scores.append(get_score(tol_mz, tol_rt, tol_ccs,
-                                         mz_q=mz, rt_q=rt, ccs_q=ccs,
-                                         mz_x=mz_x, rt_x=rt_x, ccs_x=ccs_x))
+        x.append((mz_x, rt_x, ccs_x))
 
     if putative_ids:
+        putative_scores = get_scores((mz, rt, ccs), x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
         return putative_ids, 'meas_mz_rt_ccs', putative_scores
     else:
         return '', '', []
 
 
+def tiered_id(levels, candidates, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, norm='l2'):
+    """
+tiered_id
+    description:
+        Assigns identification levels to a set of candidates that have already been matched on m/z (from the measured
+        and/or predicted tables), the identification levels are checked in the order they are provided and all of the
+        candidates that satisfy the first level with any matches are returned. This produces exactly the same results
+        as querying the database for each identification level in turn, without any additional queries.
+    parameters:
+        levels (list(str)) -- list of identification levels to try, will be attempted in the order they are provided
+        candidates (dict(str:list(tuple))) -- name, adduct, m/z, rt, and CCS of all candidates within the m/z
+                                                tolerance, for each reference table ('measured' or 'predicted')
+                                                required by the identification levels, in order of their identifiers
+        mz (float) -- m/z to match
+        rt (float) -- retention time to match
+        ccs (float) -- CCS to match
+        tol_mz (float) -- tolerance for m/z
+        tol_rt (float) -- tolerance for retention time
+        tol_ccs (float) -- tolerance for CCS
+        [norm (str)] -- specify l1 or l2 norm for computing scores [optional, default='l2']
+    returns:
+        (str or list(str)), (str), (list(float)) -- putative identification(s) (or '' for no matches), identification
+                                                    level, and scores
+"""
+    rt_min, rt_max = rt - tol_rt, rt + tol_rt
+    ccs_min, ccs_max = ccs - tol_ccs, ccs + tol_ccs
+    for lvl in levels:
+        src, use_rt, use_ccs = level_defs[lvl]
+        putative_ids, x = [], []
+        for name, adduct, mz_x, rt_x, ccs_x in candidates[src]:
+            # equivalent to: rt BETWEEN rt_min AND rt_max, ccs BETWEEN ccs_min AND ccs_max (NULL never matches)
+            if use_rt and (rt_x is None or not rt_min <= rt_x <= rt_max):
+                continue
+            if use_ccs and (ccs_x is None or not ccs_min <= ccs_x <= ccs_max):
+                continue
+            putative_ids.append('{}_{}'.format(name, adduct))
+            x.append((mz_x, rt_x if use_rt else nan, ccs_x if use_ccs else nan))
+        if putative_ids:
+            q = (mz, rt if use_rt else nan, ccs if use_ccs else nan)
+            putative_scores = get_scores(q, x, (tol_mz, tol_rt, tol_ccs), norm=norm).tolist()
+            return putative_ids, lvl, putative_scores
+
+    return '', '', []
+
+
+def id_feat_tiered(levels, cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm='l2'):
+    """
+id_feat_tiered
+    description:
+        Fetches all candidates within the m/z tolerance with a single query on each of the reference tables that are
+        required by the identification levels, then assigns the identification levels using tiered_id(...)
+    parameters:
+        levels (list(str)) -- list of identification levels to try, will be attempted in the order they are provided
+        cursor (sqlite3.Cursor) -- cursor for querying lipids.db
+        mz (float) -- m/z to match
+        rt (float) -- retention time to match
+        ccs (float) -- CCS to match
+        tol_mz (float) -- tolerance for m/z
+        tol_rt (float) -- tolerance for retention time
+        tol_ccs (float) -- tolerance for CCS
+        esi_mode (str) -- filter results by ionization mode: 'neg', 'pos', or None for unspecified
+        [norm (str)] -- specify l1 or l2 norm for computing scores [optional, default='l2']
+    returns:
+        (str or list(str)), (str), (list(float)) -- putative identification(s) (or '' for no matches), identification
+                                                    level, and scores
+"""
+    candidates = {}
+    for src in set([level_defs[lvl][0] for lvl in levels]):
+        qry = 'SELECT name, adduct, mz, rt, ccs FROM {} WHERE mz BETWEEN ? AND ?'.format(src)
+        if esi_mode == 'pos':
+            qry += ' AND charge > 0'
+        elif esi_mode == 'neg':
+            qry += ' AND charge < 0'
+        qry += ' ORDER BY {}'.format('m_id' if src == 'measured' else 't_id')
+        candidates[src] = cursor.execute(qry, (mz - tol_mz, mz + tol_mz)).fetchall()
+    return tiered_id(levels, candidates, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, norm=norm)
+
+
 def id_feat_any(cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm='l2', use_rt=True):
     """
 id_feat_any
@@ -364,31 +481,8 @@ id_feat_any
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    if use_rt:
-        id_funcs = [
-            id_feat_meas_mz_rt_ccs,
-            id_feat_pred_mz_rt_ccs,
-            id_feat_meas_mz_rt,
-            id_feat_pred_mz_rt,
-            id_feat_meas_mz_ccs,
-            id_feat_pred_mz_ccs,
-            id_feat_meas_mz,
-            id_feat_pred_mz
-        ]
-    else:
-        id_funcs = [
-            id_feat_meas_mz_ccs,
-            id_feat_pred_mz_ccs,
-            id_feat_meas_mz,
-            id_feat_pred_mz
-        ]
-
-    for f in id_funcs:
-        fid, lvl, scr = f(cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm=norm)
-        if fid:
-            return fid, lvl, scr
-
-    return '', '', []
+    levels = any_levels if use_rt else any_levels_no_rt
+    return id_feat_tiered(levels, cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm=norm)
 
 
 def id_feat_custom(levels, cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm='l2'):
@@ -411,28 +505,12 @@ id_feat_custom
     returns:
         (str or list(str)), (str) -- putative identification(s) (or '' for no matches), identification level
 """
-    level_to_id_func = {
-        'meas_mz_rt_ccs': id_feat_meas_mz_rt_ccs,
-        'pred_mz_rt_ccs': id_feat_pred_mz_rt_ccs,
-        'meas_mz_rt': id_feat_meas_mz_rt,
-        'pred_mz_rt': id_feat_pred_mz_rt,
-        'meas_mz_ccs': id_feat_meas_mz_ccs,
-        'pred_mz_ccs': id_feat_pred_mz_ccs,
-        'meas_mz': id_feat_meas_mz,
-        'pred_mz': id_feat_pred_mz
-    }
     # check that the identification levels are defined
     for lvl in levels:
         if lvl == 'any':
             m = 'id_feat_custom: the special "any" ID level is invalid in a custom ID level list'
             raise ValueError(m)
-        elif lvl not in level_to_id_func:
+        elif lvl not in level_defs:
             m = 'id_feat_custom: identification level "{}" is not defined'
             raise ValueError(m.format(lvl))
-    id_funcs = [level_to_id_func[lvl] for lvl in levels]
-    for f in id_funcs:
-        fid, lvl, scr = f(cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm=norm)
-        if fid:
-            return fid, lvl, scr
-
-    return '', '', []
+    return id_feat_tiered(levels, cursor, mz, rt, ccs, tol_mz, tol_rt, tol_ccs, esi_mode, norm=norm)
@@ -0,0 +1,84 @@
+"""
+    index_database.py
+    Dylan H. Ross
+    2026/10/15
+
+        Final (post-build) stage of building lipids.db: fills the denormalized `predicted` table used for the predicted
+        identification levels, creates the covering indexes used for m/z range queries on measured values, and fills
+        the R*Tree table used for the measured m/z, rt, and CCS box queries. This can also be run on an existing
+        database to add these to it.
+"""
+
+
+import os
+from sqlite3 import connect
+
+from .db_table_defs import measured_rtree, predicted, indexes, bulk_load_pragmas
+from ..util import print_and_log
+
+
+# missing rt values span this range in the R*Tree table so that they are matched by any box query on that dimension,
+# the exact values are always checked against the base table
+_rtree_inf = 1.e9
+
+
+def add_predicted(cursor):
+    """
+add_predicted
+    description:
+        Creates the `predicted` table (if it is not already present) then (re)fills it by joining the predicted CCS and
+        retention times onto the predicted m/z values
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for running queries against the lipids.db database
+"""
+    cursor.execute(predicted)
+    cursor.execute('DELETE FROM predicted')
+    qry = 'INSERT INTO predicted SELECT m.t_id, m.name, m.lipid_class, m.lipid_nc, m.lipid_nu, m.fa_mod, m.adduct, ' \
+          + 'm.charge, m.mz, c.ccs, r.rt FROM predicted_mz AS m LEFT JOIN predicted_ccs AS c ON c.t_id=m.t_id ' \
+          + 'LEFT JOIN predicted_rt AS r ON r.t_id=m.t_id ORDER BY m.mz, m.t_id'
+    cursor.execute(qry)
+
+
+def add_indexes(cursor):
+    """
+add_indexes
+    description:
+        Creates the covering indexes and R*Tree table (if they are not already present) then (re)fills the R*Tree
+        table from the measured values, and updates the statistics used by the query planner
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for running queries against the lipids.db database
+"""
+    for idx in indexes:
+        cursor.execute(idx)
+    cursor.execute(measured_rtree)
+
+    cursor.execute('DELETE FROM measured_rtree')
+    qry = 'INSERT INTO measured_rtree SELECT m_id, mz, mz, IFNULL(rt, ?), IFNULL(rt, ?), ccs, ccs, charge, charge ' \
+          + 'FROM measured'
+    cursor.execute(qry, (-_rtree_inf, _rtree_inf))
+
+    cursor.execute('ANALYZE')
+
+
+def main(tstamp):
+    """ main build function """
+
+    # connect to database
+    db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
+    con = connect(db_path)
+    cur = con.cursor()
+    for pragma in bulk_load_pragmas:
+        cur.execute(pragma)
+
+    build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
+    with open(build_log, 'a') as bl:
+        print_and_log('adding combined predicted values into lipids.db ...', bl, end=' ')
+        add_predicted(cur)
+        print_and_log('ok\n', bl)
+        print_and_log('adding indexes into lipids.db ...', bl, end=' ')
+        add_indexes(cur)
+        print_and_log('ok\n', bl)
+
+    # save changes to the database
+    con.commit()
+    con.close()
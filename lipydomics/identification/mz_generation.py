@@ -5,9 +5,18 @@
 
     description:
         utilities to generate predicted m/z data for lipids
+
+
+        Masses are enumerated for whole lipid classes at once: the chemical formula of each lipid class is represented
+        as element-count vectors (core formula, plus increments per acyl carbon and per unsaturation) so that the
+        masses for every sum composition are computed with a single matrix-vector product against the atomic masses
 """
 
 
+from functools import partial
+import numpy as np
+
+from .LipidMass.monoiso import a_to_m, adduct_to_m, adduct_to_z
 from .LipidMass.lipids.glycerolipids import DG, TG
 from .LipidMass.lipids.glycolipids import DGDG, GlcADG, MGDG
 from .LipidMass.lipids.glycerophospholipids import (
@@ -55,6 +64,108 @@ enumerate_lipid_class
                 yield lipid.name(), adduct, lipid.ms_adduct_monoiso(adduct)
 
 
+# element order for the element-count vectors, and the corresponding atomic masses
+_elements = list(a_to_m)
+_element_masses = np.array([a_to_m[_] for _ in _elements])
+
+
+def formula_vector(formula):
+    """
+formula_vector
+    description:
+        converts a chemical formula into an element-count vector (elements in the same order as _elements)
+    parameters:
+        formula (dict(str:int)) -- chemical formula expressed as atom ids mapped to their counts
+    returns:
+        (numpy.ndarray(int)) -- element counts
+"""
+    for atom in formula:
+        if atom not in a_to_m:
+            raise ValueError('formula_vector: atom id {} not available in a_to_m'.format(atom))
+    return np.array([formula[_] if _ in formula else 0 for _ in _elements])
+
+
+def lipid_class_vectors(lipid_class_obj, fa_mod=None):
+    """
+lipid_class_vectors
+    description:
+        Determines the element-count vectors for a lipid class: its core formula (i.e. with a sum composition of 0:0)
+        and the increments for each additional acyl carbon and unsaturation. These are taken from the formulas of the
+        LipidMass.Lipid objects for the lipid class (which are linear in the sum composition) so that the lipid class
+        definitions stay in one place.
+    parameters:
+        lipid_class_obj (LipidMass.Lipid) -- reference to uninitialized lipid class object
+        [fa_mod (None or str)] -- fatty acid modifier [optional, default=None]
+    returns:
+        (numpy.ndarray(int), numpy.ndarray(int), numpy.ndarray(int)) -- core formula, increment per acyl carbon, and
+                                                                        increment per unsaturation
+"""
+    def formula(nc, nu):
+        lipid = lipid_class_obj(nc, nu, fa_mod=fa_mod) if fa_mod else lipid_class_obj(nc, nu)
+        return formula_vector(lipid.formula)
+
+    f0 = formula(20, 2)
+    per_c, per_u = formula(21, 2) - f0, formula(20, 3) - f0
+    return f0 - 20 * per_c - 2 * per_u, per_c, per_u
+
+
+def enumerate_lipid_class_array(lipid_class_obj, n_carbon_bounds, n_unsat_bounds, adducts, fa_mod=None,
+                                limit_nu=True, nc_step=1):
+    """
+enumerate_lipid_class_array
+    description:
+        Array version of enumerate_lipid_class(...), produces exactly the same lipids (in the same order) and masses.
+        The element counts for every sum composition are computed from the lipid class element-count vectors and the
+        neutral masses come from a single matrix-vector product against the atomic masses, then the adduct masses
+        are added for the whole (sum composition, adduct) grid at once.
+    parameters:
+        lipid_class_obj (LipidMass.Lipid) -- reference to uninitialized lipid class object
+        n_carbon_bounds (tuple(int)) -- upper and lower bonds (inclusive) of total carbon number to include
+        n_unsat_bounds (tuple(int)) -- upper and lower bonds (inclusive) of total unsaturations to include
+        adducts (list(str)) -- all MS adducts to include
+        [fa_mod (None or str)] -- fatty acid modifier to indicate plasmalogen or ether lipids ('p' and 'o',
+                                    respectively) or None [optional, default=None]
+        [limit_nu (bool)] -- apply the bounds discussed in enumerate_lipid_class(...) to the maximum number of
+                                unsaturations on the basis of carbon count [optional, default=True]
+        [nc_step (int)] -- step between carbon numbers [optional, default=1]
+    returns:
+        (list(str), list(str), numpy.ndarray(float)) -- names, adducts, and monoisotopic masses
+"""
+    nc_min, nc_max = n_carbon_bounds
+    nu_min, nu_max = n_unsat_bounds
+    ncs, nus = [], []
+    for nc in range(nc_min, nc_max + 1, nc_step):
+        # apply upper limit on unsaturations based on number of carbons
+        if limit_nu:
+            nu_max_ = min(nu_max, 6) if nc < 36 else (min(nu_max, 12) if nc < 54 else min(nu_max, 18))
+        else:
+            nu_max_ = nu_max
+        for nu in range(nu_min, (nu_max_ + 1)):
+            ncs.append(nc)
+            nus.append(nu)
+    for adduct in adducts:
+        if adduct not in adduct_to_m:
+            m = 'enumerate_lipid_class_array: MS adduct {} not available in adduct_to_m'.format(adduct)
+            raise ValueError(m)
+
+    # neutral monoisotopic masses for all sum compositions
+    core, per_c, per_u = lipid_class_vectors(lipid_class_obj, fa_mod=fa_mod)
+    counts = core + np.outer(ncs, per_c) + np.outer(nus, per_u)
+    # (rounding with round() rather than np.round() since the latter is not correctly rounded, which matters for the
+    # values that are exactly halfway between after dividing by the charge)
+    neutral = np.array([round(_, 6) for _ in np.dot(counts, _element_masses).tolist()])
+    # add the MS adducts (and divide by charge)
+    adduct_mass = np.dot([formula_vector(adduct_to_m[_]) for _ in adducts], _element_masses)
+    z = np.array([abs(adduct_to_z[_]) for _ in adducts])
+    mzs = np.array([round(_, 6) for _ in ((adduct_mass + neutral[:, np.newaxis]) / z).ravel().tolist()])
+
+    # lipid names (see LipidMass.Lipid.name())
+    ref = lipid_class_obj(nc_min, nu_min, fa_mod=fa_mod) if fa_mod else lipid_class_obj(nc_min, nu_min)
+    fmt = ref.lipid_class + '(' + (ref.fa_mod if fa_mod else '') + '{}:{})'
+    names = [fmt.format(nc, nu) for nc, nu in zip(ncs, nus) for _ in adducts]
+    return names, list(adducts) * len(ncs), mzs
+
+
 def enumerate_all_lipids():
     """
 enumerate_all_lipids
@@ -73,11 +184,11 @@ enumerate_all_lipids
     diagls = [DG, MGDG, DGDG, GlcADG]
     diagl_adducts = ['[M+NH4]+', '[M+Na]+', '[M+K]+', '[M-H]-', '[M+HCOO]-', '[M+CH3COO]-', '[M+Cl]-', '[M+H-H2O]+']
     for lc in diagls:
-        for l in enumerate_lipid_class(lc, diacyl_nc, diacyl_nu, diagl_adducts):
+        for l in zip(*enumerate_lipid_class_array(lc, diacyl_nc, diacyl_nu, diagl_adducts)):
             yield l
 
     # MGDG and TG
-    for l in enumerate_lipid_class(TG, (24, 72), (0, 24), ['[M+NH4]+', '[M+Na]+', '[M+K]+']):
+    for l in zip(*enumerate_lipid_class_array(TG, (24, 72), (0, 24), ['[M+NH4]+', '[M+Na]+', '[M+K]+'])):
         yield l
 
     # diacyl-glycerophospholipids (with plasmalogen and ether derivatives)
@@ -86,16 +197,16 @@ enumerate_all_lipids
                       '[M+Cl]-']
     for lc in diagpls:
         for fa_mod in [None, 'p', 'o']:
-            for l in enumerate_lipid_class(lc, diacyl_nc, diacyl_nu, diagpl_adducts, fa_mod=fa_mod):
+            for l in zip(*enumerate_lipid_class_array(lc, diacyl_nc, diacyl_nu, diagpl_adducts, fa_mod=fa_mod)):
                 yield l
 
     # AcylPG, AcylPE, CL, and LCL
     for lc in [AcylPG, AcylPE]:
-        for l in enumerate_lipid_class(lc, (24, 64), (0, 18), ['[M-H]-', '[M+Na]+']):
+        for l in zip(*enumerate_lipid_class_array(lc, (24, 64), (0, 18), ['[M-H]-', '[M+Na]+'])):
             yield l
-    for l in enumerate_lipid_class(CL, (36, 72), (0, 24), ['[M-2H]2-', '[M+2K]2+']):
+    for l in zip(*enumerate_lipid_class_array(CL, (36, 72), (0, 24), ['[M-2H]2-', '[M+2K]2+'])):
         yield l
-    for l in enumerate_lipid_class(LCL, (24, 64), (0, 18), ['[M-2H]2-', '[M+2K]2+']):
+    for l in zip(*enumerate_lipid_class_array(LCL, (24, 64), (0, 18), ['[M-2H]2-', '[M+2K]2+'])):
         yield l
 
     # (monoacyl) lysoglycerophospholipids
@@ -104,7 +215,7 @@ enumerate_all_lipids
     for lc in lgpls:
         for fa_mod in [None, 'p', 'o']:
             lgpl_nu = (0, 6)
-            for l in enumerate_lipid_class(lc, (12, 24), lgpl_nu, lgpl_adducts, fa_mod=fa_mod):
+            for l in zip(*enumerate_lipid_class_array(lc, (12, 24), lgpl_nu, lgpl_adducts, fa_mod=fa_mod)):
                 yield l
 
     # sphingolipids (Cer, HexCer, GlcCer, SM)
@@ -112,19 +223,18 @@ enumerate_all_lipids
     sls_adducts = ['[M+H]+', '[M+Na]+', '[M+HCOO]-', '[M+CH3COO]-', '[M-H]-', '[M+K]+', '[M+H-H2O]+']
     for lc in sls:
         # our sphingolipids will all have the 'd' FA mod
-        for l in enumerate_lipid_class(lc, (30, 44), (1, 7), sls_adducts, fa_mod='d'):
+        for l in zip(*enumerate_lipid_class_array(lc, (30, 44), (1, 7), sls_adducts, fa_mod='d')):
             yield l
 
     # gangliosides (only the most common species observed in human brain)
+    gs_adducts = ['[M+H]+', '[M+2H]2+', '[M+3H]3+', '[M-H]-', '[M-2H]2-', '[M-3H]3-']
     for gs in ['GA1', 'GA2', 'GA3', 'GM1', 'GM2', 'GM3', 'GD1', 'GD2', 'GD3', 'GT1', 'GT2', 'GT3', 'GQ1']:
-        for nc in range(28, 42, 2):
-            for nu in range(1, 5):
-                for ad in ['[M+H]+', '[M+2H]2+', '[M+3H]3+', '[M-H]-', '[M-2H]2-', '[M-3H]3-']:
-                    lipid = Ganglioside(gs, nc, nu, fa_mod='d')
-                    yield lipid.name(), ad, lipid.ms_adduct_monoiso(ad)
+        for l in zip(*enumerate_lipid_class_array(partial(Ganglioside, gs), (28, 40), (1, 4), gs_adducts, fa_mod='d',
+                                                  limit_nu=False, nc_step=2)):
+            yield l
 
     # fatty acids
-    for l in enumerate_lipid_class(FA, (10, 42), (0, 6), ['[M-H]-']):
+    for l in zip(*enumerate_lipid_class_array(FA, (10, 42), (0, 6), ['[M-H]-'])):
         yield l
 
 
@@ -0,0 +1,156 @@
+"""
+    lipydomics/identification/predictors.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        Reusable CCS and HILIC retention time predictors. Each predictor loads its predictive model (exported in the
+        compact .npz format, see compact_models.py) once, then featurizes and predicts whole arrays of lipids at a time
+        using NumPy only. A single instance of each is created lazily (on first use) and shared, see
+        get_ccs_predictor() and get_rt_predictor().
+"""
+
+
+import os
+import numpy as np
+
+from lipydomics.identification.compact_models import load_model
+from lipydomics.identification.featurization import ccs_featurize_batch, rt_featurize_batch
+
+
+# shared predictor instances, created on first use
+_ccs_predictor = None
+_rt_predictor = None
+
+
+def _load_model(model_fname):
+    """
+_load_model
+    description:
+        loads a predictive model (with its input scaling) from a .npz file in the identification module directory
+    parameters:
+        model_fname (str) -- file name of the exported model
+    returns:
+        (compact_models.SVRModel or compact_models.LinearModel) -- predictive model
+"""
+    return load_model(os.path.join(os.path.dirname(__file__), model_fname))
+
+
+class CCSPredictor:
+    """
+CCSPredictor
+    description:
+        Predicts CCS for lipids defined by lipid class, fatty acid sum composition, fatty acid modifier, MS adduct and
+        m/z, using the model trained by train_lipid_ccs_pred.py
+"""
+
+    def __init__(self):
+        """
+CCSPredictor.__init__
+    description:
+        loads the predictive model
+"""
+        self.model = _load_model('lipid_ccs_pred.npz')
+
+    def featurize(self, lipid_classes, lipid_ncs, lipid_nus, fa_mods, adducts, mzs):
+        """
+CCSPredictor.featurize
+    description:
+        generates numerical representations for an array of lipids (see featurization.ccs_featurize_batch(...))
+    parameters:
+        lipid_classes (list(str)) -- lipid classes
+        lipid_ncs (list(int)) -- sum compositions: number of carbons
+        lipid_nus (list(int)) -- sum compositions: number of unsaturations
+        fa_mods (list(str or None)) -- fatty acid modifiers
+        adducts (list(str)) -- MS adducts
+        mzs (list(float)) -- m/z values
+    returns:
+        (numpy.ndarray(float)) -- feature vectors, shape = (n_lipids, n_features)
+"""
+        return ccs_featurize_batch(lipid_classes, lipid_ncs, lipid_nus, fa_mods, adducts, mzs)
+
+    def predict(self, lipid_classes, lipid_ncs, lipid_nus, fa_mods, adducts, mzs):
+        """
+CCSPredictor.predict
+    description:
+        predicts CCS for an array of lipids (see CCSPredictor.featurize(...) for parameters)
+    returns:
+        (numpy.ndarray(float)) -- predicted CCS, shape = (n_lipids,)
+"""
+        if len(lipid_classes) == 0:
+            return np.array([], dtype=float)
+        x = self.featurize(lipid_classes, lipid_ncs, lipid_nus, fa_mods, adducts, mzs)
+        return self.model.predict(x)
+
+
+class RTPredictor:
+    """
+RTPredictor
+    description:
+        Predicts HILIC retention time for lipids defined by lipid class, fatty acid sum composition and fatty acid
+        modifier, using the model trained by train_lipid_rt_pred.py
+"""
+
+    def __init__(self):
+        """
+RTPredictor.__init__
+    description:
+        loads the predictive model
+"""
+        self.model = _load_model('lipid_rt_pred.npz')
+
+    def featurize(self, lipid_classes, lipid_ncs, lipid_nus, fa_mods):
+        """
+RTPredictor.featurize
+    description:
+        generates numerical representations for an array of lipids (see featurization.rt_featurize_batch(...))
+    parameters:
+        lipid_classes (list(str)) -- lipid classes
+        lipid_ncs (list(int)) -- sum compositions: number of carbons
+        lipid_nus (list(int)) -- sum compositions: number of unsaturations
+        fa_mods (list(str or None)) -- fatty acid modifiers
+    returns:
+        (numpy.ndarray(float)) -- feature vectors, shape = (n_lipids, n_features)
+"""
+        return rt_featurize_batch(lipid_classes, lipid_ncs, lipid_nus, fa_mods)
+
+    def predict(self, lipid_classes, lipid_ncs, lipid_nus, fa_mods):
+        """
+RTPredictor.predict
+    description:
+        predicts HILIC retention times for an array of lipids (see RTPredictor.featurize(...) for parameters)
+    returns:
+        (numpy.ndarray(float)) -- predicted retention times, shape = (n_lipids,)
+"""
+        if len(lipid_classes) == 0:
+            return np.array([], dtype=float)
+        x = self.featurize(lipid_classes, lipid_ncs, lipid_nus, fa_mods)
+        return self.model.predict(x)
+
+
+def get_ccs_predictor():
+    """
+get_ccs_predictor
+    description:
+        returns the shared CCSPredictor instance, creating it on first use
+    returns:
+        (CCSPredictor) -- CCS predictor
+"""
+    global _ccs_predictor
+    if _ccs_predictor is None:
+        _ccs_predictor = CCSPredictor()
+    return _ccs_predictor
+
+
+def get_rt_predictor():
+    """
+get_rt_predictor
+    description:
+        returns the shared RTPredictor instance, creating it on first use
+    returns:
+        (RTPredictor) -- retention time predictor
+"""
+    global _rt_predictor
+    if _rt_predictor is None:
+        _rt_predictor = RTPredictor()
+    return _rt_predictor
@@ -7,23 +7,24 @@
         Trains a predictive model for generating predicted CCS values
 
         * requires scikit-learn v0.21.3 ! *
+
+        scikit-learn is only imported when it is needed for training, the trained model is also exported in a compact
+        format that can be used for making predictions without it (see compact_models.py)
 """
 
 
 from sqlite3 import connect
 import os
 import pickle
+from time import perf_counter
 import numpy as np
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.model_selection import ShuffleSplit
-from sklearn.linear_model import LinearRegression
-from sklearn.svm import SVR
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
 
 from ..util import print_and_log
+from .compact_models import export_svr, export_linear
+from .db_table_defs import bulk_load_pragmas
 from .build_params import ccs_pred_ref_dsets
 from .encoder_params import ccs_lipid_classes, ccs_fa_mods, ccs_ms_adducts
+from .featurization import ccs_featurize_batch as featurize_batch, _ccs_lc_codes
 
 
 def prep_encoders():
@@ -35,6 +36,8 @@ prep_encoders
         c_encoder, f_encoder, a_encoder (sklearn.preprocessing.OneHotEncoder) -- encoders for lipid_class, fa_mod, and
                                                                                     adduct, respectively
 """
+    from sklearn.preprocessing import OneHotEncoder
+
     lipid_classes = [[_] for _ in ccs_lipid_classes]
     c_encoder = OneHotEncoder(sparse=False, handle_unknown='ignore').fit(lipid_classes)
     fa_mods = [[_] for _ in ccs_fa_mods]
@@ -82,6 +85,13 @@ train_new_model
     returns:
         mdl, scaler -- trained predictive model and input scaler instances
 """
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.model_selection import ShuffleSplit
+    from sklearn.linear_model import LinearRegression
+    from sklearn.svm import SVR
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import mean_squared_error
+
     # prepare encoders
     c_encoder, f_encoder, a_encoder = prep_encoders()
 
@@ -162,6 +172,15 @@ train_new_model
         pickle.dump(model, pf1)
         pickle.dump(scaler, pf2)
 
+    # export the model and the scaler in the compact format used for making predictions
+    npz_path = os.path.join(this_dir, 'lipid_ccs_pred.npz')
+    if use_model == 'svr':
+        export_svr(model, scaler, npz_path)
+    elif use_model == 'linear':
+        export_linear(model, scaler, npz_path)
+    else:
+        print_and_log('ML model "{}" cannot be exported to {}'.format(use_model, npz_path), bl)
+
     # return model and scaler
     return model, scaler
 
@@ -175,6 +194,8 @@ dump_split_data_to_files
     parameters:
         savedir (str) -- directory to save the dumped files into
 """
+    from sklearn.model_selection import ShuffleSplit
+
     # connect to database
     db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_path)
@@ -217,6 +238,53 @@ dump_split_data_to_files
     con.close()
 
 
+def predicted_ccs_rows(cursor, model, scaler, chunk_size=50000):
+    """
+predicted_ccs_rows
+    description:
+        predicts CCS for all of the lipids in the predicted_mz table that have an encodable lipid class. The
+        predicted_mz table is read in chunks and each chunk is featurized and predicted all at once
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+        model, scaler -- trained predictive model and input scaler instances
+        [chunk_size (int)] -- number of rows to featurize and predict at a time [optional, default=50000]
+    yields:
+        (list(tuple(int, float))) -- rows for the predicted_ccs table (t_id, ccs), one chunk at a time
+"""
+    rows = cursor.connection.cursor()
+    rows.execute('SELECT t_id, lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz FROM predicted_mz')
+    chunk = rows.fetchmany(chunk_size)
+    while chunk:
+        # make sure lipid class is encodable
+        chunk = [row for row in chunk if row[1] in _ccs_lc_codes]
+        if chunk:
+            tids, lcs, lncs, lnus, fams, adds, mzs = zip(*chunk)
+            ccs = model.predict(scaler.transform(featurize_batch(lcs, lncs, lnus, fams, adds, mzs)))
+            yield list(zip(tids, ccs.tolist()))
+        chunk = rows.fetchmany(chunk_size)
+
+
+def add_predicted_ccs(cursor, model, scaler, chunk_size=50000):
+    """
+add_predicted_ccs
+    description:
+        predicts CCS for all of the lipids in the predicted_mz table that have an encodable lipid class and adds them
+        to the predicted_ccs table, each chunk of predictions (see predicted_ccs_rows(...)) is inserted with a single
+        executemany (changes are not committed)
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+        model, scaler -- trained predictive model and input scaler instances
+        [chunk_size (int)] -- number of rows to featurize and predict at a time [optional, default=50000]
+    returns:
+        (int) -- number of predicted CCS values added
+"""
+    n = 0
+    for chunk in predicted_ccs_rows(cursor, model, scaler, chunk_size=chunk_size):
+        cursor.executemany('INSERT INTO predicted_ccs VALUES (?, ?)', chunk)
+        n += len(chunk)
+    return n
+
+
 def main(tstamp):
     """ main build function """
 
@@ -224,9 +292,8 @@ def main(tstamp):
     db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_path)
     cur = con.cursor()
-
-    # prepare encoders
-    c_encoder, f_encoder, a_encoder = prep_encoders()
+    for pragma in bulk_load_pragmas:
+        cur.execute(pragma)
 
     build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
     with open(build_log, 'a') as bl:
@@ -239,16 +306,9 @@ def main(tstamp):
 
         # add predicted CCS to the database
         print_and_log('\nadding predicted CCS to database ...', bl, end=' ')
-        qry = 'SELECT t_id, lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz FROM predicted_mz'
-        tid_to_ccs = {}
-        for tid, lc, lnc, lnu, fam, add, m in cur.execute(qry).fetchall():
-            if int(sum(c_encoder.transform([[lc]])[0])) != 0:  # make sure lipid class is encodable
-                x = [featurize(lc, lnc, lnu, fam, add, float(m), c_encoder, f_encoder, a_encoder)]
-                tid_to_ccs[int(tid)] = model.predict(scaler.transform(x))[0]
-        qry = 'INSERT INTO predicted_ccs VALUES (?, ?)'
-        for tid in tid_to_ccs:
-            cur.execute(qry, (tid, tid_to_ccs[tid]))
-        print_and_log('ok\n', bl)
+        t0 = perf_counter()
+        n = add_predicted_ccs(cur, model, scaler)
+        print_and_log('ok ({} rows, {:.0f} rows/s)\n'.format(n, n / (perf_counter() - t0)), bl)
 
     # commit changes to the database and close connection
     con.commit()
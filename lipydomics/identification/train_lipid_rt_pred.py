@@ -7,20 +7,23 @@
         Trains a predictive model for generating predicted RT values
 
         * requires scikit-learn v0.21.3 ! *
+
+        scikit-learn is only imported when it is needed for training, the trained model is also exported in a compact
+        format that can be used for making predictions without it (see compact_models.py)
 """
 
 
 from sqlite3 import connect
 import os
 import pickle
+from time import perf_counter
 import numpy as np
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import ShuffleSplit
-from sklearn.metrics import mean_squared_error
 
 from ..util import print_and_log
+from .compact_models import export_linear
+from .db_table_defs import bulk_load_pragmas
 from .encoder_params import rt_lipid_classes, rt_fa_mods
+from .featurization import rt_featurize_batch as featurize_batch, _rt_lc_codes
 
 
 def prep_encoders():
@@ -31,6 +34,8 @@ prep_encoders
     returns:
         c_encoder, f_encoder (sklearn.preprocessing.OneHotEncoder) -- encoders for lipid_class and fa_mod
 """
+    from sklearn.preprocessing import OneHotEncoder
+
     lipid_classes = [[_] for _ in rt_lipid_classes]
     c_encoder = OneHotEncoder(sparse=False, handle_unknown='ignore').fit(lipid_classes)
     fa_mods = [[_] for _ in rt_fa_mods]
@@ -71,6 +76,11 @@ train_new_model
     returns:
         mdl, scaler -- trained predictive model and input scaler instances
 """
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LinearRegression
+    from sklearn.model_selection import ShuffleSplit
+    from sklearn.metrics import mean_squared_error
+
     # prepare encoders
     c_encoder, f_encoder = prep_encoders()
 
@@ -132,6 +142,9 @@ train_new_model
         pickle.dump(model, pf1)
         pickle.dump(scaler, pf2)
 
+    # export the model and the scaler in the compact format used for making predictions
+    export_linear(model, scaler, os.path.join(this_dir, 'lipid_rt_pred.npz'))
+
     # return model and scaler
     return model, scaler
 
@@ -145,6 +158,8 @@ dump_split_data_to_files
     parameters:
         savedir (str) -- directory to save the dumped files into
 """
+    from sklearn.model_selection import ShuffleSplit
+
     # connect to database
     db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_path)
@@ -185,6 +200,72 @@ dump_split_data_to_files
     con.close()
 
 
+def predict_batch(model, scaler, X):
+    """
+predict_batch
+    description:
+        predicts retention times for an array of featurized lipids
+
+        The linear model has very large (nearly cancelling) coefficients so its predictions are sensitive to the order
+        of summation, computing each row's dot product separately gives exactly the same predictions as predicting one
+        lipid at a time with model.predict(...) (a single matrix-vector product does not)
+    parameters:
+        model (sklearn.linear_model.LinearRegression) -- trained predictive model
+        scaler (sklearn.preprocessing.StandardScaler) -- input scaler
+        X (np.array(float)) -- feature vectors, shape = (n_lipids, n_features)
+    returns:
+        (np.array(float)) -- predicted retention times, shape = (n_lipids,)
+"""
+    return np.array([np.dot(x, model.coef_) for x in scaler.transform(X)]) + model.intercept_
+
+
+def predicted_rt_rows(cursor, model, scaler, chunk_size=50000):
+    """
+predicted_rt_rows
+    description:
+        predicts retention times for all of the lipids in the predicted_mz table that have an encodable lipid class.
+        The predicted_mz table is read in chunks and each chunk is featurized and predicted all at once
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+        model, scaler -- trained predictive model and input scaler instances
+        [chunk_size (int)] -- number of rows to featurize and predict at a time [optional, default=50000]
+    yields:
+        (list(tuple(int, float))) -- rows for the predicted_rt table (t_id, rt), one chunk at a time
+"""
+    rows = cursor.connection.cursor()
+    rows.execute('SELECT t_id, lipid_class, lipid_nc, lipid_nu, fa_mod FROM predicted_mz')
+    chunk = rows.fetchmany(chunk_size)
+    while chunk:
+        # make sure lipid class is encodable
+        chunk = [row for row in chunk if row[1] in _rt_lc_codes]
+        if chunk:
+            tids, lcs, lncs, lnus, fams = zip(*chunk)
+            rt = predict_batch(model, scaler, featurize_batch(lcs, lncs, lnus, fams))
+            yield list(zip(tids, rt.tolist()))
+        chunk = rows.fetchmany(chunk_size)
+
+
+def add_predicted_rt(cursor, model, scaler, chunk_size=50000):
+    """
+add_predicted_rt
+    description:
+        predicts retention times for all of the lipids in the predicted_mz table that have an encodable lipid class
+        and adds them to the predicted_rt table, each chunk of predictions (see predicted_rt_rows(...)) is inserted
+        with a single executemany (changes are not committed)
+    parameters:
+        cursor (sqlite3.cursor) -- cursor for querying lipids.db
+        model, scaler -- trained predictive model and input scaler instances
+        [chunk_size (int)] -- number of rows to featurize and predict at a time [optional, default=50000]
+    returns:
+        (int) -- number of predicted retention times added
+"""
+    n = 0
+    for chunk in predicted_rt_rows(cursor, model, scaler, chunk_size=chunk_size):
+        cursor.executemany('INSERT INTO predicted_rt VALUES (?, ?)', chunk)
+        n += len(chunk)
+    return n
+
+
 def main(tstamp):
     """ main build function """
 
@@ -192,9 +273,8 @@ def main(tstamp):
     db_path = os.path.join(os.path.dirname(__file__), 'lipids.db')
     con = connect(db_path)
     cur = con.cursor()
-
-    # prepare encoders
-    c_encoder, f_encoder = prep_encoders()
+    for pragma in bulk_load_pragmas:
+        cur.execute(pragma)
 
     build_log = os.path.join(os.path.dirname(__file__), 'builds/build_log_{}.txt'.format(tstamp))
     with open(build_log, 'a') as bl:
@@ -206,16 +286,9 @@ def main(tstamp):
 
         # add predicted RT to the database
         print_and_log('\nadding predicted RT to database ...', bl, end=' ')
-        qry = 'SELECT t_id, lipid_class, lipid_nc, lipid_nu, fa_mod FROM predicted_mz'
-        tid_to_rt = {}
-        for tid, lc, lnc, lnu, fam in cur.execute(qry).fetchall():
-            if int(sum(c_encoder.transform([[lc]])[0])) != 0: # make sure lipid class is encodable
-                x = np.array([featurize(lc, lnc, lnu, fam, c_encoder, f_encoder)]).reshape(1, -1)
-                tid_to_rt[int(tid)] = model.predict(scaler.transform(x))[0]
-        qry = 'INSERT INTO predicted_rt VALUES (?, ?)'
-        for tid in tid_to_rt:
-            cur.execute(qry, (tid, tid_to_rt[tid]))
-        print_and_log('ok\n', bl)
+        t0 = perf_counter()
+        n = add_predicted_rt(cur, model, scaler)
+        print_and_log('ok ({} rows, {:.0f} rows/s)\n'.format(n, n / (perf_counter() - t0)), bl)
 
     # commit changes to the database and close connection
     con.commit()
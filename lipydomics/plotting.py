@@ -9,19 +9,35 @@
 
 import os
 import numpy as np
-from scipy.sparse import coo_matrix
 from csv import reader
-from matplotlib import pyplot as plt, colors as mcolors
-from matplotlib import rcParams
 
 from lipydomics.util import fetch_lipid_class_log2fc
 
 
-rcParams['font.size'] = 8
 CS = ['#2FA2AB', '#9BD0B9', 'Purple', 'Blue', 'Green', 'Orange', 'Red', 'Yellow',
       '#E8ACF6', 'Grey', '#D6BF49', '#412F88', '#A2264B', '#3ACBE8', '#1CA3DE', '#0D85D8']
 IMG_RES = 350  # image resolution
 
+# the default font size is set when matplotlib.pyplot is first imported (see _pyplot())
+_font_size_set = False
+
+
+def _pyplot():
+    """
+_pyplot
+    description:
+        imports matplotlib.pyplot on first use (it is slow to import and only needed when a plot is actually made)
+        and sets the default font size the first time through
+    returns:
+        (module) -- matplotlib.pyplot
+"""
+    global _font_size_set
+    from matplotlib import pyplot
+    if not _font_size_set:
+        pyplot.rcParams['font.size'] = 8
+        _font_size_set = True
+    return pyplot
+
 
 def barplot_feature_bygroup(dataset, group_names, img_dir, feature, normed=False, tolerance=(0.01, 0.1, 1.)):
     """
@@ -43,6 +59,7 @@ barplot_feature_bygroup
     returns:
         (bool) -- at least one feature was found
 """
+    plt = _pyplot()
     # search for the corresponding feature
     mz_r, rt_r, ccs_r = feature
     mz_t, rt_t, ccs_t = tolerance
@@ -79,11 +96,12 @@ barplot_feature_bygroup
         fig_name = 'bar_{:.4f}-{:.2f}-{:.1f}_'.format(mz, rt, ccs) + '-'.join(group_names) + '_{}.png'.format(nrm)
         fig_path = os.path.join(img_dir, fig_name)
 
-        group_data = np.array([_[i] for _ in dataset.get_data_bygroup(group_names, normed=normed)])
+        # mean and standard deviation (ddof=0) of each group from the per-group summary statistics
+        group_stats = [dataset.get_group_stats(name, normed=normed) for name in group_names]
 
-        x = [_ for _ in range(len(group_data))]
-        y = [np.mean(_) for _ in group_data]
-        e = [np.std(_) for _ in group_data]
+        x = [_ for _ in range(len(group_stats))]
+        y = [gs['mean'][i] for gs in group_stats]
+        e = [np.sqrt(gs['var'][i] * (gs['n'] - 1) / gs['n']) if gs['n'] > 1 else 0. for gs in group_stats]
         c = [c_ for _, c_ in zip(x, CS)]
 
         fig = plt.figure(figsize=(1. + 0.5 * len(group_names), 2))
@@ -149,6 +167,7 @@ scatter_pca3_projections_bygroup
         img_dir (str) -- directory to save the image under
         [normed (bool)] -- Use normalized data (True) or raw (False) [optional, default=False]
 """
+    plt = _pyplot()
     # generate the path to save the figure under
     if normed:
         nrm = 'normed'
@@ -204,6 +223,7 @@ scatter_plsda_projections_bygroup
         img_dir (str) -- directory to save the image under
         [normed (bool)] -- Use normalized data (True) or raw (False) [optional, default=False]
 """
+    plt = _pyplot()
     if len(group_names) != 2:
         m = 'scatter_plsda_projections_bygroup: 2 group names must be specified for PLS-DA, {} group names specified'
         raise ValueError(m.format(len(group_names)))
@@ -258,6 +278,7 @@ splot_plsda_pcorr_bygroup
         img_dir (str) -- directory to save the image under
         [normed (bool)] -- Use normalized data (True) or raw (False) [optional, default=False]   
 """
+    plt = _pyplot()
     if len(group_names) != 2:
         m = 'splot_plsda_pcorr_bygroup: 2 group names must be specified for S-plot, {} group names specified'
         raise ValueError(m.format(len(group_names)))
@@ -316,6 +337,7 @@ scatter_plsra_projections_bygroup
         img_dir (str) -- directory to save the image under
         [normed (bool)] -- Use normalized data (True) or raw (False) [optional, default=False]
 """
+    plt = _pyplot()
     # generate the path to save the figure under
     if normed:
         nrm = 'normed'
@@ -369,6 +391,7 @@ heatmap_lipid_class_log2fc
     returns:
         (bool) -- found data for the specified lipid class
 """
+    plt = _pyplot()
     # check that identifications have been made first
     if dataset.feat_ids is None:
         m = 'heatmap_lipid_class_log2fc: no lipid identifications have been made'
@@ -391,6 +414,7 @@ heatmap_lipid_class_log2fc
     min_nu, max_nu = np.min(nu), np.max(nu)
     max_abs_l2 = np.max(np.abs(l2))
     # create an appropriately sized sparse matrix to hold the data
+    from scipy.sparse import coo_matrix
     spmat = coo_matrix((l2, (nc, nu)))
 
     # generate the figure
@@ -400,6 +424,7 @@ heatmap_lipid_class_log2fc
     im = ax.pcolor(spmat.toarray(), cmap='bwr', vmin=-max_abs_l2, vmax=max_abs_l2, edgecolors='k', linewidth=0.5)
     fig.colorbar(im, label='log2({} / {})'.format(group_names[1], group_names[0]))
     # mask out the missing values
+    from matplotlib import colors as mcolors
     mask_cm = mcolors.ListedColormap([np.array([0., 0., 0., 0.4]), np.array([0., 0., 0., 0.])], N=2)
     bnorm = mcolors.BoundaryNorm([0., 0.0001, 100000.], mask_cm.N, clip=True)
     ax.pcolor(np.abs(spmat.toarray()), cmap=mask_cm, norm=bnorm)
@@ -440,6 +465,7 @@ heatmap_lipid_class_log2fc
     returns:
         (bool) -- found data for the specified lipid class
 """
+    plt = _pyplot()
     if len(group_names) != 2:
         m = 'volcano_2group: 2 group names must be specified for volcano plot, {} group names specified'
         raise ValueError(m.format(len(group_names)))
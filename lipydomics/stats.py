@@ -16,18 +16,43 @@
 
 
 import numpy as np
-from scipy.stats import f_oneway, pearsonr, ttest_ind, mannwhitneyu
-from sklearn.decomposition import PCA
-from sklearn.cross_decomposition import PLSRegression
 import warnings
 
 
+# scipy and sklearn are slow to import and each is only needed by a few of these functions, so they are imported
+# inside of the functions that use them rather than with this module
+
+
+def _per_feature(dataset, group_names, normed, func):
+    """
+_per_feature
+    description:
+        computes a per-feature statistic from the group data one block of features at a time (see
+        Dataset.feature_blocks()), so memory mapped intensities never need to be loaded into memory all at once
+    parameters:
+        dataset (lipydomics.data.Dataset) -- lipidomics dataset
+        group_names (list(str)) -- groups to get data for
+        normed (bool) -- Use normalized data (True) or raw (False)
+        func (function) -- computes the statistic for a block of features, gets called with the data from each group
+                            (n_block_features, group_size) as arguments and returns an array (n_block_features,)
+    returns:
+        (numpy.ndarray) -- the statistic for all features, shape = (n_features,)
+"""
+    return np.concatenate([func(*dataset.get_data_bygroup(group_names, normed=normed, features=s))
+                           for s in dataset.feature_blocks()])
+
+
 def add_anova_p(dataset, group_names, normed=False):
     """
 add_anova_p
     description:
         adds a column containing ANOVA p-values computed for user-specified groups
 
+        The one-way ANOVA F statistic is computed for all features at once from the per-group sample counts, means,
+        and variances (see Dataset.get_group_stats(...)), groups may have different numbers of samples. The results
+        are the same as scipy.stats.f_oneway, including features that are constant within every group (p-value of 0)
+        or across all of the groups (p-value of NaN)
+
         The p-values (n_features,) are added to Dataset.stats with the label:
             'ANOVA_{group_name1}-{group_name2}-{etc.}_{raw/normed}'
     parameters:
@@ -35,8 +60,33 @@ add_anova_p
         group_names (list(str)) -- groups to use to compute the ANOVA p-value
         [normed (bool)] -- Use normalized data (True) or raw (False) [optional, default=False]
 """
-    group_data = np.array([_ for _ in dataset.get_data_bygroup(group_names, normed=normed)])
-    anova_p = np.array([f_oneway(*feature)[1] for feature in zip(*group_data)])
+    from scipy.special import fdtrc
+
+    group_stats = [dataset.get_group_stats(name, normed=normed) for name in group_names]
+    # per-group statistics stacked into arrays with shape (n_groups, n_features)
+    n = np.array([gs['n'] for gs in group_stats], dtype=float)[:, None]
+    means = np.array([gs['mean'] for gs in group_stats])
+    # the variance of a group with a single sample is NaN, but it contributes nothing to the within group sum of squares
+    ss_groups = np.array([(gs['n'] - 1) * gs['var'] if gs['n'] > 1 else np.zeros(len(gs['var']))
+                          for gs in group_stats])
+    mins = np.array([gs['min'] for gs in group_stats])
+    maxs = np.array([gs['max'] for gs in group_stats])
+    n_total = n.sum()
+    df_between, df_within = len(group_stats) - 1, n_total - len(group_stats)
+    grand_mean = (n * means).sum(axis=0) / n_total
+    # between and within group sums of squares
+    ss_between = (n * (means - grand_mean) ** 2).sum(axis=0)
+    ss_within = ss_groups.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_stat = (ss_between / df_between) / (ss_within / df_within)
+    anova_p = fdtrc(df_between, df_within, f_stat)
+    # features that are constant within every group have an infinite F statistic, unless they are also the same
+    # across all of the groups, in which case it is undefined (same as scipy.stats.f_oneway), and with only a single
+    # sample in each group there are no degrees of freedom within groups so it is always undefined
+    all_const = (mins == maxs).all(axis=0)
+    if df_within > 0:
+        anova_p[all_const] = 0.
+    anova_p[all_const & (mins == mins[0]).all(axis=0)] = np.nan
     if normed:
         normed = "normed"
     else: 
@@ -65,6 +115,8 @@ add_pca3
         [normed (bool)] -- Use normalized data (True) or raw (False) [optional, default=False]
         [random_state (int)] -- pRNG seed for deterministic results [optional, default=69]
 """
+    from sklearn.decomposition import PCA
+
     # initialize the PCA object, add it to the Dataset
     dataset.pca3_ = PCA(n_components=3, random_state=random_state)
 
@@ -122,6 +174,7 @@ add_plsda
     y = np.array([-1 for _ in range(n_A)] + [1 for _ in range(n_B)])
 
     # initialize the PLSRegression object, add to the Dataset, fit the group data
+    from sklearn.cross_decomposition import PLSRegression
     dataset.plsda_ = PLSRegression(scale=scaled)
     dataset.plsda_.fit(X, y)
 
@@ -170,27 +223,27 @@ add_2group_corr
         m = 'add_2group_corr: 2 group names must be specified for correlation, {} group names specified'
         raise ValueError(m.format(len(group_names)))
 
-    # get the group data, reshape and concatenate -> X 
-    Y = np.concatenate([_.T for _ in dataset.get_data_bygroup(group_names, normed=normed)]).T
-    # target variable is just 1 for group A and -1 for group B
-    n_A = len(dataset.group_indices[group_names[0]])
-    n_B = len(dataset.group_indices[group_names[1]])
-    # set so that the direction is the same as in PLS-DA
-    x = np.array([-1 for _ in range(n_A)] + [1 for _ in range(n_B)])
-
     # compute correlation coefficients for each feature
-    corr = []
-    for y in Y:
-        c = 0.
-        for _ in y:
-            # if x is all 0s then dont bother computing the correlation coefficient, it just causes a warning
-            if _ > 0:
-                c = pearsonr(x, y)[0]
-                break
-        corr.append(c)
-
-    # convert corr to a numpy array
-    corr = np.array(corr)
+    from scipy.stats import pearsonr
+
+    def block_corr(A, B):
+        # concatenate the group data -> Y
+        Y = np.concatenate([A, B], axis=1)
+        # target variable is just 1 for group A and -1 for group B
+        # set so that the direction is the same as in PLS-DA
+        x = np.array([-1 for _ in range(A.shape[1])] + [1 for _ in range(B.shape[1])])
+        corr = []
+        for y in Y:
+            c = 0.
+            for _ in y:
+                # if x is all 0s then dont bother computing the correlation coefficient, it just causes a warning
+                if _ > 0:
+                    c = pearsonr(x, y)[0]
+                    break
+            corr.append(c)
+        return np.array(corr)
+
+    corr = _per_feature(dataset, group_names, normed, block_corr)
 
     if normed:
         nrm = 'normed'
@@ -230,6 +283,7 @@ add_plsra
         raise ValueError(m.format())
 
     # initialize the PLSRegression object, add to the Dataset, fit the group data
+    from sklearn.cross_decomposition import PLSRegression
     dataset.plsra_ = PLSRegression(scale=scaled)
     dataset.plsra_.fit(X, y)
 
@@ -269,14 +323,12 @@ add_log2fc
         m = 'add_log2fc: you must provide exactly 2 group names ({} group names provided)'
         raise ValueError(m.format(len(group_names)))
 
-    # get the group data A and B
-    A, B = dataset.get_data_bygroup(group_names, normed=normed)
-
-    # compute the log2(fold-change) of  mean intensities for each lipid from both groups
+    # compute the log2(fold-change) of  mean intensities for each lipid from both groups A and B
     # this will raise a warning if A has a mean of 0, we will ignore that warning
+    A, B = [dataset.get_group_stats(name, normed=normed) for name in group_names]
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        log2fc = np.log2(np.mean(B, axis=1) / np.mean(A, axis=1))
+        log2fc = np.log2(B['mean'] / A['mean'])
 
     # add the statistics into the Dataset
     dataset.stats['LOG2FC_{}_{}'.format('-'.join(group_names), 'normed' if normed else 'raw')] = log2fc
@@ -313,25 +365,31 @@ add_2group_pvalue
         raise ValueError(m.format(len(group_names)))
 
     # compute the statistic
-    group_data = np.array([_ for _ in dataset.get_data_bygroup(group_names, normed=normed)])
+    from scipy.stats import ttest_ind_from_stats, mannwhitneyu
     if stats_test in ['students', 'welchs']:
         eqv = stats_test == 'students'
+        # t-tests only need the sample counts, means, and variances from each group
+        A, B = [dataset.get_group_stats(name, normed=normed) for name in group_names]
         # this raises warnings with zero means, ignore the warnings since the resulting p-values end up getting set
         # to NaN when the ttest function runs and then 1. below
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            stat, pvalue = ttest_ind(*group_data, axis=1, equal_var=eqv)
+            pvalue = ttest_ind_from_stats(A['mean'], np.sqrt(A['var']), A['n'], B['mean'], np.sqrt(B['var']), B['n'],
+                                          equal_var=eqv)[1]
     else:
         # mann-whitney
-        pv = []
-        for feature in zip(*group_data):
-            try:
-                u, p = mannwhitneyu(*feature, alternative='two-sided')
-            except ValueError:
-                # this happens when both samples are equal (typically all zeros)
-                p = np.nan
-            pv.append(p)
-        pvalue = np.array(pv)
+        def block_mannwhit(*group_data):
+            pv = []
+            for feature in zip(*group_data):
+                try:
+                    u, p = mannwhitneyu(*feature, alternative='two-sided')
+                except ValueError:
+                    # this happens when both samples are equal (typically all zeros)
+                    p = np.nan
+                pv.append(p)
+            return np.array(pv)
+
+        pvalue = _per_feature(dataset, group_names, normed, block_mannwhit)
 
     # the pvalue arrays may contain NaNs, convert those to 1.
     pvalue = np.nan_to_num(pvalue, nan=1.)
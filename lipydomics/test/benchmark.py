@@ -0,0 +1,464 @@
+"""
+    lipydomics/test/benchmark.py
+    Dylan H. Ross
+    2026/10/15
+
+    description:
+        Define benchmarks for performance-sensitive parts of lipydomics. These are not run with the rest of the tests,
+        run them directly with:
+            python -m lipydomics.test.benchmark
+"""
+
+
+import os
+import sys
+import pickle
+import tempfile
+import subprocess
+import tracemalloc
+from time import perf_counter
+from sqlite3 import connect
+import numpy as np
+
+from lipydomics.test import run_tests
+from lipydomics.data import Dataset
+from lipydomics.stats import add_anova_p, add_log2fc, add_2group_pvalue, add_pca3, add_plsda
+from lipydomics.identification import (
+    add_feature_ids, predict_ccs, predict_rt, predict_ccs_batch, predict_rt_batch
+)
+from lipydomics.identification.batch_id import batch_id_levels
+from lipydomics.identification.id_levels import (
+    id_feat_pred_mz_rt_ccs, id_feat_pred_mz_ccs, id_feat_pred_mz_rt, any_levels
+)
+from lipydomics.identification.candidate_index import get_candidate_index
+from lipydomics.identification.compact_models import load_model
+from lipydomics.identification.featurization import ccs_featurize_batch
+
+
+# budget (in seconds) for the cumulative time it takes to import each of the main lipydomics modules, numpy on its
+# own takes ~0.1 s so this leaves plenty of headroom but not enough to absorb pandas, scipy, sklearn, or matplotlib
+IMPORT_TIME_BUDGET = 0.75
+
+
+def _synthetic_dataset(labels, intensities):
+    """
+_synthetic_dataset
+    description:
+        writes synthetic labels and intensities into a dataset .csv file (in a temporary directory) then loads it, so
+        the Dataset is set up by Dataset.__init__(...) like any other
+    parameters:
+        labels (numpy.ndarray(float)) -- m/z, rt, and CCS of each feature, shape = (n_features, 3)
+        intensities (numpy.ndarray(float)) -- feature intensities, shape = (n_features, n_samples)
+    returns:
+        (lipydomics.data.Dataset) -- the dataset
+"""
+    header = ','.join(['mz', 'rt', 'ccs'] + ['sample_{}'.format(i) for i in range(intensities.shape[1])])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv = os.path.join(tmp_dir, 'synthetic.csv')
+        np.savetxt(csv, np.hstack([labels, intensities]), delimiter=',', header=header, comments='')
+        return Dataset(csv)
+
+
+def bench_add_feature_ids_engines_real1():
+    """
+bench_add_feature_ids_engines_real1
+    description:
+        Times feature identification at the 'any' level on real_data_1.csv (773 features) using the per-feature,
+        batch, and numpy identification engines
+
+        Benchmark fails if the engines do not produce the same identifications
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    results, timings = [], []
+    for engine in ['feature', 'batch', 'numpy']:
+        t0 = perf_counter()
+        add_feature_ids(dset, [0.05, 0.5, 5.], engine=engine)
+        timings.append(perf_counter() - t0)
+        results.append((dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores))
+    print(' feature: {:.3f} s batch: {:.3f} s numpy: {:.3f} s'.format(*timings), end='')
+    return results[0] == results[1] == results[2]
+
+
+def bench_id_engines_synthetic_100k():
+    """
+bench_id_engines_synthetic_100k
+    description:
+        Times feature identification at the 'any' level for 100,000 synthetic features (m/z, rt and CCS drawn
+        uniformly from typical ranges) using the batch and numpy identification engines. The time to build the
+        candidate index from the database is reported separately.
+
+        Benchmark fails if the engines do not produce the same identifications
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    rng = np.random.default_rng(420)
+    n = 100000
+    mz, rt, ccs = rng.uniform(400., 1000., n), rng.uniform(0.5, 10., n), rng.uniform(200., 320., n)
+    features = [(*_, 0.05, 0.5, c * 0.05) for *_, c in zip(mz, rt, ccs, ccs)]
+    db_path = os.path.join(os.path.dirname(__file__), '../identification/lipids.db')
+
+    t0 = perf_counter()
+    con = connect(db_path)
+    batch = batch_id_levels(any_levels, con.cursor(), features, 'neg')
+    con.close()
+    t_batch = perf_counter() - t0
+
+    t0 = perf_counter()
+    idx = get_candidate_index(db_path)
+    t_build = perf_counter() - t0
+    t0 = perf_counter()
+    npy = idx.identify(any_levels, features, 'neg')
+    t_numpy = perf_counter() - t0
+
+    print(' batch: {:.3f} s numpy: {:.3f} s (+{:.3f} s index load/build)'.format(t_batch, t_numpy, t_build), end='')
+    return batch == npy
+
+
+def bench_pred_levels_joined_vs_predicted():
+    """
+bench_pred_levels_joined_vs_predicted
+    description:
+        Times the predicted m/z + rt + CCS, m/z + CCS, and m/z + rt identification levels for 500 synthetic features
+        (negative mode) against the shipped lipids.db, querying either the predicted_mz, predicted_ccs and predicted_rt
+        tables joined on t_id (as the identification levels used to) or the denormalized predicted table (as the
+        identification levels in id_levels.py do now)
+
+        Benchmark fails if the two approaches do not find the same putative identifications
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    rng = np.random.default_rng(420)
+    n = 500
+    mz, rt, ccs = rng.uniform(400., 1000., n), rng.uniform(0.5, 10., n), rng.uniform(200., 320., n)
+    con = connect(os.path.join(os.path.dirname(__file__), '../identification/lipids.db'))
+    cur = con.cursor()
+    joined = {
+        id_feat_pred_mz_rt_ccs: 'SELECT name, adduct FROM predicted_mz JOIN predicted_ccs ON '
+                                'predicted_mz.t_id=predicted_ccs.t_id JOIN predicted_rt ON '
+                                'predicted_mz.t_id=predicted_rt.t_id WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? AND ? '
+                                'AND rt BETWEEN ? AND ? AND charge < 0 ORDER BY predicted_mz.t_id',
+        id_feat_pred_mz_ccs: 'SELECT name, adduct FROM predicted_mz JOIN predicted_ccs ON '
+                             'predicted_mz.t_id=predicted_ccs.t_id WHERE mz BETWEEN ? AND ? AND ccs BETWEEN ? AND ? '
+                             'AND charge < 0 ORDER BY predicted_mz.t_id',
+        id_feat_pred_mz_rt: 'SELECT name, adduct FROM predicted_mz JOIN predicted_rt ON '
+                            'predicted_mz.t_id=predicted_rt.t_id WHERE mz BETWEEN ? AND ? AND rt BETWEEN ? AND ? '
+                            'AND charge < 0 ORDER BY predicted_mz.t_id'
+    }
+    same = True
+    for id_func, qry in joined.items():
+        t0 = perf_counter()
+        res_joined = []
+        for mz_, rt_, ccs_ in zip(mz, rt, ccs):
+            qdata = {
+                id_feat_pred_mz_rt_ccs: (mz_ - 0.05, mz_ + 0.05, ccs_ * 0.95, ccs_ * 1.05, rt_ - 0.5, rt_ + 0.5),
+                id_feat_pred_mz_ccs: (mz_ - 0.05, mz_ + 0.05, ccs_ * 0.95, ccs_ * 1.05),
+                id_feat_pred_mz_rt: (mz_ - 0.05, mz_ + 0.05, rt_ - 0.5, rt_ + 0.5)
+            }[id_func]
+            res_joined.append(['{}_{}'.format(*_) for _ in cur.execute(qry, qdata).fetchall()])
+        t_joined = perf_counter() - t0
+        t0 = perf_counter()
+        res_pred = []
+        for mz_, rt_, ccs_ in zip(mz, rt, ccs):
+            fid, _, _ = id_func(cur, mz_, rt_, ccs_, 0.05, 0.5, ccs_ * 0.05, 'neg')
+            res_pred.append(fid if fid else [])
+        t_pred = perf_counter() - t0
+        print('\n\t\t{}: joined: {:.3f} s predicted: {:.3f} s'.format(id_func.__name__, t_joined, t_pred), end='')
+        same = same and res_joined == res_pred
+    con.close()
+    return same
+
+
+def bench_add_feature_ids_n_jobs_scaling():
+    """
+bench_add_feature_ids_n_jobs_scaling
+    description:
+        Times feature identification at the 'any' level for 20,000 synthetic features (real_data_1.csv with the labels
+        replaced) using the per-feature identification engine with 1 up to the number of available CPUs worker
+        processes
+
+        Benchmark fails if the identifications are not the same for every number of worker processes
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    rng = np.random.default_rng(420)
+    n = 20000
+    dset.labels = np.column_stack([rng.uniform(400., 1000., n), rng.uniform(0.5, 10., n), rng.uniform(200., 320., n)])
+    results = []
+    for n_jobs in range(1, (os.cpu_count() or 1) + 1):
+        t0 = perf_counter()
+        add_feature_ids(dset, [0.05, 0.5, 5.], n_jobs=n_jobs)
+        print('\n\t\tn_jobs={}: {:.3f} s'.format(n_jobs, perf_counter() - t0), end='')
+        results.append((dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores))
+    return all([_ == results[0] for _ in results])
+
+def bench_predict_ccs_rt_batch():
+    """
+bench_predict_ccs_rt_batch
+    description:
+        Times CCS and HILIC retention time predictions for 2,000 lipids (PC and PE with a range of sum compositions,
+        [M+H]+ adduct), one lipid at a time with predict_ccs/predict_rt and all at once with
+        predict_ccs_batch/predict_rt_batch
+
+        Benchmark fails if the single and batch predictions are not exactly the same
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    lipids = [(lc, nc, nu) for lc in ['PC', 'PE'] for nc in range(10, 60) for nu in range(20)]
+    t0 = perf_counter()
+    ccs = [predict_ccs(lc, nc, nu, '[M+H]+') for lc, nc, nu in lipids]
+    rt = [predict_rt(lc, nc, nu) for lc, nc, nu in lipids]
+    t_single = perf_counter() - t0
+    t0 = perf_counter()
+    ccs_b = predict_ccs_batch(*zip(*lipids), ['[M+H]+' for _ in lipids])
+    rt_b = predict_rt_batch(*zip(*lipids))
+    t_batch = perf_counter() - t0
+    print(' single: {:.3f} s batch: {:.3f} s'.format(t_single, t_batch), end='')
+    return ccs == ccs_b.tolist() and rt == rt_b.tolist()
+
+
+def bench_compact_ccs_model():
+    """
+bench_compact_ccs_model
+    description:
+        Times loading the CCS model and predicting CCS for 20,000 lipids from the predicted_mz table using the pickled
+        scikit-learn model and scaler, and using the compact .npz model (NumPy inference)
+
+        Benchmark fails if the predictions are not the same within a relative tolerance of 1e-9
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    this_dir = os.path.join(os.path.dirname(__file__), '..', 'identification')
+    con = connect(os.path.join(this_dir, 'lipids.db'))
+    qry = 'SELECT lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz FROM predicted_mz JOIN predicted_ccs ' \
+          + 'ON predicted_ccs.t_id=predicted_mz.t_id LIMIT 20000'
+    X = ccs_featurize_batch(*zip(*con.execute(qry).fetchall()))
+    con.close()
+    t0 = perf_counter()
+    with open(os.path.join(this_dir, 'lipid_ccs_pred.pickle'), 'rb') as pf1, \
+            open(os.path.join(this_dir, 'lipid_ccs_scale.pickle'), 'rb') as pf2:
+        model, scaler = pickle.load(pf1), pickle.load(pf2)
+    t1 = perf_counter()
+    ccs_sk = model.predict(scaler.transform(X))
+    t2 = perf_counter()
+    compact = load_model(os.path.join(this_dir, 'lipid_ccs_pred.npz'))
+    t3 = perf_counter()
+    ccs_np = compact.predict(X)
+    t4 = perf_counter()
+    print(' sklearn: load {:.3f} s predict {:.3f} s npz: load {:.3f} s predict {:.3f} s'.format(t1 - t0, t2 - t1,
+                                                                                             t3 - t2, t4 - t3), end='')
+    return np.allclose(ccs_np, ccs_sk, rtol=1e-9, atol=0.)
+
+
+def bench_dataset_csv_load():
+    """
+bench_dataset_csv_load
+    description:
+        Times loading a synthetic 20,000 feature x 200 sample dataset .csv file with numpy.genfromtxt (the way that
+        Dataset.__init__ used to) and with Dataset.__init__ using float64 and float32 intensities
+
+        Benchmark fails if the loaded labels or intensities do not match the ones from numpy.genfromtxt
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    rng = np.random.default_rng(420)
+    n_features, n_samples = 20000, 200
+    labels = np.round(np.array([rng.uniform(400., 1000., n_features), rng.uniform(0.5, 10., n_features),
+                                rng.uniform(200., 320., n_features)]).T, 4)
+    intensities = rng.integers(0, 100000, (n_features, n_samples))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv = os.path.join(tmp_dir, 'synthetic.csv')
+        with open(csv, 'w') as f:
+            f.write('mz,rt,ccs,' + ','.join(['s{}'.format(_) for _ in range(n_samples)]) + '\n')
+            for lbl, ints in zip(labels, intensities):
+                f.write(','.join([str(_) for _ in lbl] + [str(_) for _ in ints]) + '\n')
+        t0 = perf_counter()
+        mz, rt, ccs, *ints = np.genfromtxt(csv, delimiter=',', unpack=True, skip_header=1)
+        ref_labels, ref_ints = np.array([mz, rt, ccs]).T, np.array(ints).T
+        t1 = perf_counter()
+        dset64 = Dataset(csv)
+        t2 = perf_counter()
+        dset32 = Dataset(csv, dtype=np.float32)
+        t3 = perf_counter()
+    print(' genfromtxt: {:.3f} s float64: {:.3f} s float32: {:.3f} s'.format(t1 - t0, t2 - t1, t3 - t2), end='')
+    return (np.array_equal(ref_labels, dset64.labels) and np.array_equal(ref_ints, dset64.intensities)
+            and np.array_equal(ref_labels, dset32.labels) and np.array_equal(ref_ints, dset32.intensities))
+
+
+def bench_save_load_bin():
+    """
+bench_save_load_bin
+    description:
+        Times saving and loading a synthetic 50,000 feature x 200 sample Dataset (with normalized intensities and a few
+        statistics) by pickling it and with Dataset.save_bin(...)/Dataset.load_bin(...), then reading a single
+        statistic from the loaded Dataset
+
+        Benchmark fails if the statistic read back does not match
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    rng = np.random.default_rng(420)
+    dset = _synthetic_dataset(rng.uniform(200., 1000., (50000, 3)), rng.uniform(0., 100000., (50000, 200)))
+    dset.assign_groups({'A': list(range(100)), 'B': list(range(100, 200))})
+    dset.normalize(np.full(200, 0.5))
+    dset.stats = {'stat_{}'.format(i): rng.random(50000) for i in range(10)}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_path, bin_path = os.path.join(tmp_dir, 'dset.pickle'), os.path.join(tmp_dir, 'dset.bin')
+        t0 = perf_counter()
+        with open(pickle_path, 'wb') as pf:
+            pickle.dump(dset, pf)
+        t1 = perf_counter()
+        with open(pickle_path, 'rb') as pf:
+            stat_pickle = pickle.load(pf).stats['stat_7'].sum()
+        t2 = perf_counter()
+        dset.save_bin(bin_path)
+        t3 = perf_counter()
+        dset_bin = Dataset.load_bin(bin_path)
+        stat_bin = dset_bin.stats['stat_7'].sum()
+        t4 = perf_counter()
+        del dset_bin
+    print(' pickle: save {:.3f} s load {:.3f} s save_bin: save {:.3f} s load {:.4f} s'.format(t1 - t0, t2 - t1,
+                                                                                         t3 - t2, t4 - t3), end='')
+    return stat_pickle == stat_bin == dset.stats['stat_7'].sum()
+
+
+def bench_group_data_allocations():
+    """
+bench_group_data_allocations
+    description:
+        Measures the memory allocated (with tracemalloc) while computing ANOVA, log2(fold-change), Welch's t-test, PCA
+        and PLS-DA on a synthetic 5,000 feature x 40 sample Dataset with 4 groups of 10 samples. Compares interleaved
+        groups with the group data cache cleared before every statistic (so group data is copied every time, like
+        before the cache existed) or kept warm, and contiguous groups (where group data are just views). The sum of
+        the peak memory allocated during each statistic is reported for each.
+
+        Benchmark fails if the statistics are not the same in every case
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    rng = np.random.default_rng(420)
+    n_features, n_samples = 5000, 40
+    dset = _synthetic_dataset(rng.uniform(200., 1000., (n_features, 3)),
+                              rng.uniform(0., 100000., (n_features, n_samples)))
+    groups = ['A', 'B', 'C', 'D']
+    stats = [
+        lambda: add_anova_p(dset, groups),
+        lambda: add_log2fc(dset, groups[:2]),
+        lambda: add_2group_pvalue(dset, groups[:2], 'welchs'),
+        lambda: add_pca3(dset, groups),
+        lambda: add_plsda(dset, groups[:2])
+    ]
+
+    def run(clear_cache):
+        dset.stats = {}
+        peak, t0 = 0, perf_counter()
+        tracemalloc.start()
+        for stat in stats:
+            if clear_cache:
+                dset._clear_group_cache()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            stat()
+            peak += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        return peak / 2 ** 20, perf_counter() - t0, dset.stats
+
+    results = []
+    # interleaved groups, copied for every statistic
+    dset.assign_groups({g: list(range(i, n_samples, 4)) for i, g in enumerate(groups)})
+    results.append(run(True))
+    # interleaved groups, cache already filled
+    run(False)
+    results.append(run(False))
+    # contiguous groups, reorder the samples so that the groups are the same
+    order = np.concatenate([dset.group_indices[g] for g in groups])
+    dset.intensities = dset.intensities[:, order]
+    dset.assign_groups({g: list(range(10 * i, 10 * (i + 1))) for i, g in enumerate(groups)})
+    results.append(run(False))
+    print(' uncached: {:.1f} MB ({:.3f} s) cached: {:.1f} MB ({:.3f} s) contiguous: {:.1f} MB ({:.3f} s)'.format(
+        *[_ for r in results for _ in r[:2]]), end='')
+    for label in results[0][2]:
+        if not all(np.allclose(r[2][label], results[0][2][label], equal_nan=True) for r in results[1:]):
+            return False
+    return True
+
+
+def bench_anova_100k_12groups():
+    """
+bench_anova_100k_12groups
+    description:
+        Times add_anova_p(...) on a synthetic 100,000 feature Dataset with 12 groups of unequal size (2 to 8 samples),
+        both with the group statistics computed from scratch and with them already cached. The p-values are checked
+        against scipy.stats.f_oneway for a random subset of 1,000 features.
+
+        Benchmark fails if any p-values differ from scipy.stats.f_oneway (rtol=1e-10) or if the uncached ANOVA takes
+        longer than 1 s
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    from scipy.stats import f_oneway
+
+    rng = np.random.default_rng(420)
+    sizes = rng.integers(2, 9, 12)
+    n_features, n_samples = 100000, int(sizes.sum())
+    dset = _synthetic_dataset(rng.uniform(200., 1000., (n_features, 3)),
+                              rng.lognormal(10., 1., (n_features, n_samples)))
+    ends = np.cumsum(sizes)
+    groups = {'G{}'.format(i): list(range(end - size, end)) for i, (size, end) in enumerate(zip(sizes, ends))}
+    dset.assign_groups(groups)
+    t0 = perf_counter()
+    add_anova_p(dset, list(groups))
+    t1 = perf_counter()
+    add_anova_p(dset, list(groups))
+    t2 = perf_counter()
+    print(' uncached: {:.3f} s cached: {:.3f} s'.format(t1 - t0, t2 - t1), end='')
+    anova_p = dset.stats['ANOVA_' + '-'.join(groups) + '_raw']
+    check = rng.choice(n_features, 1000, replace=False)
+    ref = np.array([f_oneway(*[dset.intensities[i, idx] for idx in groups.values()]).pvalue for i in check])
+    return np.allclose(anova_p[check], ref, rtol=1e-10, atol=0.) and t1 - t0 < 1.
+
+
+def bench_import_time():
+    """
+bench_import_time
+    description:
+        Imports each of the main lipydomics modules in a fresh interpreter (python -X importtime) and reports the
+        cumulative import time of each. The heavy dependencies (pandas, scipy, sklearn, and matplotlib) are only
+        imported when they are first used, so importing lipydomics should be fast.
+
+        Benchmark fails if any module takes longer than IMPORT_TIME_BUDGET to import
+    returns:
+        (bool) -- benchmark pass (True) or fail (False)
+"""
+    ok = True
+    for module in ['lipydomics.data', 'lipydomics.stats', 'lipydomics.plotting', 'lipydomics.identification']:
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                              capture_output=True, text=True, check=True)
+        # lines look like: "import time: self [us] | cumulative | imported package"
+        for line in proc.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                t = int(fields[1]) / 1e6
+                print('\n\t\t{}: {:.3f} s'.format(module, t), end='')
+                ok = ok and t <= IMPORT_TIME_BUDGET
+    return ok
+
+
+# references to all of the benchmark functions to be run, and order to run them in
+all_benchmarks = [
+    bench_add_feature_ids_engines_real1,
+    bench_id_engines_synthetic_100k,
+    bench_pred_levels_joined_vs_predicted,
+    bench_add_feature_ids_n_jobs_scaling,
+    bench_predict_ccs_rt_batch,
+    bench_compact_ccs_model,
+    bench_dataset_csv_load,
+    bench_save_load_bin,
+    bench_group_data_allocations,
+    bench_anova_100k_12groups,
+    bench_import_time
+]
+if __name__ == '__main__':
+    run_tests(all_benchmarks)
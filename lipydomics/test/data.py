@@ -9,12 +9,17 @@
 
 
 import os
+import pickle
+import shutil
+import tempfile
 import numpy as np
 
 from lipydomics.test import run_tests
+import lipydomics.data
 from lipydomics.data import Dataset
-from lipydomics.stats import add_pca3, add_plsra
+from lipydomics.stats import add_pca3, add_plsra, add_anova_p, add_log2fc, add_2group_pvalue, add_2group_corr
 from lipydomics.identification import add_feature_ids
+from lipydomics.identification.rt_calibration import RTCalibration
 
 
 def dataset_init_mock1():
@@ -36,6 +41,59 @@ dataset_init_mock1
     return dset.labels.shape == (5, 3) and dset.intensities.shape == (5, 6)
 
 
+def dataset_init_genfromtxt_real1():
+    """
+dataset_init_genfromtxt_real1
+    description:
+        Initializes the Dataset class using real_data_1.csv, with float64 and float32 intensities, and compares the
+        labels and intensities against the arrays loaded with numpy.genfromtxt
+
+        Test fails if the labels or intensities do not match the reference arrays, or have the wrong dtypes
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    csv = os.path.join(os.path.dirname(__file__), 'real_data_1.csv')
+    mz, rt, ccs, *intensities = np.genfromtxt(csv, delimiter=',', unpack=True, skip_header=1)
+    labels, intensities = np.array([mz, rt, ccs]).T, np.array(intensities).T
+    for dtype in [np.float64, np.float32]:
+        dset = Dataset(csv, dtype=dtype)
+        if dset.labels.dtype != np.float64 or dset.intensities.dtype != dtype:
+            return False
+        if not np.array_equal(dset.labels, labels) or not np.array_equal(dset.intensities, intensities.astype(dtype)):
+            return False
+    return True
+
+
+def dataset_init_comments_real1():
+    """
+dataset_init_comments_real1
+    description:
+        Writes a copy of real_data_1.csv with comment and blank lines (including right after the header, before the
+        first line of data) then initializes the Dataset class from it, in memory and with memory mapped intensities,
+        and compares the labels and intensities against the arrays loaded with numpy.genfromtxt from the original
+
+        Test fails if the labels or intensities do not match the reference arrays
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    csv = os.path.join(os.path.dirname(__file__), 'real_data_1.csv')
+    mz, rt, ccs, *intensities = np.genfromtxt(csv, delimiter=',', unpack=True, skip_header=1)
+    labels, intensities = np.array([mz, rt, ccs]).T, np.array(intensities).T
+    with open(csv, 'r') as f:
+        header, *lines = f.read().splitlines()
+    lines = [header, '#comment', ''] + lines[:100] + ['# more comments', ''] + lines[100:]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        commented_csv = os.path.join(tmp_dir, 'real_data_1_comments.csv')
+        with open(commented_csv, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        for mmap_dir in [None, os.path.join(tmp_dir, 'mmap')]:
+            dset = Dataset(commented_csv, mmap_dir=mmap_dir)
+            if not np.array_equal(dset.labels, labels) or not np.array_equal(dset.intensities, intensities):
+                return False
+            del dset
+    return True
+
+
 def dataset_normalize_mock1():
     """
 dataset_normalize_mock1
@@ -67,6 +125,105 @@ dataset_getgroup_mock1
     return True
 
 
+def dataset_getgroup_cache_real1():
+    """
+dataset_getgroup_cache_real1
+    description:
+        Loads real_data_1.csv and gets data by group with contiguous groups (which should be read-only views of the
+        intensities) and interleaved groups (which should be copied once then cached). Then checks that the cached
+        data gets updated after normalizing, dropping features, reassigning groups, and replacing the intensities with
+        a modified copy.
+
+        Test fails if any of the group data does not match the intensities indexed directly, if contiguous groups are
+        not views, if interleaved groups are not cached, if any of the arrays are writeable, or if stale cached data is
+        returned
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'))
+    groups = {'A': [0, 1, 2, 3, 4], 'B': [5, 6, 7, 8, 9], 'C': [10, 12, 14, 16, 18], 'D': [11, 13, 15, 17, 19]}
+    dset.assign_groups(groups)
+
+    def check(normed):
+        intensities = dset.normed_intensities if normed else dset.intensities
+        for name, idx in groups.items():
+            x = dset.get_data_bygroup(name, normed=normed)
+            if x.flags.writeable or not np.array_equal(x, intensities[:, idx]):
+                return False
+            # contiguous groups are views, the others are cached
+            if name in ['A', 'B'] and not np.shares_memory(x, intensities):
+                return False
+            if name in ['C', 'D'] and x is not dset.get_data_bygroup(name, normed=normed):
+                return False
+        return True
+
+    if not check(False):
+        return False
+    dset.normalize(np.linspace(0.5, 1.5, 20))
+    if not check(True) or not check(False):
+        return False
+    dset.drop_features('mintensity', lower_bound=1000, normed=True)
+    if not check(True) or not check(False):
+        return False
+    groups['C'] = [10, 11, 14, 15, 18]
+    dset.assign_groups({'C': groups['C']})
+    if not check(True) or not check(False):
+        return False
+    intensities = dset.intensities.copy()
+    intensities[:, groups['C']] += 1.
+    dset.intensities = intensities
+    return check(False)
+
+
+def dataset_group_stats_real1():
+    """
+dataset_group_stats_real1
+    description:
+        Loads real_data_1.csv, assigns groups, and gets the per-group summary statistics (sample count, sum, sum of
+        squares, mean, variance, minimum, maximum) for raw and normalized intensities, then checks that they get
+        recomputed after the intensities or groups change (including replacing the intensities with a modified copy)
+
+        Test fails if any of the summary statistics do not match values computed directly from the group data, if they
+        are not cached, or if stale statistics are returned
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'))
+    groups = {'A': [0, 1, 2, 3, 4, 5], 'B': [6, 8, 10, 12], 'C': [13]}
+    dset.assign_groups(groups)
+
+    def check(normed):
+        for name in groups:
+            x = dset.get_data_bygroup(name, normed=normed)
+            gs = dset.get_group_stats(name, normed=normed)
+            if gs is not dset.get_group_stats(name, normed=normed) or gs['n'] != len(groups[name]):
+                return False
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ref = [np.sum(x, axis=1), np.sum(x * x, axis=1), np.mean(x, axis=1), np.var(x, axis=1, ddof=1),
+                       np.min(x, axis=1), np.max(x, axis=1)]
+            for stat, r in zip(['sum', 'sumsq', 'mean', 'var', 'min', 'max'], ref):
+                if not np.allclose(gs[stat], r, rtol=1e-12, atol=0., equal_nan=True):
+                    return False
+        return True
+
+    if not check(False):
+        return False
+    dset.normalize(np.linspace(0.5, 1.5, 20))
+    if not check(True):
+        return False
+    dset.drop_features('mintensity', lower_bound=1000, normed=True)
+    if not check(True) or not check(False):
+        return False
+    groups['B'] = [6, 7, 8]
+    dset.assign_groups({'B': groups['B']})
+    if not check(True) or not check(False):
+        return False
+    intensities = dset.intensities.copy()
+    intensities[:, groups['A']] *= 2.
+    dset.intensities = intensities
+    return check(False)
+
+
 def dataset_assign_groups_using_replicates_real1():
     """
 dataset_assign_groups_using_replicates_real1
@@ -95,6 +252,160 @@ dataset_assign_groups_using_replicates_real1
     return True
 
 
+def dataset_save_load_bin_real1():
+    """
+dataset_save_load_bin_real1
+    description:
+        Loads real_data_1.csv, assigns groups, normalizes, computes PCA and ANOVA, makes identifications and adds a
+        retention time calibration, then saves the Dataset with Dataset.save_bin(...) and loads it back. Also checks
+        that a Dataset pickled the old way still loads with Dataset.load_bin(...)
+
+        Test fails if the reloaded arrays, statistics, identifications, groups, retention time calibration, or fitted
+        PCA do not match, if the reloaded arrays are not read-only views of the file, or if the PCA gets unpickled
+        before it is used
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    dset.assign_groups_with_replicates(['Par', 'Dap2', 'Dal2', 'Van4', 'Van8'], 4)
+    dset.normalize(np.linspace(0.5, 1.5, 20))
+    add_pca3(dset, ['Par', 'Dap2', 'Dal2', 'Van4', 'Van8'])
+    add_anova_p(dset, ['Par', 'Dap2', 'Dal2', 'Van4', 'Van8'], normed=True)
+    add_feature_ids(dset, [0.03, 0.3, 3.])
+    dset.rt_calibration = RTCalibration(['PC(16:0_18:1)', 'PE(18:0_20:4)'], [3.21, 4.56], [3.3, 4.5])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_path = os.path.join(tmp_dir, 'dataset_real1.bin')
+        dset.save_bin(bin_path)
+        dset_reload = Dataset.load_bin(bin_path)
+        # the PCA should not be unpickled until it is used
+        if 'pca3_' in dset_reload.__dict__:
+            return False
+        for name in ['labels', 'intensities', 'normed_intensities']:
+            x = getattr(dset_reload, name)
+            if x.flags.writeable or not np.array_equal(x, getattr(dset, name)):
+                return False
+        if list(dset_reload.stats) != list(dset.stats):
+            return False
+        for label in dset.stats:
+            if not np.array_equal(dset_reload.stats[label], dset.stats[label], equal_nan=True):
+                return False
+        if (dset_reload.feat_ids, dset_reload.feat_id_levels, dset_reload.feat_id_scores) != \
+                (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores):
+            return False
+        if dset_reload.group_indices != dset.group_indices or dset_reload.esi_mode != dset.esi_mode:
+            return False
+        if dset_reload.rt_calibration.get_calibrated_rt(4.) != dset.rt_calibration.get_calibrated_rt(4.):
+            return False
+        if not np.array_equal(dset_reload.pca3_.components_, dset.pca3_.components_):
+            return False
+        # Datasets that were pickled by older versions
+        pickle_path = os.path.join(tmp_dir, 'dataset_real1.pickle')
+        with open(pickle_path, 'wb') as pf:
+            pickle.dump(dset, pf)
+        if not np.array_equal(Dataset.load_bin(pickle_path).intensities, dset.intensities):
+            return False
+        del dset_reload
+    return True
+
+
+def dataset_save_load_bin_memmap_real1():
+    """
+dataset_save_load_bin_memmap_real1
+    description:
+        Loads real_data_1.csv into memory mapped storage, assigns groups and normalizes, then saves the Dataset with
+        Dataset.save_bin(...) and removes the memory map directory before loading it back (like loading the file on
+        another machine). The reloaded Dataset is normalized again and has features dropped, and the same is done with
+        a Dataset pickled the old way.
+
+        Test fails if the reloaded Dataset still has mmap_dir set, if anything gets written into the (removed) memory
+        map directory, or if the intensities after normalizing and dropping features do not match the same operations
+        on a Dataset kept in memory
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    csv = os.path.join(os.path.dirname(__file__), 'real_data_1.csv')
+    weights = np.linspace(0.5, 1.5, 20)
+    ref = Dataset(csv)
+    ref.normalize(weights[::-1])
+    ref.drop_features('meantensity', lower_bound=10000., normed=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mmap_dir = os.path.join(tmp_dir, 'mmap')
+        dset = Dataset(csv, mmap_dir=mmap_dir)
+        dset.assign_groups_with_replicates(['Par', 'Dap2', 'Dal2', 'Van4', 'Van8'], 4)
+        dset.normalize(weights)
+        bin_path = os.path.join(tmp_dir, 'dataset_real1.bin')
+        pickle_path = os.path.join(tmp_dir, 'dataset_real1.pickle')
+        dset.save_bin(bin_path)
+        with open(pickle_path, 'wb') as pf:
+            pickle.dump(dset, pf)
+        del dset
+        shutil.rmtree(mmap_dir)
+        for dset_reload in [Dataset.load_bin(bin_path), Dataset.load_bin(pickle_path)]:
+            if dset_reload.mmap_dir is not None:
+                return False
+            dset_reload.normalize(weights[::-1])
+            dset_reload.drop_features('meantensity', lower_bound=10000., normed=True)
+            if os.path.exists(mmap_dir) or not np.array_equal(dset_reload.intensities, ref.intensities) or \
+                    not np.array_equal(dset_reload.normed_intensities, ref.normed_intensities):
+                return False
+            del dset_reload
+    return True
+
+
+def dataset_memmap_real1():
+    """
+dataset_memmap_real1
+    description:
+        Loads real_data_1.csv into memory and into memory mapped storage (with a small block size so that the
+        intensities are processed in many blocks), then assigns groups, normalizes, computes per-feature statistics
+        and drops features with both and compares the results. Also moves an in-memory Dataset into memory mapped
+        storage with Dataset.to_memmap(...)
+
+        Test fails if the intensities are not memory mapped, or if any of the intensities or statistics differ
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    csv = os.path.join(os.path.dirname(__file__), 'real_data_1.csv')
+    block_bytes = lipydomics.data.MMAP_BLOCK_BYTES
+    # 100 features at a time
+    lipydomics.data.MMAP_BLOCK_BYTES = 100 * 8 * 23
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dset = Dataset(csv)
+            dset_mm = Dataset(csv, mmap_dir=os.path.join(tmp_dir, 'a'))
+            dset_to = Dataset(csv)
+            dset_to.to_memmap(os.path.join(tmp_dir, 'b'))
+            for d in [dset, dset_mm, dset_to]:
+                d.assign_groups_with_replicates(['Par', 'Dap2', 'Dal2', 'Van4', 'Van8'], 4)
+                d.normalize(np.linspace(0.5, 1.5, 20))
+                add_anova_p(d, ['Par', 'Dap2', 'Dal2', 'Van4', 'Van8'], normed=True)
+                add_log2fc(d, ['Par', 'Dap2'])
+                add_2group_pvalue(d, ['Par', 'Dap2'], 'welchs')
+                add_2group_pvalue(d, ['Par', 'Dap2'], 'mann-whitney', normed=True)
+                add_2group_corr(d, ['Par', 'Dap2'])
+                d.drop_features('mintensity', lower_bound=1000, normed=False)
+            for d in [dset_mm, dset_to]:
+                if not isinstance(d.intensities, np.memmap) or not isinstance(d.normed_intensities, np.memmap):
+                    return False
+                if not np.array_equal(d.labels, dset.labels) or d.n_features != dset.n_features:
+                    return False
+                if not np.array_equal(d.intensities, dset.intensities):
+                    return False
+                if not np.array_equal(d.normed_intensities, dset.normed_intensities):
+                    return False
+                for label in dset.stats:
+                    if not np.array_equal(d.stats[label], dset.stats[label], equal_nan=True):
+                        return False
+            # only the .npy files backing the current arrays should be left (old ones get removed)
+            if len(os.listdir(os.path.join(tmp_dir, 'a'))) != 2:
+                return False
+            # release the memory maps before the directory gets cleaned up
+            del dset_mm, dset_to, d
+    finally:
+        lipydomics.data.MMAP_BLOCK_BYTES = block_bytes
+    return True
+
+
 def dataset_save_load_bin_mock1():
     """
 dataset_save_load_bin_mock1
@@ -333,10 +644,17 @@ dataset_drop_features_real1
 # references to al of the test functions to be run, and order to run them in
 all_tests = [
     dataset_init_mock1,
+    dataset_init_genfromtxt_real1,
+    dataset_init_comments_real1,
     dataset_normalize_mock1,
     dataset_getgroup_mock1,
+    dataset_getgroup_cache_real1,
+    dataset_group_stats_real1,
     dataset_assign_groups_using_replicates_real1,
     dataset_save_load_bin_mock1,
+    dataset_save_load_bin_real1,
+    dataset_save_load_bin_memmap_real1,
+    dataset_memmap_real1,
     dataset_export_feature_data_real1,
     dataset_export_xlsx_real1,
     dataset_export_analyzed_xlsx_real1,
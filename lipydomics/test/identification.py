@@ -9,10 +9,49 @@
 
 
 import os
+import pickle
+from functools import partial
+from io import BytesIO
+from itertools import product
+from sqlite3 import connect
+from tempfile import TemporaryDirectory
+import numpy as np
 
 from lipydomics.test import run_tests
 from lipydomics.data import Dataset
-from lipydomics.identification import add_feature_ids, predict_ccs, predict_rt, remove_potential_nonlipids
+from lipydomics.identification import (
+    add_feature_ids, predict_ccs, predict_rt, predict_ccs_batch, predict_rt_batch, remove_potential_nonlipids
+)
+from lipydomics.identification.mz_generation import (
+    get_lipid_mz, enumerate_lipid_class, enumerate_lipid_class_array, DG, TG, DGDG, GlcADG, MGDG, AcylPG, AcylPE, CL,
+    PA, PC, PE, PG, PI, PIP, PIP2, PIP3, PS, LysylPG, AlanylPG, LPA, LPC, LPE, LPG, LPI, LPS, LCL, Cer, HexCer, GlcCer,
+    SM, Ganglioside, FA
+)
+from lipydomics.identification.LipidMass.monoiso import adduct_to_m
+from lipydomics.identification.fill_theo_mz_from_gen import enumerated_mz_rows
+from lipydomics.identification.db_table_defs import measured, theo_mz, theo_ccs, theo_rt, build_stages
+from lipydomics.identification.build_params import ccs_pred_ref_dsets
+from lipydomics.identification.characterize_lipid_ccs_pred import group_data as ccs_group_data
+from lipydomics.identification import build_database
+from lipydomics.identification.build_database import get_stages, stage_input_hash, run_stages
+from lipydomics.identification.train_lipid_ccs_pred import (
+    prep_encoders as ccs_prep_encoders, featurize as ccs_featurize, add_predicted_ccs
+)
+from lipydomics.identification.train_lipid_rt_pred import (
+    prep_encoders as rt_prep_encoders, featurize as rt_featurize, predict_batch as rt_predict_batch,
+    add_predicted_rt
+)
+from lipydomics.identification.featurization import ccs_featurize_batch, rt_featurize_batch
+from lipydomics.identification.encoder_params import (
+    ccs_lipid_classes, ccs_fa_mods, ccs_ms_adducts, rt_lipid_classes, rt_fa_mods
+)
+from lipydomics.identification.compact_models import export_svr, export_linear, load_model
+from lipydomics.identification import id_cache
+from lipydomics.identification.id_cache import IdCache
+from lipydomics.identification.id_levels import (
+    id_feat_meas_mz_rt_ccs, id_feat_pred_mz_rt_ccs, id_feat_meas_mz_rt, id_feat_pred_mz_rt, id_feat_meas_mz_ccs,
+    id_feat_pred_mz_ccs, id_feat_meas_mz, id_feat_pred_mz, id_feat_any, id_feat_custom
+)
 
 
 def add_feature_ids_any_real1():
@@ -154,6 +193,312 @@ add_feature_ids_any_bad_tstamp
     return False
 
 
+def add_feature_ids_batch_real1():
+    """
+add_feature_ids_batch_real1
+    description:
+        Uses the raw data from real_data_1.csv to make compound identifications using the per-feature, batch, and
+        numpy identification engines, for the 'any' identification level (with and without retention time, Da and ppm
+        m/z tolerances), a custom list of identification levels, and a single identification level
+
+        Test fails if there are any errors, or if the identifications, identification levels, or scores from the
+        engines are not exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    params = [
+        ([0.05, 0.5, 5.], {}),
+        ([50., 0.5, 5.], {'mz_tol_type': 'ppm'}),
+        ([0.05, 0.5, 5.], {'use_rt': False, 'norm': 'l1'}),
+        ([0.05, 0.5, 5.], {'level': ['pred_mz_rt_ccs', 'pred_mz_rt', 'pred_mz']}),
+        ([0.05, 0.5, 5.], {'level': 'meas_mz'})
+    ]
+    for tol, kwargs in params:
+        add_feature_ids(dset, tol, engine='feature', **kwargs)
+        expected = (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores)
+        for engine in ['batch', 'numpy']:
+            add_feature_ids(dset, tol, engine=engine, **kwargs)
+            if (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores) != expected:
+                m = 'add_feature_ids_batch_real1: {} and per-feature identifications differ (tol: {}, kwargs: {})'
+                raise RuntimeError(m.format(engine, tol, kwargs))
+    return True
+
+
+def add_feature_ids_n_jobs_real1():
+    """
+add_feature_ids_n_jobs_real1
+    description:
+        Uses the raw data from real_data_1.csv to make compound identifications with the per-feature and batch
+        identification engines, in a single process and split between 3 worker processes, for the 'any' identification
+        level and a custom list of identification levels
+
+        Test fails if there are any errors, or if the identifications, identification levels, or scores from the
+        single process and worker processes are not exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    for engine in ['feature', 'batch']:
+        for kwargs in [{}, {'level': ['pred_mz_rt_ccs', 'meas_mz_ccs', 'pred_mz']}]:
+            add_feature_ids(dset, [0.05, 0.5, 5.], engine=engine, **kwargs)
+            expected = (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores)
+            add_feature_ids(dset, [0.05, 0.5, 5.], engine=engine, n_jobs=3, **kwargs)
+            if (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores) != expected:
+                return False
+    return True
+
+
+def add_feature_ids_bad_n_jobs():
+    """
+add_feature_ids_bad_n_jobs
+    description:
+        Tries to make compound identifications with invalid values for n_jobs (0, -2, and 1.5)
+
+        Test fails if a ValueError is not raised for each
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    for n_jobs in [0, -2, 1.5]:
+        try:
+            add_feature_ids(dset, [0.05, 0.5, 5.], n_jobs=n_jobs)
+            return False
+        except ValueError:
+            pass
+    return True
+
+
+def add_feature_ids_cache_real1():
+    """
+add_feature_ids_cache_real1
+    description:
+        Uses the raw data from real_data_1.csv to make compound identifications with and without a persistent cache
+        of identification results: first with an empty cache, then again with the same parameters (after dropping
+        some of the features) and finally with a different set of tolerances
+
+        Test fails if there are any errors, if the identifications, identification levels, or scores made using the
+        cache are not exactly the same as those made without it, or if the cache hits and misses are not as expected
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    n = dset.n_features
+    with TemporaryDirectory() as tmp:
+        cache = IdCache(os.path.join(tmp, 'id_cache.db'))
+        for tol, hits, misses in [([0.05, 0.5, 5.], 0, n), ([0.05, 0.5, 5.], n, n), ([0.05, 1., 5.], n, 2 * n)]:
+            add_feature_ids(dset, tol)
+            expected = (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores)
+            add_feature_ids(dset, tol, cache=cache)
+            if (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores) != expected:
+                return False
+            if (cache.hits, cache.misses) != (hits, misses):
+                return False
+        # the remaining features are all found in the cache after dropping some
+        dset.drop_features('mintensity', lower_bound=1000, normed=False)
+        add_feature_ids(dset, [0.05, 0.5, 5.])
+        expected = (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores)
+        add_feature_ids(dset, [0.05, 0.5, 5.], cache=cache)
+        if (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores) != expected:
+            return False
+        if cache.misses != 2 * n or cache.hits != n + dset.n_features:
+            return False
+        cache.close()
+    return True
+
+
+def add_feature_ids_cache_missing_real1():
+    """
+add_feature_ids_cache_missing_real1
+    description:
+        Writes a copy of real_data_1.csv with the retention time and/or CCS of some features left empty (loaded as NaN)
+        then makes compound identifications with and without a persistent cache of identification results, twice
+
+        Test fails if there are any errors, if the identifications made using the cache are not exactly the same as
+        those made without it, or if the features with missing values are not found in the cache the second time
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    with open(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), 'r') as f:
+        lines = f.read().splitlines()
+    for i in range(1, 40, 3):
+        mz, rt, ccs, *ints = lines[i].split(',')
+        lines[i] = ','.join([mz, '' if i % 2 else rt, '' if i % 9 < 5 else ccs] + ints)
+    with TemporaryDirectory() as tmp:
+        csv = os.path.join(tmp, 'real_data_1_missing.csv')
+        with open(csv, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        dset = Dataset(csv, esi_mode='neg')
+        if not np.isnan(dset.labels[:, 1:]).any():
+            return False
+        add_feature_ids(dset, [0.05, 0.5, 5.])
+        expected = (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores)
+        cache = IdCache(os.path.join(tmp, 'id_cache.db'))
+        for hits in [0, dset.n_features]:
+            add_feature_ids(dset, [0.05, 0.5, 5.], cache=cache)
+            if (dset.feat_ids, dset.feat_id_levels, dset.feat_id_scores) != expected or cache.hits != hits:
+                return False
+        cache.close()
+    return True
+
+
+def id_cache_lru_eviction():
+    """
+id_cache_lru_eviction
+    description:
+        Adds results to an identification cache with a maximum size of 3 results, then checks which results remain
+        after more are added and some are used
+
+        Test fails if there are any errors, or if the cache does not evict the least recently used results
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    feats = [(700. + i, 5., 270.) for i in range(5)]
+    res = [(['PC(32:0)_[M+H]+'], 'meas_mz', [float(i)]) for i in range(5)]
+    with TemporaryDirectory() as tmp:
+        cache = IdCache(os.path.join(tmp, 'id_cache.db'), max_entries=3)
+        ctx = cache.context('test', 'any', 'l2', 'Da', [0.05, 0.5, 5.], 'pos', False)
+        cache.put(ctx, feats[:3], res[:3])
+        # using feature 0 makes feature 1 the least recently used
+        if cache.get(ctx, feats[:1]) != res[:1]:
+            return False
+        cache.put(ctx, feats[3:4], res[3:4])
+        if len(cache) != 3 or cache.get(ctx, feats[:4]) != [res[0], None, res[2], res[3]]:
+            return False
+        # a different context does not match
+        if cache.get(cache.context('test', 'any', 'l1', 'Da', [0.05, 0.5, 5.], 'pos', False), feats[:1]) != [None]:
+            return False
+        cache.close()
+    return True
+
+
+def id_cache_unwritable_path():
+    """
+id_cache_unwritable_path
+    description:
+        Opens an identification cache where the default location (builds directory) can not be written to (like a
+        read-only installation), then opens one at an explicit path that can not be written to
+
+        Test fails if the cache does not fall back on the next default location, or if an explicit path that can not
+        be written to does not raise an OSError
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    default_paths = id_cache._default_paths
+    with TemporaryDirectory() as tmp:
+        # a path inside of a regular file can never be created
+        blocker = os.path.join(tmp, 'blocker')
+        open(blocker, 'w').close()
+        fallback = os.path.join(tmp, 'user_cache', 'lipydomics', 'id_cache.db')
+        id_cache._default_paths = lambda: [os.path.join(blocker, 'id_cache.db'), fallback]
+        try:
+            cache = IdCache()
+        finally:
+            id_cache._default_paths = default_paths
+        if cache.path != fallback or not os.path.isfile(fallback):
+            return False
+        cache.close()
+        try:
+            IdCache(os.path.join(blocker, 'id_cache.db'))
+        except OSError:
+            return True
+    return False
+
+
+def id_feat_tiered_real1():
+    """
+id_feat_tiered_real1
+    description:
+        Identifies the features from real_data_1.csv with id_feat_any (with and without retention time) and
+        id_feat_custom, which fetch all candidates within the m/z tolerance at once then assign identification levels,
+        and compares the results against trying each of the individual identification level functions in turn
+
+        Test fails if there are any errors, or if the identifications, identification levels, or scores are not
+        exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'), esi_mode='neg')
+    con = connect(os.path.join(os.path.dirname(__file__), '../identification/lipids.db'))
+    cur = con.cursor()
+    all_funcs = [
+        id_feat_meas_mz_rt_ccs, id_feat_pred_mz_rt_ccs, id_feat_meas_mz_rt, id_feat_pred_mz_rt, id_feat_meas_mz_ccs,
+        id_feat_pred_mz_ccs, id_feat_meas_mz, id_feat_pred_mz
+    ]
+    custom = ['pred_mz_ccs', 'meas_mz_rt', 'pred_mz']
+    checks = [
+        (lambda *args: id_feat_any(*args), all_funcs),
+        (lambda *args: id_feat_any(*args, use_rt=False), all_funcs[4:]),
+        (lambda *args: id_feat_custom(custom, *args), [id_feat_pred_mz_ccs, id_feat_meas_mz_rt, id_feat_pred_mz])
+    ]
+    for mz, rt, ccs in dset.labels:
+        args = (cur, mz, rt, ccs, 0.05, 0.5, ccs * 0.05, 'neg')
+        for tiered, id_funcs in checks:
+            expected = ('', '', [])
+            for id_func in id_funcs:
+                fid, lvl, scr = id_func(*args)
+                if fid:
+                    expected = (fid, lvl, scr)
+                    break
+            if tiered(*args) != expected:
+                con.close()
+                return False
+    con.close()
+    return True
+
+
+def id_levels_query_plans():
+    """
+id_levels_query_plans
+    description:
+        Runs EXPLAIN QUERY PLAN on the queries made by each of the individual identification level functions (for a
+        feature that matches at every level) and checks that they use the indexes in lipids.db: the R*Tree table for
+        the measured levels that match on m/z and rt and/or CCS, the (positive mode) partial covering m/z index for the
+        measured level that matches on m/z only, and the m/z primary key of the predicted table for all of the
+        predicted levels
+
+        Test fails if any of the queries do a full scan of a table, or does not use the expected index
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    class PlanCursor:
+        # wraps a cursor, recording the query plan of each query before running it
+        def __init__(self, cursor):
+            self.cursor, self.plans = cursor, []
+
+        def execute(self, qry, qdata):
+            qp = self.cursor.execute('EXPLAIN QUERY PLAN ' + qry, qdata).fetchall()
+            self.plans.append([_[3] for _ in qp])
+            return self.cursor.execute(qry, qdata)
+
+    expected = [
+        (id_feat_meas_mz_rt_ccs, 'SCAN b VIRTUAL TABLE INDEX 2:'),
+        (id_feat_pred_mz_rt_ccs, 'SEARCH predicted USING PRIMARY KEY'),
+        (id_feat_meas_mz_rt, 'SCAN b VIRTUAL TABLE INDEX 2:'),
+        (id_feat_pred_mz_rt, 'SEARCH predicted USING PRIMARY KEY'),
+        (id_feat_meas_mz_ccs, 'SCAN b VIRTUAL TABLE INDEX 2:'),
+        (id_feat_pred_mz_ccs, 'SEARCH predicted USING PRIMARY KEY'),
+        (id_feat_meas_mz, 'SEARCH measured USING COVERING INDEX measured_mz_pos_idx'),
+        (id_feat_pred_mz, 'SEARCH predicted USING PRIMARY KEY')
+    ]
+    con = connect(os.path.join(os.path.dirname(__file__), '../identification/lipids.db'))
+    for id_func, index_step in expected:
+        cur = PlanCursor(con.cursor())
+        # PE(p34:2) [M+H]+
+        fid, _, _ = id_func(cur, 700.5287, 5.33, 271.8, 0.05, 1.5, 10., 'pos')
+        plan, = cur.plans
+        if not fid or not plan[0].startswith(index_step):
+            con.close()
+            return False
+        for step in plan:
+            # a plain SCAN (other than the R*Tree box query) means a full table scan
+            if step.startswith('SCAN') and 'VIRTUAL TABLE INDEX 2:' not in step:
+                con.close()
+                return False
+    con.close()
+    return True
+
+
 def predict_ccs_noerrs():
     """
 predict_ccs_noerrs
@@ -265,6 +610,431 @@ predict_rt_ignencerr
     return True
 
 
+def featurize_batch_bit_identical():
+    """
+featurize_batch_bit_identical
+    description:
+        Featurizes every combination of the lipid classes, fatty acid modifiers, and MS adducts that the CCS and RT
+        models encode (see encoder_params.py), plus None and unknown values for each (and the lipid class 'PE', which
+        is listed twice for the RT model), using both featurize_batch(...) and featurize(...) one lipid at a time
+
+        Test fails if the feature vectors are not exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    ccs_rows = [(lc, 12 + i % 30, i % 7, fam, add, 300. + 0.123 * i) for i, (lc, fam, add) in enumerate(product(
+        ccs_lipid_classes + [None, 'XYZ'], ccs_fa_mods + [None, 'x'], ccs_ms_adducts + [None, '[M+X]+']))]
+    encoders = ccs_prep_encoders()
+    X = np.array([ccs_featurize(*row, *encoders) for row in ccs_rows])
+    if not np.array_equal(ccs_featurize_batch(*zip(*ccs_rows)), X):
+        return False
+    rt_rows = [(lc, 12 + i % 30, i % 7, fam) for i, (lc, fam) in enumerate(product(
+        rt_lipid_classes + [None, 'XYZ'], rt_fa_mods + [None, 'x']))]
+    encoders = rt_prep_encoders()
+    X = np.array([rt_featurize(*row, *encoders) for row in rt_rows])
+    return np.array_equal(rt_featurize_batch(*zip(*rt_rows)), X)
+
+
+def predict_ccs_batch_real1():
+    """
+predict_ccs_batch_real1
+    description:
+        predicts CCS for several lipids (including one that is not encodable) using predict_ccs_batch, and compares
+        the predictions against those made one lipid at a time by featurizing with train_lipid_ccs_pred.featurize(...)
+        and using the pickled (scikit-learn) model and scaler directly
+
+        test fails if there are any errors, or if the predictions are not the same (within a relative tolerance of
+        1e-9, the predictions are made using the NumPy version of the model, see compact_models.py)
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    lipids = [('PC', 34, 3, '[M+H]+', None), ('PE', 38, 1, '[M-H]-', 'o'), ('LPE', 18, 1, '[M+Na]+', None),
+              ('TG', 52, 2, '[M+NH4]+', None), ('Rock', 34, 3, '[M+Paper]+', 'Scissors')]
+    mzs = ['generate', 'generate', 234.5678, 'generate', 234.5678]
+    ccs = predict_ccs_batch(*zip(*[lpd[:4] for lpd in lipids]), mzs=mzs, fa_mods=[lpd[4] for lpd in lipids],
+                            ignore_encoding_errors=True)
+    encoders = ccs_prep_encoders()
+    this_dir = os.path.join(os.path.dirname(__file__), '..', 'identification')
+    with open(os.path.join(this_dir, 'lipid_ccs_pred.pickle'), 'rb') as pf1, \
+            open(os.path.join(this_dir, 'lipid_ccs_scale.pickle'), 'rb') as pf2:
+        model, scaler = pickle.load(pf1), pickle.load(pf2)
+    for (lc, lnc, lnu, add, fam), mz, ccs_ in zip(lipids, mzs, ccs):
+        mz = get_lipid_mz(lc, lnc, lnu, add, fa_mod=fam) if mz == 'generate' else mz
+        x = [ccs_featurize(lc, lnc, lnu, fam, add, mz, *encoders)]
+        if not np.isclose(model.predict(scaler.transform(x))[0], ccs_, rtol=1e-9, atol=0.):
+            return False
+    # the single-lipid version gives the same predictions
+    if predict_ccs('PE', 38, 1, '[M-H]-', fa_mod='o') != ccs[1]:
+        return False
+    return True
+
+
+def compact_models_parity_real1():
+    """
+compact_models_parity_real1
+    description:
+        exports the pickled (scikit-learn) CCS and RT models to .npz files, loads them back, and compares predictions
+        made by the NumPy versions of the models against predictions made by the scikit-learn models for all of the
+        lipids in the predicted_mz table with an encodable lipid class, using small blocks for the kernel evaluation.
+        Also checks that the shipped .npz models are the same as the exported ones.
+
+        test fails if there are any errors, if the CCS predictions are not the same within a relative tolerance of
+        1e-9, or if the RT predictions are not exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    this_dir = os.path.join(os.path.dirname(__file__), '..', 'identification')
+    con = connect(os.path.join(this_dir, 'lipids.db'))
+    rows = con.execute('SELECT lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz FROM predicted_mz').fetchall()
+    con.close()
+    with TemporaryDirectory() as tmp:
+        for pred, export, featurize_batch, args in [
+                ('ccs', export_svr, ccs_featurize_batch, [row for row in rows if row[0] in ccs_lipid_classes]),
+                ('rt', export_linear, rt_featurize_batch, [row[:4] for row in rows if row[0] in rt_lipid_classes])]:
+            with open(os.path.join(this_dir, 'lipid_{}_pred.pickle'.format(pred)), 'rb') as pf1, \
+                    open(os.path.join(this_dir, 'lipid_{}_scale.pickle'.format(pred)), 'rb') as pf2:
+                model, scaler = pickle.load(pf1), pickle.load(pf2)
+            npz_path = os.path.join(tmp, '{}.npz'.format(pred))
+            export(model, scaler, npz_path)
+            compact, shipped = load_model(npz_path), load_model(os.path.join(this_dir, 'lipid_{}_pred.npz'.format(pred)))
+            X = featurize_batch(*zip(*args))
+            if pred == 'ccs':
+                expected = model.predict(scaler.transform(X))
+                if not np.allclose(compact.predict(X, block_size=1000), expected, rtol=1e-9, atol=0.):
+                    return False
+                if not np.array_equal(shipped.support_vectors, compact.support_vectors):
+                    return False
+                if (shipped.intercept, shipped.gamma) != (compact.intercept, compact.gamma):
+                    return False
+            else:
+                expected = rt_predict_batch(model, scaler, X)
+                if not np.array_equal(compact.predict(X), expected):
+                    return False
+                if not np.array_equal(shipped.coef, compact.coef) or shipped.intercept != compact.intercept:
+                    return False
+            if not np.array_equal(shipped.scale, compact.scale):
+                return False
+    return True
+
+
+def predict_rt_batch_real1():
+    """
+predict_rt_batch_real1
+    description:
+        predicts HILIC RT for several lipids (including one that is not encodable) using predict_rt_batch, and compares
+        the predictions against those made one lipid at a time by featurizing with train_lipid_rt_pred.featurize(...)
+        and using the pickled model and scaler directly
+
+        test fails if there are any errors, or if the predictions are not exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    lipids = [('PC', 34, 3, None), ('PE', 38, 1, 'p'), ('LPE', 18, 1, None), ('Cer', 40, 1, 'd'),
+              ('Elephant', 34, 3, None)]
+    rt = predict_rt_batch(*zip(*[lpd[:3] for lpd in lipids]), fa_mods=[lpd[3] for lpd in lipids],
+                          ignore_encoding_errors=True)
+    encoders = rt_prep_encoders()
+    this_dir = os.path.join(os.path.dirname(__file__), '..', 'identification')
+    with open(os.path.join(this_dir, 'lipid_rt_pred.pickle'), 'rb') as pf1, \
+            open(os.path.join(this_dir, 'lipid_rt_scale.pickle'), 'rb') as pf2:
+        model, scaler = pickle.load(pf1), pickle.load(pf2)
+    for (lc, lnc, lnu, fam), rt_ in zip(lipids, rt):
+        x = [rt_featurize(lc, lnc, lnu, fam, *encoders)]
+        if model.predict(scaler.transform(x))[0] != rt_:
+            return False
+    # the single-lipid version gives the same predictions
+    if predict_rt('PE', 38, 1, fa_mod='p') != rt[1]:
+        return False
+    return True
+
+
+def add_predicted_ccs_rt_chunked():
+    """
+add_predicted_ccs_rt_chunked
+    description:
+        Copies a sample of the predicted_mz table from lipids.db into an in-memory database, then adds predicted CCS
+        and retention times using the chunked (batch) build functions with a small chunk size, and compares them to
+        predictions made one row at a time using featurize(...) and the pickled models and scalers
+
+        Test fails if there are any errors, or if the predictions (or the lipids they were made for) are not exactly the
+        same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    db_path = os.path.join(os.path.dirname(__file__), '..', 'identification', 'lipids.db')
+    con = connect(':memory:')
+    cur = con.cursor()
+    for tbl in [theo_mz, theo_ccs, theo_rt]:
+        cur.execute(tbl)
+    src = connect(db_path)
+    cur.executemany('INSERT INTO predicted_mz VALUES (?,?,?,?,?,?,?,?,?)',
+                    src.execute('SELECT * FROM predicted_mz WHERE t_id % 50 = 0').fetchall())
+    src.close()
+    rows = cur.execute('SELECT t_id, lipid_class, lipid_nc, lipid_nu, fa_mod, adduct, mz FROM predicted_mz').fetchall()
+    this_dir = os.path.join(os.path.dirname(__file__), '..', 'identification')
+    for pred, fname, prep_encoders_, featurize_, add_predicted in [
+            ('ccs', 'lipid_ccs', ccs_prep_encoders, ccs_featurize, add_predicted_ccs),
+            ('rt', 'lipid_rt', rt_prep_encoders, rt_featurize, add_predicted_rt)]:
+        with open(os.path.join(this_dir, fname + '_pred.pickle'), 'rb') as pf1, \
+                open(os.path.join(this_dir, fname + '_scale.pickle'), 'rb') as pf2:
+            model, scaler = pickle.load(pf1), pickle.load(pf2)
+        add_predicted(cur, model, scaler, chunk_size=300)
+        encoders = prep_encoders_()
+        expected = []
+        for tid, lc, lnc, lnu, fam, add, m in rows:
+            if int(sum(encoders[0].transform([[lc]])[0])) != 0:  # make sure lipid class is encodable
+                args = (lc, lnc, lnu, fam, add, m) if pred == 'ccs' else (lc, lnc, lnu, fam)
+                x = [featurize_(*args, *encoders)]
+                expected.append((tid, model.predict(scaler.transform(x))[0]))
+        if cur.execute('SELECT * FROM predicted_{} ORDER BY t_id'.format(pred)).fetchall() != expected:
+            return False
+    con.close()
+    return True
+
+
+def enumerate_lipid_class_array_real1():
+    """
+enumerate_lipid_class_array_real1
+    description:
+        Enumerates lipid masses for all of the lipid classes (with and without FA modifiers, and a selection of
+        gangliosides) over a range of sum compositions and all of the defined MS adducts, using the array enumeration
+        engine and the per-lipid LipidMass objects
+
+        Test fails if there are any errors, or if the lipids (names, adducts, and order) or their masses (to 6 decimal
+        places) are not the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    classes = [(lc, None) for lc in [DG, TG, DGDG, GlcADG, MGDG, AcylPG, AcylPE, CL, LCL, FA]]
+    classes += [(lc, fam) for lc in [PA, PC, PE, PG, PI, PIP, PIP2, PIP3, PS, LysylPG, AlanylPG, LPA, LPC, LPE, LPG,
+                                     LPI, LPS] for fam in [None, 'p', 'o']]
+    classes += [(lc, 'd') for lc in [Cer, HexCer, GlcCer, SM]]
+    classes += [(partial(Ganglioside, gs), 'd') for gs in ['GA1', 'GM3', 'GD2', 'GT1', 'GQ1']]
+    adducts = list(adduct_to_m)
+    for lc, fam in classes:
+        expected = list(enumerate_lipid_class(lc, (28, 58), (0, 14), adducts, fa_mod=fam))
+        names, adducts_, mzs = enumerate_lipid_class_array(lc, (28, 58), (0, 14), adducts, fa_mod=fam)
+        if [(name, add) for name, add, _ in expected] != list(zip(names, adducts_)):
+            return False
+        if ['{:.6f}'.format(mz) for _, _, mz in expected] != ['{:.6f}'.format(mz) for mz in mzs]:
+            return False
+    return True
+
+
+def enumerated_mz_rows_real1():
+    """
+enumerated_mz_rows_real1
+    description:
+        Generates all of the (batched) rows for the predicted_mz table and compares them against the predicted_mz table
+        in lipids.db
+
+        Test fails if there are any errors, or if the rows are not exactly the same
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    con = connect(os.path.join(os.path.dirname(__file__), '..', 'identification', 'lipids.db'))
+    expected = con.execute('SELECT * FROM predicted_mz ORDER BY t_id').fetchall()
+    con.close()
+    return [row for batch in enumerated_mz_rows(batch_size=10000) for row in batch] == expected
+
+
+def _stage_hash_db():
+    """ in-memory database with the build tables, and the measured and predicted_mz tables copied from lipids.db """
+    con = connect(':memory:')
+    for tbl in [measured, theo_mz, theo_ccs, theo_rt]:
+        con.execute(tbl)
+    src = connect(os.path.join(os.path.dirname(__file__), '..', 'identification', 'lipids.db'))
+    con.executemany('INSERT INTO measured VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                    src.execute('SELECT * FROM measured').fetchall())
+    con.executemany('INSERT INTO predicted_mz VALUES (?,?,?,?,?,?,?,?,?)',
+                    src.execute('SELECT * FROM predicted_mz').fetchall())
+    src.close()
+    return con
+
+
+def build_stage_input_hash_real1():
+    """
+build_stage_input_hash_real1
+    description:
+        Copies the measured and predicted_mz tables from lipids.db into an in-memory database and computes the input
+        hashes for all of the build stages, then changes a retention time in the measured table and computes them
+        again
+
+        Test fails if there are any errors, if the hashes are not reproducible, or if the change in the measured data
+        does not change the hashes of exactly the stages that read it (and only those stages)
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    con = _stage_hash_db()
+    cur = con.cursor()
+    stages = get_stages()
+    hashes1 = [stage_input_hash(stage, cur) for stage in stages]
+    if hashes1 != [stage_input_hash(stage, cur) for stage in stages]:
+        return False
+    cur.execute('UPDATE measured SET rt = rt + 0.1 WHERE m_id = (SELECT MIN(m_id) FROM measured WHERE rt IS NOT NULL)')
+    changed = [stage['name'] for stage, h in zip(stages, hashes1) if stage_input_hash(stage, cur) != h]
+    con.close()
+    return changed == ['characterize_lipid_ccs_pred', 'train_lipid_rt_pred', 'characterize_lipid_rt_pred',
+                       'index_database']
+
+
+def build_stage_inputs_changed_real1():
+    """
+build_stage_inputs_changed_real1
+    description:
+        Computes the input hashes for all of the build stages (using the measured and predicted_mz tables from
+        lipids.db) as if from a previous build, then changes the contents of each of the source files that the CCS and
+        RT models are trained and exported with (featurization.py, compact_models.py, ../util.py) and changes the
+        charge of one of the lipids in the predicted_mz table
+
+        Test fails if there are any errors, or if the stages that depend on any of the changed inputs would still be
+        skipped (i.e. their input hashes are the same as from the previous build)
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    con = _stage_hash_db()
+    cur = con.cursor()
+    stages = get_stages()
+    prev_hashes = {stage['name']: stage_input_hash(stage, cur) for stage in stages}
+
+    def not_skipped():
+        return [stage['name'] for stage in stages if stage_input_hash(stage, cur) != prev_hashes[stage['name']]]
+
+    train_stages = ['train_lipid_ccs_pred', 'train_lipid_rt_pred']
+    this_dir = os.path.dirname(build_database.__file__)
+    try:
+        for fname in ['featurization.py', 'compact_models.py', '../util.py']:
+            changed_path = os.path.join(this_dir, fname)
+
+            def changed_open(path, mode='r', *args, **kwargs):
+                # same file contents, plus an extra comment at the end for the changed source file
+                f = open(path, mode, *args, **kwargs)
+                if path != changed_path:
+                    return f
+                with f:
+                    return BytesIO(f.read() + b'\n# changed\n')
+
+            build_database.open = changed_open
+            if not set(train_stages) <= set(not_skipped()):
+                return False
+    finally:
+        del build_database.open
+    if not_skipped():
+        return False
+    cur.execute('UPDATE predicted_mz SET charge = -charge WHERE t_id = (SELECT MIN(t_id) FROM predicted_mz)')
+    changed = not_skipped()
+    con.close()
+    return set(train_stages + ['index_database']) <= set(changed)
+
+
+def build_stages_charac_jobs():
+    """
+build_stages_charac_jobs
+    description:
+        Gets the build stages with different numbers of worker processes and checks the number of worker processes
+        that each of the characterization stages renders plots with
+
+        Test fails if the characterization stages together would use more worker processes than requested (or fewer
+        than one each)
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    for jobs, expected in [(1, 1), (2, 1), (3, 1), (8, 4), (9, 4)]:
+        charac = [stage for stage in get_stages(jobs=jobs) if stage['name'].startswith('characterize')]
+        if len(charac) != 2 or [stage['run'].keywords['n_jobs'] for stage in charac] != [expected, expected]:
+            return False
+    return True
+
+
+def characterize_ccs_group_data_real1():
+    """
+characterize_ccs_group_data_real1
+    description:
+        Groups the measured and predicted CCS from lipids.db for the CCS prediction performance plots, then checks a
+        selection of the groups against the measured and predicted values queried for each group individually
+
+        Test fails if there are any errors, or if any of the checked groups do not have exactly the same values
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    con = connect(os.path.join(os.path.dirname(__file__), '..', 'identification', 'lipids.db'))
+    cur = con.cursor()
+    groups = ccs_group_data(cur)
+    if len(groups) < 10:
+        return False
+    for lipid_class, adduct, fa_mod, mz_m, ccs_m, mz_t, ccs_t, mz_resid, ccs_resid in groups[::7]:
+        fam = fa_mod if fa_mod in ['o', 'p'] else None
+        qry = 'SELECT mz, ccs FROM measured WHERE lipid_class=? AND fa_mod IS ? AND adduct=? AND src_tag IN ({}) ' \
+              + 'ORDER BY m_id'
+        qry = qry.format(','.join(['?' for _ in ccs_pred_ref_dsets]))
+        meas = cur.execute(qry, (lipid_class, fam, adduct, *ccs_pred_ref_dsets)).fetchall()
+        if [(float(m), float(c)) for m, c in meas] != list(zip(mz_m, ccs_m)):
+            return False
+        qry = 'SELECT mz, ccs FROM predicted_mz JOIN predicted_ccs ON predicted_mz.t_id=predicted_ccs.t_id WHERE ' \
+              + 'lipid_class=? AND fa_mod IS ? AND adduct=? AND (mz BETWEEN ? AND ?) AND (ccs BETWEEN ? AND ?) ' \
+              + 'ORDER BY predicted_mz.t_id'
+        bounds = (int(min(mz_m)), int(max(mz_m)), int(min(ccs_m)), int(max(ccs_m)))
+        if cur.execute(qry, (lipid_class, fam, adduct, *bounds)).fetchall() != list(zip(mz_t, ccs_t)):
+            return False
+        if len(mz_resid) != len(ccs_resid) or not set(mz_resid) <= set(mz_m):
+            return False
+    con.close()
+    return True
+
+
+def _dag_stage_a(cursor, bl):
+    """ test build stage: rows for table a """
+    return {'a': [(i,) for i in range(10)]}
+
+
+def _dag_stage_b(cursor, bl):
+    """ test build stage: rows for table b, computed from table a """
+    return {'b': [(2 * x,) for x, in cursor.execute('SELECT x FROM a ORDER BY x')]}
+
+
+def _dag_stage_c(cursor, bl):
+    """ test build stage (writer): fills table c from tables a and b """
+    cursor.execute('INSERT INTO c SELECT a.x + b.x FROM a JOIN b ON b.x = 2 * a.x')
+
+
+def build_run_stages_dag():
+    """
+build_run_stages_dag
+    description:
+        Runs a small graph of build stages (two stages run on a process pool that return rows, and a writer stage that
+        depends on both of them) on a temporary database, then runs them again using the recorded input hashes
+
+        Test fails if there are any errors, if the tables are not filled correctly, or if any of the stages are not
+        skipped on the second run
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    stages = [
+        {'name': 'c', 'run': _dag_stage_c, 'deps': ['a', 'b'], 'writer': True, 'files': [], 'params': [],
+         'queries': ['SELECT * FROM b'], 'tables': [('c', 'CREATE TABLE c (x INT)')], 'img_dir': None},
+        {'name': 'b', 'run': _dag_stage_b, 'deps': ['a'], 'writer': False, 'files': [], 'params': [],
+         'queries': ['SELECT * FROM a'], 'tables': [('b', 'CREATE TABLE b (x INT)')], 'img_dir': None},
+        {'name': 'a', 'run': _dag_stage_a, 'deps': [], 'writer': False, 'files': [], 'params': [], 'queries': [],
+         'tables': [('a', 'CREATE TABLE a (x INT)')], 'img_dir': None}
+    ]
+    with TemporaryDirectory() as tmp:
+        con = connect(os.path.join(tmp, 'test.db'))
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute(build_stages)
+        build_log = os.path.join(tmp, 'build_log.txt')
+        run_stages(stages, con, build_log, {}, 'tstamp', jobs=2)
+        if [_ for _, in con.execute('SELECT x FROM c ORDER BY x')] != [3 * i for i in range(10)]:
+            return False
+        hashes = dict(con.execute('SELECT stage, input_hash FROM build_stages').fetchall())
+        if sorted(hashes) != ['a', 'b', 'c']:
+            return False
+        run_stages(stages, con, build_log, hashes, 'tstamp', jobs=2)
+        con.close()
+        with open(build_log, 'r') as f:
+            skipped = [line.split()[1] for line in f if line.startswith('skipping')]
+    return sorted(skipped) == ['a', 'b', 'c']
+
+
 def remove_potential_nonlipids_bad_esi_mode():
     """
 remove_potential_nonlipids_bad_esi_mode
@@ -326,12 +1096,33 @@ all_tests = [
     add_feature_ids_badcustom_real1,
     add_feature_ids_any_real1_tstamp,
     add_feature_ids_real1_bad_tstamp,
+    add_feature_ids_batch_real1,
+    add_feature_ids_n_jobs_real1,
+    add_feature_ids_bad_n_jobs,
+    add_feature_ids_cache_real1,
+    add_feature_ids_cache_missing_real1,
+    id_cache_lru_eviction,
+    id_cache_unwritable_path,
+    id_feat_tiered_real1,
+    id_levels_query_plans,
     predict_ccs_noerrs,
     predict_ccs_notencodable,
     predict_ccs_ignencerr,
     predict_rt_noerrs,
     predict_rt_notencodable,
     predict_rt_ignencerr,
+    featurize_batch_bit_identical,
+    predict_ccs_batch_real1,
+    predict_rt_batch_real1,
+    compact_models_parity_real1,
+    add_predicted_ccs_rt_chunked,
+    enumerate_lipid_class_array_real1,
+    enumerated_mz_rows_real1,
+    build_stage_input_hash_real1,
+    build_stage_inputs_changed_real1,
+    build_stages_charac_jobs,
+    build_run_stages_dag,
+    characterize_ccs_group_data_real1,
     remove_potential_nonlipids_bad_esi_mode,
     remove_potential_nonlipids_features_not_identified,
     remove_potential_nonlipids_features_noerr
@@ -9,7 +9,9 @@
 
 
 import os
+import warnings
 import numpy as np
+from scipy.stats import ttest_ind, f_oneway
 
 from lipydomics.test import run_tests
 from lipydomics.data import Dataset
@@ -58,6 +60,38 @@ addanovap_real1
     return dset.stats['ANOVA_{}_raw'.format('-'.join(group_names))].shape == (773,)
 
 
+def addanovap_f_oneway_reference_real1():
+    """
+addanovap_f_oneway_reference_real1
+    description:
+        Uses the raw and normalized data from real_data_1.csv (with groups of different sizes, including a group with a
+        single sample) to compute ANOVA p-values, and compares them against scipy.stats.f_oneway computed one feature at
+        a time. A few features are overwritten so that they are constant within every group, constant across all of the
+        groups, or contain a NaN.
+
+        Test fails if any of the p-values differ by more than 1e-10 (relative), or if NaNs are not in the same places
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'))
+    groups = {'A': [0, 1, 2, 3, 4, 5], 'B': [6, 8, 10, 12], 'C': [13], 'D': [14, 15, 16, 17, 18, 19]}
+    # constant across all groups, constant within each group, NaN in one sample
+    dset.intensities[0] = 3.
+    dset.intensities[1] = [1. if i in groups['B'] else 2. for i in range(dset.n_samples)]
+    dset.intensities[2, 0] = np.nan
+    dset.assign_groups(groups)
+    dset.normalize(np.linspace(0.5, 1.5, 20))
+    for normed in [False, True]:
+        add_anova_p(dset, list(groups), normed=normed)
+        anova_p = dset.stats['ANOVA_A-B-C-D_{}'.format('normed' if normed else 'raw')]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ref = np.array([f_oneway(*x).pvalue for x in zip(*dset.get_data_bygroup(list(groups), normed=normed))])
+        if not np.allclose(anova_p, ref, rtol=1e-10, atol=0., equal_nan=True):
+            return False
+    return True
+
+
 def addpca3_mock1():
     """
 addpca3_mock1
@@ -402,10 +436,51 @@ add2grouppvalue_real1
     return True
 
 
+def group_stats_reference_real1():
+    """
+group_stats_reference_real1
+    description:
+        Uses the raw and normalized data from real_data_1.csv (with groups of different sizes) to compute log2(fold-
+        change) and Student's/Welch's t-test p-values, which are derived from the per-group summary statistics cached in
+        the Dataset, and compares them against values computed directly from the group data with numpy and scipy
+
+        Test fails if any of the values differ by more than 1e-12 (relative), or if the per-group summary statistics are
+        not computed just once for each group
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    dset = Dataset(os.path.join(os.path.dirname(__file__), 'real_data_1.csv'))
+    dset.assign_groups({'A': [0, 1, 2, 3], 'B': [4, 5, 6, 7, 8, 9], 'C': [10, 12, 14], 'D': [11, 13, 15, 17, 19]})
+    dset.normalize(np.linspace(0.5, 1.5, 20))
+    pairs = [['A', 'B'], ['A', 'C'], ['B', 'D'], ['C', 'D']]
+    for normed in [False, True]:
+        nrm = 'normed' if normed else 'raw'
+        for pair in pairs:
+            A, B = dset.get_data_bygroup(pair, normed=normed)
+            add_log2fc(dset, pair, normed=normed)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ref = np.log2(np.mean(B, axis=1) / np.mean(A, axis=1))
+            if not np.allclose(dset.stats['LOG2FC_{}_{}'.format('-'.join(pair), nrm)], ref, rtol=1e-12, atol=0.,
+                               equal_nan=True):
+                return False
+            for stats_test, abbrev in [('students', 'studentsP'), ('welchs', 'welchsP')]:
+                add_2group_pvalue(dset, pair, stats_test, normed=normed)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ref = np.nan_to_num(ttest_ind(A, B, axis=1, equal_var=stats_test == 'students')[1], nan=1.)
+                if not np.allclose(dset.stats['{}_{}_{}'.format(abbrev, '-'.join(pair), nrm)], ref, rtol=1e-12,
+                                   atol=0.):
+                    return False
+    # every group was used in several comparisons but the summary statistics should only be computed once
+    stats_a = dset.get_group_stats('A')
+    add_log2fc(dset, ['A', 'D'])
+    return dset.get_group_stats('A') is stats_a
+
+
 # references to al of the test functions to be run, and order to run them in
 all_tests = [
     addanovap_mock1,
     addanovap_real1,
+    addanovap_f_oneway_reference_real1,
     addpca3_mock1,
     addpca3_real1,
     addplsda_mock1,
@@ -416,7 +491,8 @@ all_tests = [
     add2groupcorr_real1,
     addplsra_real1,
     addlog2fc_real1,
-    add2grouppvalue_real1
+    add2grouppvalue_real1,
+    group_stats_reference_real1
 ]
 if __name__ == '__main__':
     run_tests(all_tests)
@@ -9,12 +9,16 @@
 
 
 import os
+import sys
+import subprocess
 
 from lipydomics.test import run_tests
 from lipydomics.data import Dataset
 from lipydomics.stats import add_log2fc
 from lipydomics.identification import add_feature_ids
-from lipydomics.util import abbreviate_sheet, fetch_lipid_class_log2fc
+from numpy import nan, sqrt
+
+from lipydomics.util import abbreviate_sheet, fetch_lipid_class_log2fc, get_score, get_scores
 
 
 def abbrev_xl_sheet_names():
@@ -83,10 +87,67 @@ fetch_lipid_class_log2fa_real1
     return nc is not None and nu is not None and log2fa is not None
 
 
+def get_scores_block():
+    """
+get_scores_block
+    description:
+        Computes scores for a block of potential matches (some with missing rt or CCS) using get_scores and compares
+        them against scores computed one candidate at a time, with both the l1 and l2 norms and with different
+        combinations of m/z, rt and CCS used. Also checks that get_score treats a retention time of 0.0 as a real
+        value rather than a missing one.
+
+        Test fails if any of the scores do not match, or if the retention time of 0.0 is ignored
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    x = [(700.5301, 5.21, 270.4), (700.5197, nan, 275.0), (700.5312, 5.50, nan), (700.5287, 5.33, 271.8)]
+    tol = (0.05, 1.5, 10.)
+    for norm in ['l1', 'l2']:
+        for q in [(700.5287, nan, nan), (700.5287, 5.33, nan), (700.5287, nan, 271.8), (700.5287, 5.33, 271.8)]:
+            scores = get_scores(q, x, tol, norm=norm).tolist()
+            for score, x_ in zip(scores, x):
+                # reference score computed one candidate at a time
+                rn = [(x__ - q_) / tol_ for q_, x__, tol_ in zip(q, x_, tol) if q_ == q_ and x__ == x__]
+                if norm == 'l1' or len(rn) == 1:
+                    ref = 1. / max(sum([abs(_) for _ in rn]), 0.000001)
+                else:
+                    ref = 1. / max(sqrt(sum([_ * _ for _ in rn])), 0.000001)
+                if abs(score - ref) > 1e-9 * ref:
+                    return False
+    # rt of 0.0 is a real value
+    if get_score(*tol, mz_q=700.5, rt_q=0.0, mz_x=700.5, rt_x=0.75) != 2.:
+        return False
+    return True
+
+
+def import_heavy_deps_deferred():
+    """
+import_heavy_deps_deferred
+    description:
+        Imports each of the main lipydomics modules in a fresh interpreter and checks which of the heavy dependencies
+        (pandas, scipy, sklearn, and matplotlib) were imported along with it. These should only get imported when they
+        are first used. (The time it takes to import each module is measured in lipydomics/test/benchmark.py)
+
+        Test fails if any heavy dependencies are imported
+    returns:
+        (bool) -- test pass (True) or fail (False)
+"""
+    heavy = ['pandas', 'scipy', 'sklearn', 'matplotlib']
+    for module in ['lipydomics.data', 'lipydomics.stats', 'lipydomics.plotting', 'lipydomics.identification']:
+        code = 'import sys, {}; print(*[_ for _ in {} if _ in sys.modules])'.format(module, heavy)
+        proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        if proc.stdout.strip():
+            print('\n{} imported: {}'.format(module, proc.stdout.strip()), end=' ')
+            return False
+    return True
+
+
 # references to al of the test functions to be run, and order to run them in
 all_tests = [
     abbrev_xl_sheet_names,
-    fetch_lipid_class_log2fa_real1
+    fetch_lipid_class_log2fa_real1,
+    get_scores_block,
+    import_heavy_deps_deferred
 ]
 if __name__ == '__main__':
     run_tests(all_tests)
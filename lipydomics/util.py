@@ -8,7 +8,7 @@
 """
 
 import re
-from numpy import sqrt, nan, inf, mean, abs, array
+from numpy import sqrt, nan, inf, mean, abs, array, isnan, where, maximum
 from datetime import datetime
 
 
@@ -72,6 +72,47 @@ filter_d
     return filtered
 
 
+def get_scores(q, x, tol, norm='l2'):
+    """
+get_scores
+    description:
+        computes scores reflecting the quality of identifications for a whole block of potential matches at once,
+        using mz rt and ccs or any combination
+
+        The scores are determined by the residuals between the query values (q) and the potential matches (x),
+        normalized by their respective tolerances. Values that are missing (NaN) in either q or x are masked out. If
+        only a single pair of values (q and x) is available, the score is simply the inverse of the normalized
+        residual, otherwise, it is the inverse of the l1 or l2 norm of the normalized residuals vector. The norm kwarg
+        controls whether the l1 or l2 norm is used in computing the scores
+    parameters:
+        q (numpy.ndarray(float)) -- query m/z, rt, and CCS (NaN for any that are not used), shape = (3,) for a single
+                                    query or (n_matches, 3) for a query per potential match
+        x (numpy.ndarray(float)) -- m/z, rt, and CCS of the potential matches (NaN if missing), shape = (n_matches, 3)
+        tol (numpy.ndarray(float)) -- tolerances for m/z, rt, and CCS, shape = (3,) or (n_matches, 3)
+        [norm (str)] -- specify l1 or l2 norm [optional, default='l2']
+    returns:
+        (numpy.ndarray(float)) -- scores (higher = more confidence in ID), shape = (n_matches,)
+"""
+    q, x, tol = array(q, dtype=float), array(x, dtype=float).reshape(-1, 3), array(tol, dtype=float)
+    # compute the normalized residuals, masking out the missing values
+    valid = ~isnan(q) & ~isnan(x)
+    rn = where(valid, (x - q) / tol, 0.)
+    n_valid = valid.sum(axis=1)
+    if (n_valid == 0).any():
+        m = 'get_scores: unable to compute residuals'
+        raise RuntimeError(m)
+    if norm == 'l1':
+        # the masked residuals are 0 so this is also the absolute value when there is only a single value
+        d = abs(rn[:, 0]) + abs(rn[:, 1]) + abs(rn[:, 2])
+    elif norm == 'l2' or (n_valid == 1).all():
+        # and the square root of the square is exactly the absolute value
+        d = sqrt(rn[:, 0] * rn[:, 0] + rn[:, 1] * rn[:, 1] + rn[:, 2] * rn[:, 2])
+    else:
+        m = 'get_scores: norm method "{}" not recognized'
+        raise ValueError(m.format(norm))
+    return 1. / maximum(d, 0.000001)  # prevent zero-division just in case ...
+
+
 def get_score(tol_mz, tol_rt, tol_ccs, mz_q=None, rt_q=None, ccs_q=None, mz_x=None, rt_x=None, ccs_x=None, norm='l2'):
     """
 get_score
@@ -82,43 +123,26 @@ get_score
         their respective tolerances. If only a single pair of values (q and x) is provided, the score is simply the
         inverse of the normalized residual, otherwise, it is the inverse of the l1 or l2 norm of the normalized
         residuals vector. The norm kwarg controls whether the l1 or l2 norm is used in computing the score
+
+        (single potential match version of get_scores)
     parameters:
-        cursor (sqlite3.Cursor) -- cursor for querying lipids.db
         tol_mz (float) -- tolerance for m/z
         tol_rt (float) -- tolerance for retention time
         tol_ccs (float) -- tolerance for CCS
         [mz_q (None or float)] -- if specified, the query m/z [optional, default=None]
         [rt_q (None or float)] -- if specified, the query retention time [optional, default=None]
         [ccs_q (None or float)] -- if specified, the query CCS [optional, default=None]
-        [mz_q (None or float)] -- if specified, the m/z of a potential match [optional, default=None]
-        [rt_q (None or float)] -- if specified, the retention time of a potential match [optional, default=None]
-        [ccs_q (None or float)] -- if specified, the CCS of a potential match [optional, default=None]
+        [mz_x (None or float)] -- if specified, the m/z of a potential match [optional, default=None]
+        [rt_x (None or float)] -- if specified, the retention time of a potential match [optional, default=None]
+        [ccs_x (None or float)] -- if specified, the CCS of a potential match [optional, default=None]
         [norm (str)] -- specify l1 or l2 norm [optional, default='l2']
     returns:
         (float) -- score (higher = more confidence in ID)
 """
-    q = [mz_q, rt_q, ccs_q]
-    x = [mz_x, rt_x, ccs_x]
-    tol = [tol_mz, tol_rt, tol_ccs]
-    # compute the normalized residuals
-    rn = []
-    for q_, x_, tol_ in zip(q, x, tol):
-        if q_ and x_:
-            rn.append((x_ - q_) / tol_)
-    # if there was only a single value, just return the inverse of the absolute value
-    if not rn:
-        m = 'get_score: unable to compute residuals'
-        raise RuntimeError(m)
-    elif len(rn) == 1:
-        return 1. / max(abs(rn[0]), 0.000001)  # prevent zero-division just in case ...
-    else:
-        if norm == 'l1':
-            return 1. / max(sum([abs(_) for _ in rn]), 0.000001)  # prevent zero-division just in case ...
-        elif norm == 'l2':
-            return 1. / max(sqrt(sum([_**2. for _ in rn])), 0.000001)  # prevent zero-division just in case ...
-        else:
-            m = 'get_score: norm method "{}" not recognized'
-            raise ValueError(m.format(norm))
+    q = [nan if _ is None else _ for _ in [mz_q, rt_q, ccs_q]]
+    x = [nan if _ is None else _ for _ in [mz_x, rt_x, ccs_x]]
+    tol = [nan if _ is None else _ for _ in [tol_mz, tol_rt, tol_ccs]]
+    return float(get_scores(q, x, tol, norm=norm)[0])
 
 
 def parse_lipid(name):